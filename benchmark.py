@@ -0,0 +1,110 @@
+"""Benchmarks of the MOT file loading and the parallel evaluation.
+
+Usage: python benchmark.py [--benchmark loaders|pickling] [--gt_folder GT_FOLDER] [--tracker_folder TRACKER_FOLDER]
+                           [--dataset DATASET] [--dataset_gt_folder FOLDER] [--dataset_trackers_folder FOLDER]
+                           [--repeats N]
+
+loaders: compares the row-by-row csv loader (_BaseDataset._load_simple_text_file) with the vectorized numpy loader
+    (mot_rows.read_rows) on the gt and tracker files of the seven MOT16 train sequences, checking that both give
+    identical rows.
+pickling: compares the data pickled to send parallel evaluation tasks to the workers, when every task carries the
+    dataset and metrics (as a partial of eval_sequence, as before) and when they are only sent once to each worker by
+    the pool initializer (eval.init_worker) and tasks only carry (tracker, seq). The dataset is any dataset class of
+    trackeval.datasets (e.g. TAO, whose annotations make it very large), with its default config and the given
+    folders.
+"""
+import os
+import pickle
+import argparse
+import timeit
+from functools import partial
+import numpy as np
+import trackeval
+from trackeval import utils
+from trackeval import eval as trackeval_eval
+from trackeval.datasets import mot_rows
+from trackeval.datasets._base_dataset import _BaseDataset
+
+MOT16_TRAIN_SEQS = ['MOT16-02', 'MOT16-04', 'MOT16-05', 'MOT16-09', 'MOT16-10', 'MOT16-11', 'MOT16-13']
+
+
+def load_with_csv_reader(file):
+    read_data, _ = _BaseDataset._load_simple_text_file(file)
+    return mot_rows.rows_from_read_data(read_data)
+
+
+def benchmark_loaders(gt_folder, tracker_folder, repeats):
+    print('%-10s %-8s %8s %12s %12s %8s' % ('seq', 'file', 'rows', 'csv (ms)', 'numpy (ms)', 'speedup'))
+    for seq in MOT16_TRAIN_SEQS:
+        files = [('gt', os.path.join(gt_folder, seq, 'gt', 'gt.txt')),
+                 ('tracker', os.path.join(tracker_folder, seq + '.txt'))]
+        for name, file in files:
+            if not os.path.isfile(file):
+                print('%-10s %-8s not found: %s' % (seq, name, file))
+                continue
+            rows = mot_rows.read_rows(file)
+            if not np.array_equal(rows, load_with_csv_reader(file)):
+                raise utils.TrackEvalException('Loaders give different rows for ' + file)
+            csv_time = min(timeit.repeat(lambda: load_with_csv_reader(file), number=1, repeat=repeats))
+            numpy_time = min(timeit.repeat(lambda: mot_rows.read_rows(file), number=1, repeat=repeats))
+            print('%-10s %-8s %8i %12.2f %12.2f %7.1fx' % (seq, name, len(rows), 1000 * csv_time, 1000 * numpy_time,
+                                                          csv_time / numpy_time))
+
+
+def benchmark_pickling(dataset_name, gt_folder, trackers_folder, num_workers, repeats):
+    dataset_class = getattr(trackeval.datasets, dataset_name)
+    dataset_config = dataset_class.get_default_dataset_config()
+    dataset_config['PRINT_CONFIG'] = False
+    if gt_folder is not None:
+        dataset_config['GT_FOLDER'] = gt_folder
+    if trackers_folder is not None:
+        dataset_config['TRACKERS_FOLDER'] = trackers_folder
+    dataset = dataset_class(dataset_config)
+    metrics_config = {'THRESHOLD': 0.5, 'PRINT_CONFIG': False}
+    metrics_list = [trackeval.metrics.HOTA(metrics_config), trackeval.metrics.CLEAR(metrics_config),
+                    trackeval.metrics.Identity(metrics_config), trackeval.metrics.Count()]
+    metric_names = utils.validate_metrics_list(metrics_list)
+    tracker_list, seq_list, class_list = dataset.get_eval_info()
+    tasks = [(tracker, seq) for seq in sorted(seq_list) for tracker in tracker_list]
+
+    def pickle_task_with_dataset(task):
+        tracker, seq = task
+        return pickle.dumps((partial(trackeval_eval.eval_sequence, dataset=dataset, tracker=tracker,
+                                     class_list=class_list, metrics_list=metrics_list, metric_names=metric_names), seq))
+
+    def pickle_initargs():
+        return pickle.dumps((dataset, class_list, metrics_list, metric_names))
+
+    # Before: the dataset and metrics are pickled with every task. After: they are pickled once per worker (when
+    # workers are not forked), and tasks only carry (tracker, seq).
+    before_bytes = sum(len(pickle_task_with_dataset(task)) for task in tasks)
+    before_time = min(timeit.repeat(lambda: [pickle_task_with_dataset(task) for task in tasks], number=1,
+                                    repeat=repeats))
+    after_bytes = num_workers * len(pickle_initargs()) + sum(len(pickle.dumps(task)) for task in tasks)
+    after_time = min(timeit.repeat(lambda: ([pickle_initargs() for _ in range(num_workers)]
+                                            + [pickle.dumps(task) for task in tasks]), number=1, repeat=repeats))
+    print('%s: %i tasks (%i trackers x %i sequences), %i workers' % (dataset_name, len(tasks), len(tracker_list),
+                                                                     len(seq_list), num_workers))
+    print('%-32s %14s %12s' % ('', 'pickled (MB)', 'time (ms)'))
+    print('%-32s %14.2f %12.2f' % ('dataset and metrics per task', before_bytes / 1e6, 1000 * before_time))
+    print('%-32s %14.2f %12.2f' % ('dataset and metrics per worker', after_bytes / 1e6, 1000 * after_time))
+
+
+if __name__ == '__main__':
+    code_path = utils.get_code_path()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--benchmark', choices=['loaders', 'pickling'], default='loaders')
+    parser.add_argument('--gt_folder', default=os.path.join(code_path, 'data/gt/mot_challenge/MOT16-train'))
+    parser.add_argument('--tracker_folder',
+                        default=os.path.join(code_path, 'data/trackers/mot_challenge/MOT16-train/MPNTrack/data'))
+    parser.add_argument('--dataset', default='TAO')
+    parser.add_argument('--dataset_gt_folder', default=None)
+    parser.add_argument('--dataset_trackers_folder', default=None)
+    parser.add_argument('--num_workers', type=int, default=8)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+    if args.benchmark == 'loaders':
+        benchmark_loaders(args.gt_folder, args.tracker_folder, args.repeats)
+    else:
+        benchmark_pickling(args.dataset, args.dataset_gt_folder, args.dataset_trackers_folder, args.num_workers,
+                           args.repeats)
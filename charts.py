@@ -1,7 +1,7 @@
 '''
-This file contains helper functions to create different bar charts using Pyecharts.
+This file contains helper functions to create different bar and line charts using Pyecharts.
 '''
-from pyecharts.charts import Bar
+from pyecharts.charts import Bar, Line
 from pyecharts import options as opts
 import streamlit as st
 import streamlit.components.v1 as components
@@ -18,4 +18,43 @@ def create_bar_chart(data, title, bar_color = '#5470c6'):
     )
     # display x and y axis labels
     bar.set_series_opts(label_opts=opts.LabelOpts(is_show=True))
-    return bar.render_embed()
\ No newline at end of file
+    return bar.render_embed()
+
+# Helper function to create a line chart of metrics over sliding windows of frames (see run_timeline_evaluation)
+def create_line_chart(timeline, title, colors = ('#5470C6', '#91CC75', '#EE6666')):
+    line = Line()
+    line.add_xaxis([f'{t0}-{t1}' for t0, t1 in timeline['windows']])
+    fields = [field for field in timeline.keys() if field != 'windows']
+    for field, color in zip(fields, colors):
+        line.add_yaxis(field, timeline[field], is_symbol_show=False, itemstyle_opts=opts.ItemStyleOpts(color=color),
+                       label_opts=opts.LabelOpts(is_show=False))
+    line.set_global_opts(
+        title_opts=opts.TitleOpts(title=title),
+        tooltip_opts=opts.TooltipOpts(trigger='axis'),
+        xaxis_opts=opts.AxisOpts(name='Frames'),
+        yaxis_opts=opts.AxisOpts(name='Score'),
+        datazoom_opts=[opts.DataZoomOpts()]  # zoom into a part of the sequence
+    )
+    return line.render_embed()
+
+# Display the charts of the evaluation results of run_evaluation
+def show_category_charts(result):
+    tracking_chart = create_bar_chart(result['HOTA'], "Tracking Quality (HOTA)", "#5470C6")
+    detection_chart = create_bar_chart(result['CLEAR'], "Detection Quality (CLEAR)", "#91CC75")
+    identification_chart = create_bar_chart(result['Identity'], "Identification Quality (Identity)", "#EE6666")
+    VACE_chart = create_bar_chart(result['VACE'], "VACE", "#fac858")
+    count_chart = create_bar_chart(result['COUNT'], "Count", "#73c0de")
+
+    components.html(tracking_chart, height=600)
+    components.html(detection_chart, height=600)
+    components.html(identification_chart, height=600)
+    components.html(VACE_chart, height=600)
+    components.html(count_chart, height=600)
+
+# Display the charts of the combined sequences and of each sequence, for the evaluation results of run_zip_evaluation
+def show_sequence_charts(results):
+    seqs = list(results.keys())
+    tabs = st.tabs(['All sequences' if seq == 'COMBINED_SEQ' else seq for seq in seqs])
+    for tab, seq in zip(tabs, seqs):
+        with tab:
+            show_category_charts(results[seq])
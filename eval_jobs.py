@@ -0,0 +1,120 @@
+'''
+This file contains a background job manager to run evaluations without blocking the Streamlit apps.
+'''
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Job status values
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+class EvaluationJobs:
+    """
+    Runs evaluation jobs in a background thread pool, so that the Streamlit script run is never blocked by them.
+    Jobs are identified by increasing job ids, and each job belongs to a channel (e.g. the evaluation shown in one
+    browser session). Submitting a job to a channel supersedes the previous job of the channel: it is cancelled if it
+    has not started yet, and its result is dropped otherwise. When a slider is dragged, only the range being evaluated
+    and the latest requested range are therefore computed, instead of queueing a full evaluation for every change.
+
+    A job which is already running cannot be interrupted: when it is superseded or cancelled, it still runs to the end
+    (keeping its worker busy) and only its result is dropped. The pool has several workers by default (as many as
+    ThreadPoolExecutor uses, min(32, CPUs + 4)), so that the long jobs of one channel (e.g. a zip or timeline
+    evaluation) do not hold up the jobs of all other channels.
+
+    Channels are never closed (browser sessions end without notice), so finished jobs whose status or result has not
+    been asked for max_idle seconds are dropped together with their result, as if they were cancelled.
+    """
+
+    def __init__(self, max_workers=None, max_idle=30 * 60):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='evaluation')
+        self._job_ids = itertools.count(1)
+        self._jobs = {}  # job id: future of the latest job of each channel
+        self._latest_job_ids = {}  # channel: latest job id
+        self._job_channels = {}  # job id: channel
+        self._last_used = {}  # job id: time the job was last submitted or asked for
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+
+    def submit(self, channel, fn, *args, **kwargs):
+        """
+        Submit fn(*args, **kwargs) as the latest job of a channel, superseding its previous job
+        Args:
+            channel (str): The channel of the job (e.g. an id of the browser session)
+            fn (callable): The function to run in the background
+        Returns:
+            int: The id of the job
+        """
+        with self._lock:
+            self._drop_idle_jobs()
+            self._cancel(channel)
+            job_id = next(self._job_ids)
+            self._jobs[job_id] = self._executor.submit(fn, *args, **kwargs)
+            self._latest_job_ids[channel] = job_id
+            self._job_channels[job_id] = channel
+            self._last_used[job_id] = time.monotonic()
+        return job_id
+
+    def cancel(self, channel):
+        """Cancel the latest job of a channel if it has not started yet, or drop its result once it is finished"""
+        with self._lock:
+            self._cancel(channel)
+
+    def _cancel(self, channel):
+        job_id = self._latest_job_ids.pop(channel, None)
+        if job_id is not None:
+            self._jobs.pop(job_id).cancel()
+            del self._job_channels[job_id]
+            del self._last_used[job_id]
+
+    def _drop_idle_jobs(self):
+        min_time = time.monotonic() - self.max_idle
+        idle_job_ids = [job_id for job_id, last_used in self._last_used.items()
+                        if last_used < min_time and self._jobs[job_id].done()]
+        for job_id in idle_job_ids:
+            self._cancel(self._job_channels[job_id])
+
+    def _get_job(self, job_id):
+        future = self._jobs.get(job_id)
+        if future is not None:
+            self._last_used[job_id] = time.monotonic()
+        return future
+
+    def latest_job_id(self, channel):
+        """Return the id of the latest job of a channel, or None if it has no job"""
+        with self._lock:
+            return self._latest_job_ids.get(channel)
+
+    def status(self, job_id):
+        """Return the status of a job: PENDING, RUNNING, DONE, FAILED or CANCELLED (also for superseded jobs)"""
+        with self._lock:
+            future = self._get_job(job_id)
+        if future is None or future.cancelled():
+            return CANCELLED
+        if not future.done():
+            return RUNNING if future.running() else PENDING
+        return FAILED if future.exception() is not None else DONE
+
+    def result(self, job_id):
+        """Return the result of a finished job, raising the exception of a failed job"""
+        with self._lock:
+            future = self._get_job(job_id)
+        if future is None:
+            raise KeyError(job_id)
+        return future.result(timeout=0)
+
+    def shutdown(self):
+        """Cancel all pending jobs and stop the worker threads once the running jobs are finished"""
+        with self._lock:
+            for future in self._jobs.values():
+                future.cancel()
+            self._jobs.clear()
+            self._latest_job_ids.clear()
+            self._job_channels.clear()
+            self._last_used.clear()
+        self._executor.shutdown(wait=False)
@@ -1,38 +1,13 @@
 import os
 from multiprocessing import freeze_support
-import shutil
-import tempfile
-import configparser
 import json
 import trackeval 
 
-def filter_frames(input_file, t0, t1):
-    """ 
-    Filter frames in a file based on the frame number
-    Args:
-        input_file (str): The path to the input file
-        t0 (int): The start frame number
-        t1 (int): The end frame number
-    """
-    # Create a temporary file
-    temp_fd, temp_path = tempfile.mkstemp()
-    try:
-        with open(input_file, 'r') as f, os.fdopen(temp_fd, 'w') as out:
-            for line in f:
-                frame_number = int(line.split(',')[0])
-                if t0 <= frame_number <= t1:
-                    out.write(line)
-        
-        # Replace the original file with the temporary file
-        shutil.move(temp_path, input_file)
-    except Exception as e:
-        print("An error occurred:", e)
-        os.remove(temp_path)
-        raise
-    finally:
-        # Ensure that the temp file is removed if it wasn't moved
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
+# Sequences of the MOT16 train set
+MOT16_TRAIN_SEQUENCES = ['MOT16-02', 'MOT16-04', 'MOT16-05', 'MOT16-09', 'MOT16-10', 'MOT16-11', 'MOT16-13']
+
+# Summary field shown over time for each metric (see run_timeline_evaluation)
+TIMELINE_FIELDS = {'HOTA': 'HOTA', 'CLEAR': 'MOTA', 'Identity': 'IDF1'}
 
 def allowed_file(filename):
     """ Check if the uploaded file is allowed by its extension 
@@ -44,51 +19,202 @@ def allowed_file(filename):
     allowed_extensions = {'txt'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
-def run_evaluation(t0, t1, SEQ_INFO = 'MOT16-02', uploaded_txt_dir = 'data/trackers/mot_challenge/MOT16-train/MPNTrack/data/MOT16-02.txt'):
+def get_category_results(res, metrics_list, cls='pedestrian', seq='COMBINED_SEQ'):
+    """
+    Group the summary results of a tracker by metric, directly from the results returned by Evaluator.evaluate
+    Args:
+        res (dict): The results of a single tracker, indexed like res[seq][cls][metric_name][field]
+        metrics_list (list): The metrics that were evaluated (Count is always added by the evaluator)
+        cls (str): The class to summarise
+        seq (str): The sequence to summarise ('COMBINED_SEQ' for all sequences together)
+    Returns:
+        dict: A dictionary of summary values for each category ('HOTA', 'CLEAR', 'Identity', 'VACE', 'COUNT')
+    """
+    category_dicts = {}
+    for metric in metrics_list + [trackeval.metrics.Count()]:
+        # summary_results gives the same (formatted) values as the pedestrian_summary.txt file (it summarises the
+        # results given as 'COMBINED_SEQ', which can be those of any sequence)
+        table_res = {'COMBINED_SEQ': res[seq][cls][metric.get_name()]}
+        category = 'COUNT' if metric.get_name() == 'Count' else metric.get_name()
+        category_dicts[category] = {key: float(value) for key, value in metric.summary_results(table_res).items()}
+    return category_dicts
+
+def run_evaluation(t0, t1, SEQ_INFO = 'MOT16-02', uploaded_txt_dir = 'data/trackers/mot_challenge/MOT16-train/MPNTrack/data/MOT16-02.txt', uploaded_rows = None):
     """
     Run the evaluation process
     Args:
         t0 (int): The start frame number
         t1 (int): The end frame number
         uploaded_txt_dir (str): The path to the uploaded txt file
+        uploaded_rows (np.ndarray): The already parsed rows of the uploaded txt file (see upload_ingest), evaluated
+            instead of uploaded_txt_dir if given
         SEQ_INFO (str): The sequence information
     Returns:
         dict: A dictionary containing the evaluation results
     """
+    # Basic Argument
+    TRACKERS_TO_EVAL = ['MPNTrack']
+    USE_PARALLEL = False
+    NUM_PARALLEL_CORES = 1
+
+    # modify SEQ info format for the config, the sequence length is read from its seqinfo.ini
+    seq_info = SEQ_INFO
+    SEQ_INFO = {SEQ_INFO: None}
+
+    arg_dic = {'TRACKERS_TO_EVAL': TRACKERS_TO_EVAL, 'USE_PARALLEL': USE_PARALLEL,
+               'NUM_PARALLEL_CORES': NUM_PARALLEL_CORES, 'SEQ_INFO': SEQ_INFO}
+
+    # Only frames [t0, t1] are evaluated. The GT and tracker files are parsed once and kept in memory by the dataset,
+    # which slices the frame window from them directly (no copies of the GT or tracker folders are made).
+    if t0 is not None and t1 is not None:
+        arg_dic['t0'] = t0
+        arg_dic['t1'] = t1
+
+    # if upload txt file, evaluate it in place of the tracker file in the tracker folder
+    if uploaded_rows is not None:
+        arg_dic['TRACKER_ROWS'] = {TRACKERS_TO_EVAL[0]: {seq_info: uploaded_rows}}
+    elif uploaded_txt_dir:
+        arg_dic['TRACKER_FILES'] = {TRACKERS_TO_EVAL[0]: {seq_info: uploaded_txt_dir}}
+
+    tracker_res, metrics_list = _run_evaluator(arg_dic)
+    return get_category_results(tracker_res, metrics_list)
+
+def run_zip_evaluation(uploaded_zip, seq_list = MOT16_TRAIN_SEQUENCES, num_parallel_cores = None):
+    """
+    Evaluate the results of several sequences together, read directly from an uploaded zip file (without extracting it).
+    The worker processes are spawned rather than forked, as this is run from a thread of the app.
+    Args:
+        uploaded_zip (str): The path to the uploaded zip file, holding a MOT16-XX.txt file for each sequence
+        seq_list (list): The sequences to evaluate (all frames of each)
+        num_parallel_cores (int): The number of processes evaluating sequences in parallel (if None, one per sequence
+            up to the number of CPUs)
+    Returns:
+        dict: The evaluation results (as returned by run_evaluation) of the combined sequences ('COMBINED_SEQ') and of
+            each sequence
+    """
+    TRACKERS_TO_EVAL = ['MPNTrack']
+    if num_parallel_cores is None:
+        num_parallel_cores = min(len(seq_list), os.cpu_count() or 1)
+
+    arg_dic = {'TRACKERS_TO_EVAL': TRACKERS_TO_EVAL, 'USE_PARALLEL': num_parallel_cores > 1,
+               'NUM_PARALLEL_CORES': num_parallel_cores, 'PARALLEL_START_METHOD': 'spawn',
+               'SEQ_INFO': {seq: None for seq in seq_list},
+               'TRACKER_ZIP_FILES': {TRACKERS_TO_EVAL[0]: uploaded_zip}}
+
+    tracker_res, metrics_list = _run_evaluator(arg_dic)
+    return {seq: get_category_results(tracker_res, metrics_list, seq=seq) for seq in ['COMBINED_SEQ'] + list(seq_list)}
+
+def run_timeline_evaluation(SEQ_INFO = 'MOT16-02', window = 100, stride = 10, uploaded_txt_dir = 'data/trackers/mot_challenge/MOT16-train/MPNTrack/data/MOT16-02.txt', uploaded_rows = None):
+    """
+    Compute HOTA, MOTA and IDF1 over sliding windows of frames across a whole sequence. The sequence is loaded,
+    preprocessed and matched once, and each window is then scored from the per-frame statistics of the metrics (see
+    trackeval.metrics.FrameIndex), which are shared by all overlapping windows, instead of running the evaluation once
+    per window. IDF1 is exact, HOTA and MOTA use the matches of the whole sequence (see FrameIndex).
+    Args:
+        SEQ_INFO (str): The sequence information
+        window (int): The number of frames of each window
+        stride (int): The number of frames between the starts of two consecutive windows
+        uploaded_txt_dir (str): The path to the uploaded txt file
+        uploaded_rows (np.ndarray): The already parsed rows of the uploaded txt file, evaluated instead of
+            uploaded_txt_dir if given
+    Returns:
+        dict: The (t0, t1) frames of each window ('windows') and the 'HOTA', 'MOTA' and 'IDF1' of each window
+    """
+    TRACKERS_TO_EVAL = ['MPNTrack']
+    arg_dic = {'TRACKERS_TO_EVAL': TRACKERS_TO_EVAL, 'SEQ_INFO': {SEQ_INFO: None},
+               'METRICS': list(TIMELINE_FIELDS.keys())}
+    if uploaded_rows is not None:
+        arg_dic['TRACKER_ROWS'] = {TRACKERS_TO_EVAL[0]: {SEQ_INFO: uploaded_rows}}
+    elif uploaded_txt_dir:
+        arg_dic['TRACKER_FILES'] = {TRACKERS_TO_EVAL[0]: {SEQ_INFO: uploaded_txt_dir}}
+
+    data, metrics_list = _get_seq_data(arg_dic)
+    index = trackeval.metrics.FrameIndex(data, metrics_list)
+
+    num_frames = index.num_timesteps
+    window = max(1, min(window, num_frames))
+    timeline = {'windows': [], **{field: [] for field in TIMELINE_FIELDS.values()}}
+    for t0 in range(1, num_frames - window + 2, max(1, stride)):
+        t1 = t0 + window - 1
+        window_res = index.eval_window(t0, t1)
+        timeline['windows'].append((t0, t1))
+        for metric in metrics_list:
+            # same (formatted) values as in the bar charts of run_evaluation
+            summary = metric.summary_results({'COMBINED_SEQ': window_res[metric.get_name()]})
+            field = TIMELINE_FIELDS[metric.get_name()]
+            timeline[field].append(float(summary[field]))
+    return timeline
+
+def run_event_log(SEQ_INFO = 'MOT16-02', uploaded_txt_dir = 'data/trackers/mot_challenge/MOT16-train/MPNTrack/data/MOT16-02.txt', uploaded_rows = None):
+    """
+    Record the CLEAR events of each frame of a whole sequence: FP tracker dets, FN gt dets, ID switches (with the old
+    and new tracker ids) and fragmentations (see trackeval.metrics.CLEAR, RECORD_EVENTS)
+    Args:
+        SEQ_INFO (str): The sequence information
+        uploaded_txt_dir (str): The path to the uploaded txt file
+        uploaded_rows (np.ndarray): The already parsed rows of the uploaded txt file, evaluated instead of
+            uploaded_txt_dir if given
+    Returns:
+        np.ndarray: The events as a structured array (trackeval.metrics.CLEAR.EVENT_DTYPE) sorted by timestep, where
+            timestep t is frame t + 1 and the ids are those of the gt and uploaded files
+    """
+    TRACKERS_TO_EVAL = ['MPNTrack']
+    arg_dic = {'TRACKERS_TO_EVAL': TRACKERS_TO_EVAL, 'SEQ_INFO': {SEQ_INFO: None}, 'METRICS': ['CLEAR'],
+               'RECORD_EVENTS': True}
+    if uploaded_rows is not None:
+        arg_dic['TRACKER_ROWS'] = {TRACKERS_TO_EVAL[0]: {SEQ_INFO: uploaded_rows}}
+    elif uploaded_txt_dir:
+        arg_dic['TRACKER_FILES'] = {TRACKERS_TO_EVAL[0]: {SEQ_INFO: uploaded_txt_dir}}
+
+    data, metrics_list = _get_seq_data(arg_dic)
+    return metrics_list[0].eval_sequence(data)['CLR_Events']
+
+def _get_seq_data(arg_dic):
+    """
+    Load and preprocess the pedestrian data of the single sequence and tracker of arg_dic, without the Evaluator
+    Args:
+        arg_dic (dict): Config values (of the eval, dataset or metrics config) overriding the defaults
+    Returns:
+        data (dict): The preprocessed data of the sequence (see MotChallenge2DBox_CHUNK.get_preprocessed_seq_data)
+        metrics_list (list): The selected metrics
+    """
+    _, dataset_config, metrics_config = _get_configs(arg_dic)
+    dataset = trackeval.datasets.MotChallenge2DBox_CHUNK(dataset_config)
+    metrics_list = _get_metrics(metrics_config)
+    seq = list(arg_dic['SEQ_INFO'].keys())[0]
+    raw_data = dataset.get_raw_seq_data(arg_dic['TRACKERS_TO_EVAL'][0], seq)
+    return dataset.get_preprocessed_seq_data(raw_data, 'pedestrian'), metrics_list
+
+def _get_configs(arg_dic):
+    """
+    Build the eval, dataset and metrics configs for the MOT16 train set with the CHUNK dataset
+    Args:
+        arg_dic (dict): Config values (of the eval, dataset or metrics config) overriding the defaults
+    Returns:
+        eval_config (dict), dataset_config (dict), metrics_config (dict)
+    """
     # default config
     default_eval_config = trackeval.Evaluator.get_default_eval_config()
     default_eval_config['DISPLAY_LESS_PROGRESS'] = False
+    # results are returned in memory, so no summary, detailed or plot files are written
+    default_eval_config['OUTPUT_SUMMARY'] = False
+    default_eval_config['OUTPUT_DETAILED'] = False
+    default_eval_config['PLOT_CURVES'] = False
 
     # 2. configs include GT data, tracker data, benchmark, SPLIT_TO_EVAL, etc
     default_dataset_config = trackeval.datasets.MotChallenge2DBox_CHUNK.get_default_dataset_config()
 
     # 3. configs include metrics, thresholds, etc
-    default_metrics_config = {'METRICS': ['HOTA', 'CLEAR', 'Identity'], 'THRESHOLD': 0.5}
+    default_metrics_config = {'METRICS': ['HOTA', 'CLEAR', 'Identity'], 'THRESHOLD': 0.5, 'RECORD_EVENTS': False}
 
      # Merge default configs
     config = {**default_eval_config, **default_dataset_config, **default_metrics_config}
-    
+
     # Basic Argument
     BENCHMARK = 'MOT16'
     SPLIT_TO_EVAL = 'train'
-    TRACKERS_TO_EVAL = ['MPNTrack']
     METRICS = ['HOTA', 'CLEAR', 'Identity', 'VACE']
-    USE_PARALLEL = False
-    NUM_PARALLEL_CORES = 1
-    t0 = t0
-    t1 = t1
-    
-    # get default seq length
-    temp_gt_seq_dir = os.path.join(default_dataset_config['GT_FOLDER'], f"{BENCHMARK}-{SPLIT_TO_EVAL}", f"{SEQ_INFO}")
-    seqinfo_file = os.path.join(temp_gt_seq_dir, 'seqinfo.ini')
-    seq_info_config = configparser.ConfigParser()
-    seq_info_config.read(seqinfo_file)
-    
-    # modify SEQ info format for the config
-    SEQ_INFO = {SEQ_INFO: None}
-    
-    arg_dic = {'BENCHMARK': BENCHMARK, 'SPLIT_TO_EVAL': SPLIT_TO_EVAL, 'TRACKERS_TO_EVAL': TRACKERS_TO_EVAL,
-     'METRICS': METRICS, 'USE_PARALLEL': USE_PARALLEL, 'NUM_PARALLEL_CORES': NUM_PARALLEL_CORES, 'SEQ_INFO': SEQ_INFO, 't0': t0, 't1': t1}
+    arg_dic = {'BENCHMARK': BENCHMARK, 'SPLIT_TO_EVAL': SPLIT_TO_EVAL, 'METRICS': METRICS, **arg_dic}
 
     for key, item in arg_dic.items():
         if key in config:
@@ -110,145 +236,41 @@ def run_evaluation(t0, t1, SEQ_INFO = 'MOT16-02', uploaded_txt_dir = 'data/track
     for key, value in metrics_config.items():
         print(key, ':', value)
     print('==' * 36)
-    
-    # Filter frames if t0 and t1 are provided
-    temp_dir_used = False
-    if t0 is not None and t1 is not None:
-        temp_dir_used = True
-        # obtain information about the sequence and tracker to evaluate (only for a single sequence and tracker)
-        seq_info = list(dataset_config['SEQ_INFO'].keys())[0] # e.g: MOT16-02
-        tracker = dataset_config['TRACKERS_TO_EVAL'][0] # e,g: MPNTrack
-
-        # =============Now we want to make a copy of desired GT folder with only the desired sequence of selected frames================
-        original_MOT16train_GT_folder = os.path.join(dataset_config['GT_FOLDER'], f"{dataset_config['BENCHMARK']}-{dataset_config['SPLIT_TO_EVAL']}", seq_info)
-        temp_gt_seq_dir = os.path.join(dataset_config['GT_FOLDER'], f"{dataset_config['BENCHMARK']}-{dataset_config['SPLIT_TO_EVAL']}", f"{seq_info}_temp")
-        
-        # Check if the temporary directory already exists
-        if os.path.exists(temp_gt_seq_dir):
-            # If it exists, delete the entire directory tree
-            shutil.rmtree(temp_gt_seq_dir)
-        
-        # Copy the directory
-        shutil.copytree(original_MOT16train_GT_folder, temp_gt_seq_dir)
-        
-        # filter frames in the desired sequence
-        gt_file = os.path.join(temp_gt_seq_dir, 'gt', 'gt.txt')
-        filter_frames(gt_file, t0, t1)
-
-        # modify seqLength in data/gt/mot_challenge/MOT16-train_temp/MOT16-02/seqinfo.ini to reflect the new number of frames
-        seqinfo_file = os.path.join(temp_gt_seq_dir, 'seqinfo.ini')
-        seq_info_config = configparser.ConfigParser()
-        seq_info_config.read(seqinfo_file)
-        seq_info_config['Sequence']['seqLength'] = str(t1 - t0 + 1)
-
-        with open(seqinfo_file, 'w') as f:
-            seq_info_config.write(f)
-        
-        # =============Now we want to make a copy of desired tracker with only the selected frames================
-        # copy the original tracker folder to a temporary folder
-        original_MOT16train_tracker_folder = os.path.join(dataset_config['TRACKERS_FOLDER'], f"{dataset_config['BENCHMARK']}-{dataset_config['SPLIT_TO_EVAL']}", tracker)
-        temp_tracker_dir = os.path.join(dataset_config['TRACKERS_FOLDER'], f"{dataset_config['BENCHMARK']}-{dataset_config['SPLIT_TO_EVAL']}", f"{tracker}_temp")
-        
-        if os.path.exists(temp_tracker_dir):
-            # If it exists, delete the entire directory tree
-            shutil.rmtree(temp_tracker_dir)
-
-        # Copy the directory
-        shutil.copytree(original_MOT16train_tracker_folder, temp_tracker_dir)
-    
-        # filter frames in the desired tracker
-        tracker_file = os.path.join(temp_tracker_dir, 'data', f"{seq_info}.txt")
-        
-        # if upload txt file, replace the original tracker file in the temp diretory with the uploaded file (copy instead of remove uploaded_txt_dir) 
-        if uploaded_txt_dir:
-            shutil.copyfile(uploaded_txt_dir, tracker_file)
-
-        filter_frames(tracker_file, t0, t1)
 
-        # rename the txt
-        os.rename(tracker_file, os.path.join(temp_tracker_dir, 'data', f"{seq_info}_temp.txt"))
-
-        # modify the config to indicate what we are evaluating now
-        dataset_config['TRACKERS_TO_EVAL'] = [f"{tracker}_temp"]
-        dataset_config['SEQ_INFO'] = {f"{seq_info}_temp": None}
-    
-    # print current config
-    print('==' * 10, 'eval config', '==' * 10)
-    for key, value in eval_config.items():
-        print(key, ':', value)
-    print('==' * 10, 'dataset config', '==' * 10)
-    for key, value in dataset_config.items():
-        print(key, ':', value)
-    print('==' * 10, 'metrics config', '==' * 10)
-    for key, value in metrics_config.items():
-        print(key, ':', value)
-    print('==' * 20)
+    return eval_config, dataset_config, metrics_config
 
-    # Run code
-    evaluator = trackeval.Evaluator(eval_config)
-    dataset_list = [trackeval.datasets.MotChallenge2DBox_CHUNK(dataset_config)]
+def _get_metrics(metrics_config):
+    """The metrics selected by metrics_config['METRICS']"""
     metrics_list = []
     for metric in [trackeval.metrics.HOTA, trackeval.metrics.CLEAR, trackeval.metrics.Identity, trackeval.metrics.VACE]:
         if metric.get_name() in metrics_config['METRICS']:
             metrics_list.append(metric(metrics_config))
     if len(metrics_list) == 0:
         raise Exception('No metrics selected for evaluation')
+    return metrics_list
+
+def _run_evaluator(arg_dic):
+    """
+    Run the Evaluator on the MOT16 train set with the CHUNK dataset
+    Args:
+        arg_dic (dict): Config values (of the eval, dataset or metrics config) overriding the defaults
+    Returns:
+        tracker_res (dict): The results of the evaluated tracker, indexed like tracker_res[seq][cls][metric_name]
+        metrics_list (list): The evaluated metrics
+    """
+    eval_config, dataset_config, metrics_config = _get_configs(arg_dic)
+
+    # Run code
+    evaluator = trackeval.Evaluator(eval_config)
+    dataset_list = [trackeval.datasets.MotChallenge2DBox_CHUNK(dataset_config)]
+    metrics_list = _get_metrics(metrics_config)
 
     output_res, output_msg = evaluator.evaluate(dataset_list, metrics_list)
     print('Eval Ends in Backend')
     
-    # get the output: pedestrian_summary.txt in the tracker folder
-    output_folder = temp_tracker_dir
-    output_txt = os.path.join(output_folder, 'pedestrian_summary.txt')
-
-    # read the output file, first lines as keys and second lines as values
-    try:
-        with open(output_txt, 'r') as f:
-            keys = f.readline().strip().split()
-            values = f.readline().strip().split()
-    except FileNotFoundError:
-        print(f"Error: The file {output_txt} does not exist.")
-        exit(1)
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        exit(1)
-    
-    # remove the temporary directories
-    if temp_dir_used:
-        shutil.rmtree(temp_gt_seq_dir)
-        shutil.rmtree(temp_tracker_dir)
-        print("Temporary directories removed.")
-    
-    converted_values = converted_values = [float(value) if value.replace('.', '', 1).isdigit() else value for value in values]
-    temp_dict = dict(zip(keys, converted_values))
-
-    # Define keys for each category
-    HOTA_keys = {'HOTA', 'DetA', 'AssA', 'DetRe', 'DetPr', 'AssRe', 'AssPr', 'LocA', 'OWTA', 'HOTA(0)', 'LocA(0)', 'HOTALocA(0)'}
-    CLEAR_keys = {'MOTA', 'MOTP', 'MODA', 'CLR_Re', 'CLR_Pr', 'MTR', 'PTR', 'MLR', 'sMOTA', 'CLR_TP', 'CLR_FN', 'CLR_FP', 'IDSW', 'MT', 'PT', 'ML', 'Frag'}
-    Identity_keys = {'IDF1', 'IDR', 'IDP', 'IDTP', 'IDFN', 'IDFP'}
-    VACE_keys = {'SFDA', 'ATA'}
-    COUNT_keys = {'Dets', 'GT_Dets', 'IDs', 'GT_IDs'}
-
-    # Define a dictionary of dictionaries
-    categories = {
-        'HOTA': HOTA_keys,
-        'CLEAR': CLEAR_keys,
-        'Identity': Identity_keys,
-        'VACE': VACE_keys,
-        'COUNT': COUNT_keys
-    }
-
-    # Create dictionaries dynamically
-    category_dicts = {category: {} for category in categories}
-
-    # Distribute key-value pairs to the respective category dictionaries
-    for key, value in temp_dict.items():
-        for category, keys in categories.items():
-            if key in keys:
-                category_dicts[category][key] = value
-                break
-    
-    return category_dicts
+    # results of the evaluated tracker
+    tracker_res = output_res[dataset_list[0].get_name()][arg_dic['TRACKERS_TO_EVAL'][0]]
+    return tracker_res, metrics_list
 
 if __name__ == '__main__':
     t0 = 20
@@ -3,7 +3,6 @@ This file contains the functions to generate the image visualization of the grou
 '''
 
 import streamlit as st
-from PIL import Image
 from io import BytesIO
 from pyecharts.charts import Bar
 from pyecharts import options as opts
@@ -12,14 +11,13 @@ import cv2
 import numpy as np
 from pathlib import Path
 import base64
-
-def image_check(my_upload, MAX_FILE_SIZE):
-    if my_upload:
-        if my_upload.size > MAX_FILE_SIZE:
-            st.sidebar.error(f"File size exceeds {MAX_FILE_SIZE}/{MAX_FILE_SIZE/1024/1024} MB")
-            return False
-        else:
-            return True    
+import os
+import hashlib
+from trackeval.datasets import mot_rows
+from trackeval.utils import LRUCache
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import tile_server
 
 def convert_image(img):
     buf = BytesIO()
@@ -28,45 +26,50 @@ def convert_image(img):
     return byte_im
 
 
-# upload:txt file, video_no: video, values: start and end frame
-def generate_image(my_upload, video_sequence, values, col1, col2):
+# upload_file: stored txt file, video_sequence: video, values: start and end frame
+def generate_image(upload_file, video_sequence, values, col1, col2):
     text_file_path = f"data/gt/mot_challenge/MOT16-train/{video_sequence}/gt/gt.txt"
-    image_path_t0 = f"MOT16/train/{video_sequence}/img1/{str(values[0]).zfill(6)}.jpg"
-    image_path_t1 = f"MOT16/train/{video_sequence}/img1/{str(values[1]).zfill(6)}.jpg"
 
     # plot the ground truth
     col1.write("Ground Truth MoT")
-    draw_box(text_file_path, image_path_t0, values[0], 'GT_plot')
-    draw_box(text_file_path, image_path_t1, values[1], 'GT_plot')
-
-    image_gt_0 = Image.open('GT_plot/output_image_'+str(values[0])+'.jpg')   
-    col1.image(image_gt_0, use_column_width=True)
+    col1.image(render_frame(text_file_path, video_sequence, values[0]), use_column_width=True)
     col1.write(f"frame {str(values[0])}")
 
-    image_gt_1 = Image.open('GT_plot/output_image_'+str(values[1])+'.jpg')   
-    col1.image(image_gt_1, use_column_width=True)
+    col1.image(render_frame(text_file_path, video_sequence, values[1]), use_column_width=True)
     col1.write(f"frame {str(values[1])}")
 
     # plot the model outcome
     col2.write("Your Model MoT")
-    draw_box(my_upload.name, image_path_t0, values[0], 'your_model_plot')
-    draw_box(my_upload.name, image_path_t1, values[1], 'your_model_plot')
-    image_your_model_0 = Image.open('your_model_plot/output_image_'+str(values[0])+'.jpg')   
-    col2.image(image_your_model_0, use_column_width=True)
+    col2.image(render_frame(upload_file, video_sequence, values[0]), use_column_width=True)
     col2.write(f"frame {str(values[0])}")
 
-    image_your_model_1 = Image.open('your_model_plot/output_image_'+str(values[1])+'.jpg')   
-    col2.image(image_your_model_1, use_column_width=True)
+    col2.image(render_frame(upload_file, video_sequence, values[1]), use_column_width=True)
     col2.write(f"frame {str(values[1])}")
 
+    prefetch_neighbour_frames(video_sequence, values)
+
     st.sidebar.markdown("\n")
     # st.sidebar.download_button("Download visualization", convert_image(fixed), "fixed.png", "image/png")
 
-# Function to create a zoomable image viewer in Streamlit
-def create_zoomable_image(image_path, col, frame_num):
-    # Convert image to base64 to embed in HTML
-    encoded_image = base64.b64encode(open(image_path, "rb").read()).decode()
-    html_code = f"""
+# Function to create a zoomable image viewer in Streamlit. If the tile server is enabled, the annotated frame is served
+# as a tile pyramid: the viewer starts from a downscaled preview and only loads full resolution tiles when zooming in.
+# Otherwise, the whole annotated frame is embedded in the page.
+def create_zoomable_image(box_file, video_sequence, frame_id, col):
+    if tile_server.is_enabled():
+        html_code = _tiled_viewer_html(box_file, video_sequence, frame_id)
+    else:
+        html_code = _inline_viewer_html(box_file, video_sequence, frame_id)
+    with col:
+        components.html(html_code, height=216, width=384)
+        st.write(f"frame {frame_id}")
+
+def _inline_viewer_html(box_file, video_sequence, frame_id):
+    # Embed a downscaled preview of the annotated frame as base64 in the HTML, which is sent again on every rerun
+    preview, preview_width = render_preview(box_file, video_sequence, frame_id)
+    encoded_image = base64.b64encode(preview).decode()
+    # Initial zoom showing the whole preview in the 384 pixels wide viewer
+    zoom = 384 / preview_width
+    return f"""
     <link rel="stylesheet" href="https://unpkg.com/viewerjs/dist/viewer.min.css">
     <script src="https://unpkg.com/viewerjs/dist/viewer.min.js"></script>
     <div style="text-align: center; width: 384px; height: 216px; overflow: hidden; display: flex; justify-content: center; align-items: center;">
@@ -91,60 +94,106 @@ def create_zoomable_image(image_path, col, frame_num):
                 flipVertical: 4
             }},
             viewed() {{
-                viewer.zoomTo(0.22); // Adjust this value as needed to ensure the full image is visible
+                viewer.zoomTo({zoom:.4f});
+            }}
+        }});
+    </script>
+    """
+
+def _tiled_viewer_html(box_file, video_sequence, frame_id):
+    image_path = f"MOT16/train/{video_sequence}/img1/{str(frame_id).zfill(6)}.jpg"
+    height, width = load_frame(image_path).shape[:2]
+    source_id = f"{video_sequence}_{frame_id}_{get_file_hash(box_file)}"
+    tile_url = tile_server.register_source(source_id, width, height,
+                                           lambda: draw_frame(box_file, video_sequence, frame_id))
+    return f"""
+    <script src="{tile_server.OPENSEADRAGON_URL}openseadragon.min.js"></script>
+    <div id="viewer" style="width: 384px; height: 216px;"></div>
+    <script>
+        OpenSeadragon({{
+            id: 'viewer',
+            prefixUrl: '{tile_server.OPENSEADRAGON_URL}images/',
+            showNavigator: false,
+            tileSources: {{
+                width: {width},
+                height: {height},
+                tileSize: {tile_server.TILE_SIZE},
+                tileOverlap: 0,
+                getTileUrl: function(level, x, y) {{
+                    return '{tile_url}' + level + '/' + x + '_' + y + '.jpg';
+                }}
             }}
         }});
     </script>
     """
-    with col:
-        components.html(html_code, height=216, width=384)
-        st.write(f"frame {frame_num}")
 
-def generate_image_zoomable(my_upload, video_sequence, values, col1, col2):
+def generate_image_zoomable(upload_file, video_sequence, values, col1, col2):
     text_file_path = f"data/gt/mot_challenge/MOT16-train/{video_sequence}/gt/gt.txt"
-    img_path_base = f"MOT16/train/{video_sequence}/img1/"
-    
+
     # Process the first frame for ground truth and model outcome
-    img_path_0 = f"{img_path_base}{str(values[0]).zfill(6)}.jpg"
-    draw_box(text_file_path, img_path_0, values[0], 'GT_plot')
     col1.write("Ground Truth MoT")
-    create_zoomable_image(f'GT_plot/output_image_{values[0]}.jpg', col1, values[0])
-    draw_box(my_upload.name, img_path_0, values[0], 'your_model_plot')
+    create_zoomable_image(text_file_path, video_sequence, values[0], col1)
     col2.write("Your Model MoT")
-    create_zoomable_image(f'your_model_plot/output_image_{values[0]}.jpg', col2, values[0])
-    
+    create_zoomable_image(upload_file, video_sequence, values[0], col2)
+
     # Process the second frame for ground truth and model outcome
-    img_path_1 = f"{img_path_base}{str(values[1]).zfill(6)}.jpg"
-    draw_box(text_file_path, img_path_1, values[1], 'GT_plot')
-    create_zoomable_image(f'GT_plot/output_image_{values[1]}.jpg', col1, values[1])
-    draw_box(my_upload.name, img_path_1, values[1], 'your_model_plot')
-    create_zoomable_image(f'your_model_plot/output_image_{values[1]}.jpg', col2, values[1])
+    create_zoomable_image(text_file_path, video_sequence, values[1], col1)
+    create_zoomable_image(upload_file, video_sequence, values[1], col2)
+
+    prefetch_neighbour_frames(video_sequence, values)
+
+# Frame indexes of recently drawn box files, keyed by (path, mtime, size): (file hash, boxes, offsets)
+box_indexes = LRUCache(max_bytes=256 * 1024 ** 2)
+
+def _get_box_file(file):
+    """Parse a box file and index it by frame, once per version (mtime and size) of the file"""
+    path = os.path.abspath(file)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    box_file = box_indexes.get(key)
+    if box_file is None:
+        with open(path, 'rb') as fp:
+            content = fp.read()
+        rows = mot_rows.parse_rows(content)
+        rows = mot_rows.sort_rows(rows) if rows is not None else mot_rows.read_rows(file)
+        frames = mot_rows.get_frames(rows)
+        boxes = np.ascontiguousarray(rows[:, 1:7]) if len(rows) > 0 else np.empty((0, 6))
+        num_frames = max(frames[-1] + 1, 0) if len(frames) > 0 else 0
+        offsets = np.searchsorted(frames, np.arange(num_frames + 1))
+        box_file = (hashlib.sha1(content).hexdigest(), boxes, offsets)
+        box_indexes.put(key, box_file)
+    return box_file
+
+def get_box_index(file):
+    """
+    Index the boxes of a MOT text file by frame. The file is parsed once per version (mtime and size), later calls
+    return the cached index without any file I/O.
+    Args:
+        file (str): The path of the GT or model outcome txt file
+    Returns:
+        boxes (np.ndarray): A (num_dets, 6) array of (id, x, y, w, h, score) rows sorted by frame
+        offsets (np.ndarray): The boxes of frame f are the contiguous block boxes[offsets[f]:offsets[f + 1]]
+    """
+    _, boxes, offsets = _get_box_file(file)
+    return boxes, offsets
+
+def get_file_hash(file):
+    """Return the SHA-1 hash of the content of a box file (computed once per version of the file)"""
+    return _get_box_file(file)[0]
 
 #Takes a filename and a frame id, returns all bounding boxes and scores in that frame.
 #tid = target ID
 def get_bbox(file, frame_id):
-    frame_ids = []
-    tids = []
-    tlwhs_lst = []
-    scores = []
-    with open(file, "r") as f:
-        for line in f:
-            line = line.strip()
-            values = line.split(',')
-            if (not values[0].isdigit()) or int(values[0])!=frame_id:
-                continue
-
-            frame_id = int(values[0])
-            tid = int(float(values[1]))
-            tlwhs = []
-            for i in values[2:6]:
-                tlwhs.append(float(i))
-            score = float(values[6])
-            frame_ids.append(frame_id)
-            tids.append(tid)
-            tlwhs_lst.append(tlwhs)
-            scores.append(score)
-    #All return types are lists
+    boxes, offsets = get_box_index(file)
+    if 0 <= frame_id < len(offsets) - 1:
+        boxes = boxes[offsets[frame_id]:offsets[frame_id + 1]]
+    else:
+        boxes = boxes[:0]
+    frame_ids = np.full(len(boxes), frame_id)
+    tids = boxes[:, 0].astype(int)
+    tlwhs_lst = boxes[:, 1:5]
+    scores = boxes[:, 5]
+    #All return types are numpy arrays
     return frame_ids, tids, tlwhs_lst, scores
 
 def vis(img, boxes, scores, cls_ids, conf=0.5, class_names=None):
@@ -186,10 +235,68 @@ def get_color(idx):
 
     return color
 
-#plot bounding boxes on a single image
+# Decoded sequence images (1920x1080 BGR arrays of about 6MB), keyed by image path
+decoded_frames = LRUCache(max_bytes=512 * 1024 ** 2)
+# Number of frames decoded ahead of each slider handle, in the direction it moves
+PREFETCH_FRAMES = 8
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+_prefetch_futures = {}  # image path: future of its pending prefetch
+_prefetch_lock = threading.RLock()  # future callbacks can run in the thread holding the lock
+
+def load_frame(image_path):
+    """Return the decoded image of a frame (which must not be modified), decoding it only if it is not cached"""
+    image = decoded_frames.get(image_path)
+    if image is None:
+        image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+        if image is not None:
+            image.flags.writeable = False
+            decoded_frames.put(image_path, image)
+    return image
+
+def prefetch_frames(image_paths):
+    """
+    Decode images into the decoded frame cache in the background. Pending prefetches of other images are cancelled,
+    as they were requested for an older slider position.
+    """
+    with _prefetch_lock:
+        for path, future in list(_prefetch_futures.items()):
+            if path not in image_paths:
+                future.cancel()
+        for path in image_paths:
+            if path in _prefetch_futures or path in decoded_frames:
+                continue
+            future = _prefetch_executor.submit(load_frame, path)
+            _prefetch_futures[path] = future
+            future.add_done_callback(lambda done, path=path: _prefetch_done(path, done))
+
+def _prefetch_done(path, future):
+    with _prefetch_lock:
+        if _prefetch_futures.get(path) is future:
+            del _prefetch_futures[path]
+
+def prefetch_neighbour_frames(video_sequence, values):
+    """
+    Prefetch the frames the slider handles are likely to show next. Each handle which moved since the previous run
+    of the session is assumed to keep moving by the same step, so that both scrubbing frame by frame and dragging
+    over larger steps find their next frames already decoded.
+    """
+    previous_values = st.session_state.get('previous_frame_values', values)
+    st.session_state.previous_frame_values = values
+    image_paths = []
+    for value, previous_value in zip(values, previous_values):
+        step = value - previous_value
+        for i in range(1, PREFETCH_FRAMES + 1):
+            frame_id = value + i * step
+            if step == 0 or frame_id < 1:
+                break
+            image_paths.append(f"MOT16/train/{video_sequence}/img1/{str(frame_id).zfill(6)}.jpg")
+    prefetch_frames(image_paths)
+
+#plot bounding boxes on a single image (given by its path, or already decoded)
 def plot_tracking(image, tlwhs, obj_ids, scores=None, frame_id=0, fps=0., ids2=None):
     # frame_id = frame_id+1
-    image = cv2.imread(image, cv2.IMREAD_COLOR)
+    if isinstance(image, str):
+        image = load_frame(image)
     im = np.ascontiguousarray(np.copy(image))
     im_h, im_w = im.shape[:2]
 
@@ -303,9 +410,54 @@ _COLORS = np.array(
 ).astype(np.float32).reshape(-1, 3)
 
 
-def draw_box(bbox, img, frame_id, folder):
-    frame_ids, tids, tlwhs_lst, scores = get_bbox(bbox, frame_id)
-    if len(frame_ids)>0:
-        image = plot_tracking(img, tlwhs_lst, tids, frame_id=frame_ids[0])
-        output_path = f'{folder}/output_image_{frame_id}.jpg'
-        cv2.imwrite(output_path, image)
\ No newline at end of file
+# Rendered frames (JPEG bytes), keyed by (sequence, frame, hash of the box file)
+rendered_frames = LRUCache(max_bytes=256 * 1024 ** 2)
+
+def render_frame(box_file, video_sequence, frame_id):
+    """
+    Draw the boxes of a box file on a frame of a sequence, in memory. Rendered frames are cached, so drawing the
+    same frame of an unchanged file again does not decode, draw and encode the image again.
+    Args:
+        box_file (str): The path of the GT or model outcome txt file
+        video_sequence (str): The sequence of the frame (e.g. 'MOT16-02')
+        frame_id (int): The frame to draw
+    Returns:
+        bytes: The JPEG encoded image, which can be given to st.image or embedded in HTML
+    """
+    key = (video_sequence, frame_id, get_file_hash(box_file))
+    image = rendered_frames.get(key)
+    if image is None:
+        image = cv2.imencode('.jpg', draw_frame(box_file, video_sequence, frame_id))[1].tobytes()
+        rendered_frames.put(key, image, num_bytes=len(image))
+    return image
+
+# Size of the previews embedded in the zoomable viewer when there is no tile server: twice the size of the viewer, so
+# that they stay sharp on high density displays and when zooming in a bit
+PREVIEW_SIZE = (768, 432)
+# Rendered previews (JPEG bytes and width), keyed by (sequence, frame, hash of the box file)
+rendered_previews = LRUCache(max_bytes=64 * 1024 ** 2)
+
+def render_preview(box_file, video_sequence, frame_id):
+    """
+    Same as render_frame, but the frame is downscaled to fit in PREVIEW_SIZE
+    Returns:
+        bytes: The JPEG encoded preview
+        int: The width of the preview
+    """
+    key = (video_sequence, frame_id, get_file_hash(box_file))
+    preview = rendered_previews.get(key)
+    if preview is None:
+        image = draw_frame(box_file, video_sequence, frame_id)
+        height, width = image.shape[:2]
+        scale = min(1, PREVIEW_SIZE[0] / width, PREVIEW_SIZE[1] / height)
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        preview = (cv2.imencode('.jpg', image)[1].tobytes(), size[0])
+        rendered_previews.put(key, preview, num_bytes=len(preview[0]))
+    return preview
+
+def draw_frame(box_file, video_sequence, frame_id):
+    """Draw the boxes of a box file on a frame of a sequence, returning the full resolution BGR image"""
+    image_path = f"MOT16/train/{video_sequence}/img1/{str(frame_id).zfill(6)}.jpg"
+    _, tids, tlwhs_lst, _ = get_bbox(box_file, frame_id)
+    return plot_tracking(image_path, tlwhs_lst, tids, frame_id=frame_id)
@@ -3,25 +3,43 @@ This is the main script to run the Streamlit app to display the evaluation resul
 '''
 import streamlit as st
 import streamlit.components.v1 as components
-from PIL import Image
 from io import BytesIO
-import base64
-from pyecharts.charts import Bar
-from pyecharts import options as opts
-from werkzeug.utils import secure_filename
-from multiprocessing import freeze_support
-from evaluate_filtered_frames import run_evaluation
-from image_generator import generate_image, image_check
-from charts import create_bar_chart
-import os
+from evaluate_filtered_frames import run_evaluation, run_zip_evaluation, run_timeline_evaluation, run_event_log, \
+    MOT16_TRAIN_SEQUENCES
+from image_generator import generate_image
+from charts import create_line_chart, show_category_charts, show_sequence_charts
+from playback import show_playback
+from eval_jobs import EvaluationJobs, PENDING, RUNNING, DONE, FAILED
+from upload_ingest import ingest_upload, ingest_zip_upload
+from trackeval.metrics import CLEAR
+from trackeval.utils import TrackEvalException
+import numpy as np
+import time
+import uuid
 
 # ===========================Streamlit Setup============================
 # Set page title and layout
 st.set_page_config(layout="wide", page_title="Vis Your MoT Model!")
 st.write("## 👀Visualize your model performance")
 
-# Set max file size and acceptable file types
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+# Seconds between two checks of a running evaluation
+POLL_INTERVAL = 0.5
+
+
+@st.cache_resource
+def get_evaluation_jobs():
+    # One background executor shared by every session of the app, whose jobs run concurrently. A running job is not
+    # interrupted when it is superseded or cleared, its result is dropped when it finishes.
+    return EvaluationJobs()
+
+
+evaluation_jobs = get_evaluation_jobs()
+
+
+def jump_to_frame(frame, n_frames):
+    # Show a problem frame next to the frame before it. The slider range can only be changed by a callback, which runs
+    # before the slider is drawn again.
+    st.session_state['values'] = (max(1, frame - 1), min(frame, n_frames))
 
 # Display the sidebar
 st.sidebar.write("## Select the video sequence you want to evaluate and upload your model outcome!")
@@ -29,6 +47,10 @@ st.sidebar.write("## Select the video sequence you want to evaluate and upload y
 if 'page' not in st.session_state:
     st.session_state.page = 1 
 
+# Evaluation jobs of this session are submitted to their own channel
+if 'eval_channel' not in st.session_state:
+    st.session_state.eval_channel = str(uuid.uuid4())
+
 # ==============Select Video, Upload Model Outcome, and Select Frame to Evaluate =====================
 col1, col2 = st.columns(2)
 
@@ -41,15 +63,24 @@ video_sequence = st.sidebar.selectbox(
 )
 
 # Upload the model outcome
-my_upload = st.sidebar.file_uploader("Upload your model outcome", type=["txt"])
-# save the file to the local directory
-if my_upload is not None:
-    # To read file as string:
-    file_details = {"FileName": video_sequence, "FileType": "txt", "FileSize": my_upload.size}
-    # Save the file to disk
-    with open((my_upload.name), "wb") as f:
-        f.write(my_upload.getbuffer())
-    st.success(f"the txt file uploaded for video sequence {video_sequence} has been saved")
+# (a txt file for the selected sequence, or a zip of MOT16-XX.txt files to evaluate all sequences together)
+my_upload = st.sidebar.file_uploader("Upload your model outcome", type=["txt", "zip"])
+# parse and validate the upload, which is stored under the hash of its content (the upload size limit is set by
+# server.maxUploadSize in .streamlit/config.toml)
+upload_file, upload_rows = None, None
+upload_zip, zip_sequences = None, None
+if my_upload is not None and my_upload.name.lower().endswith('.zip'):
+    try:
+        upload_zip, zip_sequences = ingest_zip_upload(my_upload, MOT16_TRAIN_SEQUENCES)
+        st.success(f"the zip file uploaded for video sequences {', '.join(zip_sequences)} has been saved")
+    except TrackEvalException as err:
+        st.sidebar.error(f"Invalid model outcome: {err}")
+elif my_upload is not None:
+    try:
+        upload_file, upload_rows = ingest_upload(my_upload, video_sequence)
+        st.success(f"the txt file uploaded for video sequence {video_sequence} has been saved")
+    except TrackEvalException as err:
+        st.sidebar.error(f"Invalid model outcome: {err}")
 
 
 # Frame selection
@@ -61,73 +92,156 @@ values = st.slider(
 
 # Show the range of frames selected
 st.write(f"Start frame: {values[0]}", f", End frame: {values[1]}")
+if upload_zip is not None:
+    # the sequences of a zip have different lengths, so they are always evaluated as a whole
+    st.info('Zip uploads are evaluated on all frames of every sequence, the selected frame range is ignored.')
 
 t0 = values[0]
 t1 = values[1]
 
 # ===========================Image Check and Display============================
 # Image check and display
-if image_check(my_upload, MAX_FILE_SIZE):
-    generate_image(my_upload=my_upload, video_sequence = video_sequence, values = values, col1=col1, col2=col2)
+if upload_file is not None:
+    generate_image(upload_file=upload_file, video_sequence = video_sequence, values = values, col1=col1, col2=col2)
+    show_playback(upload_file=upload_file, video_sequence=video_sequence, values=values)
 
 # ===========================Evaluation============================
-# Button to start evaluation
+# Button to start evaluation, which runs in the background so that the app stays responsive
 
 if st.button('Start Evaluation'):
-    with st.spinner('Evaluation ongoing for the selected frame range...'):
-        # Directly calling the evaluation function
-        result = run_evaluation(t0 = t0, t1 = t1, SEQ_INFO = video_sequence, uploaded_txt_dir=my_upload.name)
-
+    if upload_zip is not None:
+        # all frames of every sequence in the zip (not the selected range), evaluated in parallel
+        st.session_state.eval_job_id = evaluation_jobs.submit(
+            st.session_state.eval_channel, run_zip_evaluation, upload_zip, seq_list=zip_sequences)
+    elif upload_rows is not None:
+        st.session_state.eval_job_id = evaluation_jobs.submit(
+            st.session_state.eval_channel, run_evaluation,
+            t0 = t0, t1 = t1, SEQ_INFO = video_sequence, uploaded_rows=upload_rows)
+
+eval_job_id = st.session_state.get('eval_job_id')
+eval_status = evaluation_jobs.status(eval_job_id) if eval_job_id is not None else None
+if eval_status in (PENDING, RUNNING):
+    st.info('Evaluation ongoing for the selected frame range...')
+elif eval_status == FAILED:
+    try:
+        evaluation_jobs.result(eval_job_id)
+    except Exception as err:
+        st.error(f'Evaluation failed: {err}')
+elif eval_status == DONE:
+    result = evaluation_jobs.result(eval_job_id)
+
+    if 'COMBINED_SEQ' in result:
+        ### zip evaluation: results of all sequences together and of each sequence
+        show_sequence_charts(result)
+    else:
         ### result have the following keys: ['HOTA', 'CLEAR', 'Identity', 'VACE', 'COUNT']
-        tracking_quality = result['HOTA']
-        detection_quality = result['CLEAR']
-        identification_quality = result['Identity']
-        VACE = result['VACE']
-        count = result['COUNT']
-        
-        # Render the charts
-        width_scale = 200
-        width_ratio = [len(tracking_quality), len(detection_quality), len(identification_quality), len(VACE), len(count)]
-        # Display the evaluation results
-        tracking_chart = create_bar_chart(tracking_quality, "Tracking Quality (HOTA)", "#5470C6")
-        detection_chart = create_bar_chart(detection_quality, "Detection Quality (CLEAR)", "#91CC75")
-        identification_chart = create_bar_chart(identification_quality, "Identification Quality (Identity)", "#EE6666")
-        VACE_chart = create_bar_chart(VACE, "VACE", "#fac858")
-        count_chart = create_bar_chart(count, "Count", "#73c0de")
-        
-        components.html(tracking_chart, height=600)
-        components.html(detection_chart, height=600)
-        components.html(identification_chart, height=600)
-        components.html(VACE_chart, height=600)
-        components.html(count_chart, height=600)
-        
-        # Tell the user the evaluation is done
-        st.success("Evaluation done! You can do new evaluation now.")
+        show_category_charts(result)
+
+    # Tell the user the evaluation is done
+    st.success("Evaluation done! You can do new evaluation now.")
+
+# ===========================Metrics Over Time============================
+# HOTA, MOTA and IDF1 of sliding windows of frames across the whole sequence
+st.write("### Metrics over time")
+timeline_col1, timeline_col2 = st.columns(2)
+window = timeline_col1.number_input('Window width (frames)', min_value=1, max_value=n_frames, value=min(100, n_frames),
+                                    key='timeline_window')
+stride = timeline_col2.number_input('Window stride (frames)', min_value=1, max_value=n_frames, value=10,
+                                    key='timeline_stride')
+timeline_channel = st.session_state.eval_channel + '/timeline'
+
+if st.button('Compute Metrics Over Time') and upload_rows is not None:
+    st.session_state.timeline_job_id = evaluation_jobs.submit(
+        timeline_channel, run_timeline_evaluation,
+        SEQ_INFO=video_sequence, window=window, stride=stride, uploaded_rows=upload_rows)
+
+timeline_job_id = st.session_state.get('timeline_job_id')
+timeline_status = evaluation_jobs.status(timeline_job_id) if timeline_job_id is not None else None
+if timeline_status in (PENDING, RUNNING):
+    st.info('Computing the metrics over time...')
+elif timeline_status == FAILED:
+    try:
+        evaluation_jobs.result(timeline_job_id)
+    except Exception as err:
+        st.error(f'Evaluation failed: {err}')
+elif timeline_status == DONE:
+    timeline = evaluation_jobs.result(timeline_job_id)
+    components.html(create_line_chart(timeline, "HOTA, MOTA and IDF1 over time"), height=600)
+    st.caption("IDF1 is computed on each window alone. HOTA and MOTA reuse the matches of the whole sequence, so "
+               "tracks continuing from before a window can slightly change their values.")
+
+# ===========================Problem Frames============================
+# Frames with CLEAR events (FP and FN dets, ID switches and fragmentations) of the whole sequence, to jump straight to
+st.write("### Problem frames")
+events_channel = st.session_state.eval_channel + '/events'
+
+if st.button('Find Problem Frames') and upload_rows is not None:
+    st.session_state.events_job_id = evaluation_jobs.submit(
+        events_channel, run_event_log, SEQ_INFO=video_sequence, uploaded_rows=upload_rows)
+    st.session_state.events_sequence = video_sequence
+
+events_job_id = st.session_state.get('events_job_id')
+events_status = evaluation_jobs.status(events_job_id) if events_job_id is not None else None
+if events_status in (PENDING, RUNNING):
+    st.info('Finding the problem frames...')
+elif events_status == FAILED:
+    try:
+        evaluation_jobs.result(events_job_id)
+    except Exception as err:
+        st.error(f'Evaluation failed: {err}')
+elif events_status == DONE and st.session_state.get('events_sequence') == video_sequence:
+    events = evaluation_jobs.result(events_job_id)
+    event_types = st.multiselect('Events', CLEAR.EVENT_TYPES, default=CLEAR.EVENT_TYPES, key='event_types')
+    events = events[np.isin(events['type'], [CLEAR.EVENT_TYPES.index(event_type) for event_type in event_types])]
+    # timestep t is frame t + 1
+    frames, frame_index = np.unique(events['timestep'] + 1, return_inverse=True)
+    if len(frames) == 0:
+        st.info('No frame has the selected events.')
+    else:
+        event_counts = np.zeros((len(frames), len(CLEAR.EVENT_TYPES)), dtype=int)
+        np.add.at(event_counts, (frame_index, events['type']), 1)
+        frame_labels = {int(frame): f'frame {frame}: ' + ', '.join(
+            f'{count} {name}' for name, count in zip(CLEAR.EVENT_TYPES, counts) if count > 0)
+            for frame, counts in zip(frames, event_counts)}
+        # frames with the most events first
+        order = np.argsort(-event_counts.sum(axis=1), kind='stable')
+        problem_col1, problem_col2 = st.columns([3, 1])
+        frame = problem_col1.selectbox('Problem frame', [int(frame) for frame in frames[order]],
+                                       format_func=frame_labels.get, key='problem_frame')
+        problem_col2.button('Jump to frame', on_click=jump_to_frame, args=(frame, n_frames))
+        # ids of the gt and uploaded files, -1 where an id does not apply to the event
+        st.dataframe([{'event': CLEAR.EVENT_TYPES[event['type']], 'gt id': int(event['gt_id']),
+                       'tracker id': int(event['tracker_id']), 'previous tracker id': int(event['prev_tracker_id'])}
+                      for event in events[events['timestep'] + 1 == frame]])
+    # the Parquet file is only written once per event log (job id, file content, error), not on every rerun
+    events_parquet = st.session_state.get('events_parquet')
+    if events_parquet is None or events_parquet[0] != events_job_id:
+        try:
+            parquet_file = BytesIO()
+            CLEAR.write_events(evaluation_jobs.result(events_job_id), parquet_file)
+            events_parquet = (events_job_id, parquet_file.getvalue(), None)
+        except TrackEvalException as err:
+            events_parquet = (events_job_id, None, err)
+        st.session_state.events_parquet = events_parquet
+    _, parquet_data, parquet_error = events_parquet
+    if parquet_error is None:
+        st.download_button('Download the event log (Parquet)', parquet_data,
+                           file_name=f'{video_sequence}_events.parquet')
+    else:
+        st.warning(f'The event log cannot be downloaded: {parquet_error}')
 
 if st.button('Clear Evaluation'):
-    # delete the saved file
-    if my_upload is not None:
-        os.remove(my_upload.name)
-        # delete every image in the GT_plot and your_model_plot folder except the .gitignore file
-        for file in os.listdir('GT_plot'):
-            if file != '.gitignore':
-                os.remove(f'GT_plot/{file}')
-        for file in os.listdir('your_model_plot'):
-            if file != '.gitignore':
-                os.remove(f'your_model_plot/{file}')
-        st.success(f'the txt file uploaded for video sequence {video_sequence} has been deleted')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    # drop the evaluations of this session
+    evaluation_jobs.cancel(st.session_state.eval_channel)
+    evaluation_jobs.cancel(timeline_channel)
+    evaluation_jobs.cancel(events_channel)
+    st.session_state.pop('eval_job_id', None)
+    st.session_state.pop('timeline_job_id', None)
+    st.session_state.pop('events_job_id', None)
+    st.session_state.pop('events_parquet', None)
+    # the saved file is kept, as it is shared by the sessions uploading the same content (old uploads are pruned)
+
+# Check a running evaluation again shortly (the wait is interrupted as soon as a widget changes)
+if any(status in (PENDING, RUNNING) for status in (eval_status, timeline_status, events_status)):
+    time.sleep(POLL_INTERVAL)
+    st.experimental_rerun()
@@ -2,26 +2,33 @@
 This is the main script to run the Streamlit app to display the evaluation results MOT16 train dataset.
 '''
 import streamlit as st
-import streamlit.components.v1 as components
-from PIL import Image
-from io import BytesIO
-import base64
-from pyecharts.charts import Bar
-from pyecharts import options as opts
-from werkzeug.utils import secure_filename
-from multiprocessing import freeze_support
 from evaluate_filtered_frames import run_evaluation
-from image_generator import generate_image, image_check, generate_image_zoomable
-from charts import create_bar_chart
-import os
+from image_generator import generate_image, generate_image_zoomable
+from charts import show_category_charts
+from playback import show_playback
+from eval_jobs import EvaluationJobs, PENDING, RUNNING, DONE, FAILED
+from upload_ingest import ingest_upload
+from trackeval.utils import TrackEvalException
+import time
+import uuid
 
 # ===========================Streamlit Setup============================
 # Set page title and layout
 st.set_page_config(layout="wide", page_title="Vis Your MoT Model!")
 st.write("##Visualize your model performance")
 
-# Set max file size and acceptable file types
-MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB=
+# Seconds between two checks of a running evaluation
+POLL_INTERVAL = 0.5
+
+
+@st.cache_resource
+def get_evaluation_jobs():
+    # One background executor shared by every session of the app, whose jobs run concurrently. A running job is not
+    # interrupted when it is superseded or cleared, its result is dropped when it finishes.
+    return EvaluationJobs()
+
+
+evaluation_jobs = get_evaluation_jobs()
 
 # Display the sidebar
 st.sidebar.write("## Select the video sequence you want to evaluate and upload your model outcome!")
@@ -29,6 +36,10 @@ st.sidebar.write("## Select the video sequence you want to evaluate and upload y
 if 'page' not in st.session_state:
     st.session_state.page = 1
 
+# Evaluation jobs of this session are submitted to their own channel
+if 'eval_channel' not in st.session_state:
+    st.session_state.eval_channel = str(uuid.uuid4())
+
 # ==============Select Video, Upload Model Outcome, and Select Frame to Evaluate =====================
 col1, col2 = st.columns(2)
 
@@ -42,14 +53,15 @@ video_sequence = st.sidebar.selectbox(
 
 # Upload the model outcome
 my_upload = st.sidebar.file_uploader("Upload your model outcome", type=["txt"])
-# save the file to the local directory
+# parse and validate the upload, which is stored under the hash of its content (the upload size limit is set by
+# server.maxUploadSize in .streamlit/config.toml)
+upload_file, upload_rows = None, None
 if my_upload is not None:
-    # To read file as string:
-    file_details = {"FileName": video_sequence, "FileType": "txt", "FileSize": my_upload.size}
-    # Save the file to disk
-    with open((my_upload.name), "wb") as f:
-        f.write(my_upload.getbuffer())
-    st.success(f"the txt file uploaded for video sequence {video_sequence} has been saved")
+    try:
+        upload_file, upload_rows = ingest_upload(my_upload, video_sequence)
+        st.success(f"the txt file uploaded for video sequence {video_sequence} has been saved")
+    except TrackEvalException as err:
+        st.sidebar.error(f"Invalid model outcome: {err}")
 
 # Frame selection
 n_frames = dict_video_sequence[video_sequence]
@@ -66,63 +78,43 @@ if new_range != st.session_state.frame_range:
 
 # ===========================Image Check and Display============================
 # Image check and display
-if image_check(my_upload, MAX_FILE_SIZE):
-    generate_image_zoomable(my_upload=my_upload, video_sequence = video_sequence, values = new_range, col1=col1, col2=col2)
+if upload_file is not None:
+    generate_image_zoomable(upload_file=upload_file, video_sequence = video_sequence, values = new_range, col1=col1, col2=col2)
+    show_playback(upload_file=upload_file, video_sequence=video_sequence, values=new_range)
 
-# Perform evaluation if the range has changed
-if 'evaluate' in st.session_state and st.session_state.evaluate:
+# Start a background evaluation if the range has changed. It supersedes the evaluation of the previous range, so
+# that while the slider is dragged only the latest requested range is evaluated.
+if st.session_state.get('evaluate') and upload_rows is not None:
     t0, t1 = st.session_state.frame_range
     st.session_state.evaluate = False  # Reset the flag
-    with st.spinner('Evaluation ongoing for the selected frame range...'):
-        result = run_evaluation(t0=t0, t1=t1, SEQ_INFO=video_sequence, uploaded_txt_dir=my_upload.name)
-
-        # Render and display charts
-        tracking_chart = create_bar_chart(result['HOTA'], "Tracking Quality (HOTA)", "#5470C6")
-        detection_chart = create_bar_chart(result['CLEAR'], "Detection Quality (CLEAR)", "#91CC75")
-        identification_chart = create_bar_chart(result['Identity'], "Identification Quality (Identity)", "#EE6666")
-        VACE_chart = create_bar_chart(result['VACE'], "VACE", "#fac858")
-        count_chart = create_bar_chart(result['COUNT'], "Count", "#73c0de")
-
-        components.html(tracking_chart, height=600)
-        components.html(detection_chart, height=600)
-        components.html(identification_chart, height=600)
-        components.html(VACE_chart, height=600)
-        components.html(count_chart, height=600)
-        
-        st.success("Evaluation done! You can select new range to re-evaluate.")
+    st.session_state.eval_job_id = evaluation_jobs.submit(
+        st.session_state.eval_channel, run_evaluation,
+        t0=t0, t1=t1, SEQ_INFO=video_sequence, uploaded_rows=upload_rows)
+
+eval_job_id = st.session_state.get('eval_job_id')
+eval_status = evaluation_jobs.status(eval_job_id) if eval_job_id is not None else None
+if eval_status in (PENDING, RUNNING):
+    st.info('Evaluation ongoing for the selected frame range...')
+elif eval_status == FAILED:
+    try:
+        evaluation_jobs.result(eval_job_id)
+    except Exception as err:
+        st.error(f'Evaluation failed: {err}')
+elif eval_status == DONE:
+    result = evaluation_jobs.result(eval_job_id)
+
+    # Render and display charts
+    show_category_charts(result)
+
+    st.success("Evaluation done! You can select new range to re-evaluate.")
 
 if st.button('Clear Evaluation'):
-    # delete the saved file
-    if my_upload is not None:
-        os.remove(my_upload.name)
-        # delete every image in the GT_plot and your_model_plot folder except the .gitignore file
-        for file in os.listdir('GT_plot'):
-            if file != '.gitignore':
-                os.remove(f'GT_plot/{file}')
-        for file in os.listdir('your_model_plot'):
-            if file != '.gitignore':
-                os.remove(f'your_model_plot/{file}')
-        st.success(f'the txt file uploaded for video sequence {video_sequence} has been deleted')
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    # drop the evaluation of this session
+    evaluation_jobs.cancel(st.session_state.eval_channel)
+    st.session_state.pop('eval_job_id', None)
+    # the saved file is kept, as it is shared by the sessions uploading the same content (old uploads are pruned)
+
+# Check a running evaluation again shortly (the wait is interrupted as soon as a widget changes)
+if eval_status in (PENDING, RUNNING):
+    time.sleep(POLL_INTERVAL)
+    st.experimental_rerun()
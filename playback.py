@@ -0,0 +1,203 @@
+'''
+This file contains the playback mode of the visualizer, which streams the GT and model boxes of the whole selected
+frame range side by side, and can export them as an MP4 video.
+'''
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import streamlit as st
+
+from image_generator import get_bbox, plot_tracking
+
+# Frames are decoded at half resolution (960x540 per side), which the JPEG decoder does several times faster than a
+# full decode. Together with rendering on a few threads (cv2 releases the GIL) this keeps up with 30 FPS on a CPU.
+DECODE_SCALE = 2
+RENDER_WORKERS = 4
+JPEG_QUALITY = 80
+# Interval (in seconds) at which the display checks that the producer of the frames is still running
+POLL_INTERVAL = 0.5
+
+
+def render_playback_frame(gt_file, model_file, video_sequence, frame_id):
+    """
+    Draw the GT and model boxes of a frame side by side
+    Args:
+        gt_file (str): The path of the GT txt file
+        model_file (str): The path of the model outcome txt file
+        video_sequence (str): The sequence of the frame (e.g. 'MOT16-02')
+        frame_id (int): The frame to draw
+    Returns:
+        np.ndarray: The BGR image, with the GT on the left and the model outcome on the right
+    """
+    image_path = f"MOT16/train/{video_sequence}/img1/{str(frame_id).zfill(6)}.jpg"
+    image = cv2.imread(image_path, cv2.IMREAD_REDUCED_COLOR_2)
+    if image is None:
+        raise FileNotFoundError(f"The image of frame {frame_id} cannot be read: {image_path}")
+    panels = []
+    for box_file in (gt_file, model_file):
+        _, tids, tlwhs_lst, _ = get_bbox(box_file, frame_id)
+        panels.append(plot_tracking(image, tlwhs_lst / DECODE_SCALE, tids, frame_id=frame_id))
+    return np.hstack(panels)
+
+
+def encode_playback_frame(gt_file, model_file, video_sequence, frame_id):
+    """Same as render_playback_frame, but returns the JPEG encoded image"""
+    image = render_playback_frame(gt_file, model_file, video_sequence, frame_id)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+
+
+def render_in_order(pool, render, frame_ids, lookahead, get_due_index=None):
+    """
+    Render frames on a thread pool, yielding (index, result) in frame order while at most lookahead frames are
+    rendered ahead. If get_due_index is given, frames before the index it returns are due already and are skipped.
+    """
+    pending = deque()
+    next_index = 0
+    while True:
+        while next_index < len(frame_ids) and len(pending) < lookahead:
+            if get_due_index is not None:
+                next_index = max(next_index, get_due_index())
+                if next_index >= len(frame_ids):
+                    break
+            pending.append((next_index, pool.submit(render, frame_ids[next_index])))
+            next_index += 1
+        if not pending:
+            return
+        index, future = pending.popleft()
+        yield index, future.result()
+
+
+class FrameStream:
+    """
+    Produces the encoded frames of a playback on a background thread, at the pace of a target FPS.
+    Frame i is due start_time + i / fps. Frames which are already due when they would be rendered are skipped, so
+    that playback stays in real time even if rendering is slower than the target FPS.
+    """
+
+    def __init__(self, render, frame_ids, fps, num_workers=RENDER_WORKERS):
+        self.frame_ids = frame_ids
+        self.fps = fps
+        # (index, encoded frame), then None once finished or the exception which stopped the rendering
+        self.frames = queue.Queue(maxsize=2 * num_workers)
+        self.start_time = None
+        self._render = render
+        self._num_workers = num_workers
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+
+    def start(self):
+        # Leave some time to render the first frames
+        self.start_time = time.perf_counter() + self._num_workers / self.fps
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def due_time(self, index):
+        return self.start_time + index / self.fps
+
+    def due_index(self):
+        return int((time.perf_counter() - self.start_time) * self.fps)
+
+    def next_item(self):
+        """Wait for the next item of frames, returning None if the producer ended without giving one"""
+        while True:
+            try:
+                return self.frames.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not self._thread.is_alive() and self.frames.empty():
+                    return None
+
+    def _produce(self):
+        # The display always gets a last item, so that it never waits for frames which will not come
+        last_item = None
+        try:
+            with ThreadPoolExecutor(self._num_workers, thread_name_prefix='playback') as pool:
+                for item in render_in_order(pool, self._render, self.frame_ids, self._num_workers, self.due_index):
+                    if not self._put(item):
+                        return
+        except Exception as err:
+            last_item = err
+        finally:
+            self._put(last_item)
+
+    def _put(self, item):
+        # Wait for the display to take the frame, unless the playback is stopped
+        while not self._stopped.is_set():
+            try:
+                self.frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+
+def play_frames(placeholder, gt_file, model_file, video_sequence, values, fps):
+    """
+    Play the frames of [t0, t1] in a placeholder (st.empty()) at the target FPS. Changing any widget interrupts the
+    playback, as the script run is stopped at the next Streamlit call.
+    """
+    frame_ids = list(range(values[0], values[1] + 1))
+    stream = FrameStream(lambda frame_id: encode_playback_frame(gt_file, model_file, video_sequence, frame_id),
+                         frame_ids, fps)
+    stream.start()
+    try:
+        while True:
+            item = stream.next_item()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            index, image = item
+            delay = stream.due_time(index) - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            placeholder.image(image, caption=f"frame {frame_ids[index]}", use_column_width=True)
+    finally:
+        stream.stop()
+
+
+def export_video(gt_file, model_file, video_sequence, values, fps):
+    """
+    Export the side by side playback of [t0, t1] as an MP4 video
+    Returns:
+        bytes: The content of the MP4 file
+    """
+    frame_ids = list(range(values[0], values[1] + 1))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        video_path = os.path.join(tmp_dir, 'playback.mp4')
+        writer = None
+        with ThreadPoolExecutor(RENDER_WORKERS, thread_name_prefix='export') as pool:
+            render = lambda frame_id: render_playback_frame(gt_file, model_file, video_sequence, frame_id)
+            for _, image in render_in_order(pool, render, frame_ids, RENDER_WORKERS):
+                if writer is None:
+                    height, width = image.shape[:2]
+                    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+                writer.write(image)
+        if writer is not None:
+            writer.release()
+        with open(video_path, 'rb') as f:
+            return f.read()
+
+
+def show_playback(upload_file, video_sequence, values):
+    """Playback controls of the visualizer, for the GT and the uploaded model outcome of the selected frame range"""
+    gt_file = f"data/gt/mot_challenge/MOT16-train/{video_sequence}/gt/gt.txt"
+    st.write("### Playback of the selected range (Ground Truth | Your Model)")
+    fps = st.number_input('Playback FPS', min_value=1, max_value=60, value=30, key='playback_fps')
+    play_col, export_col = st.columns(2)
+    placeholder = st.empty()
+    if play_col.button('Play'):
+        play_frames(placeholder, gt_file, upload_file, video_sequence, values, fps)
+    if export_col.button('Export MP4'):
+        with st.spinner('Exporting the selected frame range...'):
+            video = export_video(gt_file, upload_file, video_sequence, values, fps)
+        export_col.download_button('Download MP4', video, file_name=f'{video_sequence}_{values[0]}_{values[1]}.mp4',
+                                   mime='video/mp4')
@@ -0,0 +1,123 @@
+""" Regression test of the vectorized HOTA.eval_sequence() against the original implementation, which loops over the
+alpha values for every timestep. All results must be identical (to the bit), also for similarities which are exactly
+at (or just below) the alpha thresholds.
+
+Run with: python -m pytest tests
+"""
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+from trackeval.metrics import HOTA
+
+
+def _reference_eval_sequence(metric, data):
+    """HOTA.eval_sequence() as originally implemented, with one pass over all timesteps for each alpha value"""
+    res = {}
+    for field in metric.float_array_fields + metric.integer_array_fields:
+        res[field] = np.zeros((len(metric.array_labels)), dtype=float)
+    for field in metric.float_fields:
+        res[field] = 0
+
+    potential_matches_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
+    gt_id_count = np.zeros((data['num_gt_ids'], 1))
+    tracker_id_count = np.zeros((1, data['num_tracker_ids']))
+    for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+        similarity = data['similarity_scores'][t]
+        sim_iou_denom = similarity.sum(0)[np.newaxis, :] + similarity.sum(1)[:, np.newaxis] - similarity
+        sim_iou = np.zeros_like(similarity)
+        sim_iou_mask = sim_iou_denom > 0 + np.finfo('float').eps
+        sim_iou[sim_iou_mask] = similarity[sim_iou_mask] / sim_iou_denom[sim_iou_mask]
+        potential_matches_count[gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :]] += sim_iou
+        gt_id_count[gt_ids_t] += 1
+        tracker_id_count[0, tracker_ids_t] += 1
+
+    global_alignment_score = potential_matches_count / (gt_id_count + tracker_id_count - potential_matches_count)
+    matches_counts = [np.zeros_like(potential_matches_count) for _ in metric.array_labels]
+    for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+        if len(gt_ids_t) == 0:
+            for a, alpha in enumerate(metric.array_labels):
+                res['HOTA_FP'][a] += len(tracker_ids_t)
+            continue
+        if len(tracker_ids_t) == 0:
+            for a, alpha in enumerate(metric.array_labels):
+                res['HOTA_FN'][a] += len(gt_ids_t)
+            continue
+
+        similarity = data['similarity_scores'][t]
+        score_mat = global_alignment_score[gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :]] * similarity
+        match_rows, match_cols = linear_sum_assignment(-score_mat)
+        for a, alpha in enumerate(metric.array_labels):
+            actually_matched_mask = similarity[match_rows, match_cols] >= alpha - np.finfo('float').eps
+            alpha_match_rows = match_rows[actually_matched_mask]
+            alpha_match_cols = match_cols[actually_matched_mask]
+            num_matches = len(alpha_match_rows)
+            res['HOTA_TP'][a] += num_matches
+            res['HOTA_FN'][a] += len(gt_ids_t) - num_matches
+            res['HOTA_FP'][a] += len(tracker_ids_t) - num_matches
+            if num_matches > 0:
+                res['LocA'][a] += sum(similarity[alpha_match_rows, alpha_match_cols])
+                matches_counts[a][gt_ids_t[alpha_match_rows], tracker_ids_t[alpha_match_cols]] += 1
+
+    for a, alpha in enumerate(metric.array_labels):
+        matches_count = matches_counts[a]
+        ass_a = matches_count / np.maximum(1, gt_id_count + tracker_id_count - matches_count)
+        res['AssA'][a] = np.sum(matches_count * ass_a) / np.maximum(1, res['HOTA_TP'][a])
+        ass_re = matches_count / np.maximum(1, gt_id_count)
+        res['AssRe'][a] = np.sum(matches_count * ass_re) / np.maximum(1, res['HOTA_TP'][a])
+        ass_pr = matches_count / np.maximum(1, tracker_id_count)
+        res['AssPr'][a] = np.sum(matches_count * ass_pr) / np.maximum(1, res['HOTA_TP'][a])
+
+    res['LocA'] = np.maximum(1e-10, res['LocA']) / np.maximum(1e-10, res['HOTA_TP'])
+    return metric._compute_final_fields(res)
+
+
+def _random_sequence(rng, alpha_labels, num_timesteps=40, num_gt_ids=15, num_tracker_ids=20):
+    """ Random preprocessed sequence data (as given by a dataset to the metrics). A third of the similarities are set
+    exactly to an alpha threshold, or to the threshold minus eps or 2 * eps (around the comparison in the metric)."""
+    thresholds = np.concatenate([alpha_labels, alpha_labels - np.finfo('float').eps,
+                                 alpha_labels - 2 * np.finfo('float').eps])
+    data = {'gt_ids': [], 'tracker_ids': [], 'similarity_scores': []}
+    for t in range(num_timesteps):
+        gt_ids_t = np.sort(rng.choice(num_gt_ids, size=rng.integers(0, 11), replace=False))
+        tracker_ids_t = np.sort(rng.choice(num_tracker_ids, size=rng.integers(0, 13), replace=False))
+        shape = (len(gt_ids_t), len(tracker_ids_t))
+        similarity = rng.random(shape) * (rng.random(shape) < 0.4)
+        at_threshold = (similarity > 0) & (rng.random(shape) < 0.33)
+        similarity[at_threshold] = rng.choice(thresholds, size=np.sum(at_threshold))
+        data['gt_ids'].append(gt_ids_t)
+        data['tracker_ids'].append(tracker_ids_t)
+        data['similarity_scores'].append(similarity)
+    data['num_timesteps'] = num_timesteps
+    data['num_gt_ids'] = num_gt_ids
+    data['num_tracker_ids'] = num_tracker_ids
+    data['num_gt_dets'] = sum(len(ids) for ids in data['gt_ids'])
+    data['num_tracker_dets'] = sum(len(ids) for ids in data['tracker_ids'])
+    return data
+
+
+def _assert_same_results(metric, res, ref):
+    for field in metric.fields:
+        np.testing.assert_array_equal(res[field], ref[field], err_msg=field)
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_eval_sequence(seed):
+    metric = HOTA()
+    data = _random_sequence(np.random.default_rng(seed), metric.array_labels)
+    res = metric.eval_sequence(data)
+    ref = _reference_eval_sequence(metric, data)
+    _assert_same_results(metric, res, ref)
+
+
+def test_crowded_timestep():
+    # one timestep with many more matches than all others
+    metric = HOTA()
+    data = _random_sequence(np.random.default_rng(0), metric.array_labels, num_gt_ids=60, num_tracker_ids=60)
+    data['gt_ids'][3] = np.arange(60)
+    data['tracker_ids'][3] = np.arange(60)
+    data['similarity_scores'][3] = np.where(np.eye(60) > 0, np.random.default_rng(1).random((60, 60)), 0)
+    data['num_gt_dets'] = sum(len(ids) for ids in data['gt_ids'])
+    data['num_tracker_dets'] = sum(len(ids) for ids in data['tracker_ids'])
+    res = metric.eval_sequence(data)
+    ref = _reference_eval_sequence(metric, data)
+    _assert_same_results(metric, res, ref)
@@ -0,0 +1,81 @@
+""" Tests that the decomposed matching of trackeval._matching gives the same results as linear_sum_assignment on the
+whole score matrix. MIN_DECOMPOSED_SIZE is lowered so that the connected component decomposition is used for the small
+random matrices below (it is only used for matrices with hundreds of rows and cols otherwise).
+
+Run with: python -m pytest tests
+"""
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+from trackeval import _matching
+
+
+def _random_scores(rng, num_rows, num_cols):
+    """ Random score matrix made of small clusters of overlapping dets (like the IOUs of a crowded frame), so that it
+    has single pair, single row or col, and larger components. Scores are continuous, so the optimal assignment is
+    unique."""
+    score_mat = np.zeros((num_rows, num_cols))
+    rows, cols = rng.permutation(num_rows), rng.permutation(num_cols)
+    row_start, col_start = 0, 0
+    while row_start < num_rows and col_start < num_cols:
+        cluster_rows = rows[row_start:row_start + rng.integers(1, 5)]
+        cluster_cols = cols[col_start:col_start + rng.integers(1, 5)]
+        cluster = rng.random((len(cluster_rows), len(cluster_cols)))
+        score_mat[np.ix_(cluster_rows, cluster_cols)] = cluster * (rng.random(cluster.shape) < 0.7)
+        row_start += len(cluster_rows)
+        col_start += len(cluster_cols)
+    return score_mat
+
+
+def _reference_matches(score_mat):
+    match_rows, match_cols = linear_sum_assignment(-score_mat)
+    is_positive = score_mat[match_rows, match_cols] > 0
+    return match_rows[is_positive], match_cols[is_positive]
+
+
+@pytest.fixture
+def decomposed(monkeypatch):
+    monkeypatch.setattr(_matching, 'MIN_DECOMPOSED_SIZE', 0)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('shape', [(1, 1), (1, 7), (7, 1), (12, 12), (30, 45), (45, 30)])
+def test_match_positive(decomposed, seed, shape):
+    rng = np.random.default_rng(seed)
+    score_mat = _random_scores(rng, *shape)
+    match_rows, match_cols = _matching.match_positive(score_mat)
+    ref_rows, ref_cols = _reference_matches(score_mat)
+    np.testing.assert_array_equal(match_rows, ref_rows)
+    np.testing.assert_array_equal(match_cols, ref_cols)
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('shape', [(1, 5), (12, 12), (30, 45), (45, 30)])
+def test_assignment_sum(decomposed, seed, shape):
+    rng = np.random.default_rng(seed)
+    score_mat = _random_scores(rng, *shape)
+    # bit-identical, not just close
+    assert _matching.assignment_sum(score_mat) == score_mat[linear_sum_assignment(-score_mat)].sum()
+
+
+def test_equal_scores(decomposed):
+    # single row or col components resolve ties by taking the first, as linear_sum_assignment does
+    score_mat = np.zeros((4, 6))
+    score_mat[0, [1, 3]] = 0.5
+    score_mat[[1, 2], 5] = 0.7
+    match_rows, match_cols = _matching.match_positive(score_mat)
+    ref_rows, ref_cols = _reference_matches(score_mat)
+    np.testing.assert_array_equal(match_rows, ref_rows)
+    np.testing.assert_array_equal(match_cols, ref_cols)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_match_pairs(decomposed, seed):
+    rng = np.random.default_rng(seed)
+    score_mat = _random_scores(rng, 40, 50)
+    rows, cols = np.nonzero(np.ones_like(score_mat))
+    scores = score_mat[rows, cols]
+    matches = _matching.match_pairs(rows, cols, scores)
+    ref_rows, ref_cols = _reference_matches(score_mat)
+    np.testing.assert_array_equal(rows[matches], ref_rows)
+    np.testing.assert_array_equal(cols[matches], ref_cols)
@@ -0,0 +1,34 @@
+""" Regression test of the sparse STDA of VACE against the original assignment over the dense temporal IOU matrix of
+all pairs of tracks, which must give identical (to the bit) results, with more gt or more tracker tracks.
+
+Run with: python -m pytest tests
+"""
+import numpy as np
+import pytest
+from scipy.optimize import linear_sum_assignment
+from trackeval.metrics import VACE
+
+
+def _random_tracks(rng, num_gt_ids, num_tracker_ids):
+    """Random number of frames of each track, and of frames in which pairs of tracks overlap (for 5% of the pairs)"""
+    gt_id_count = rng.integers(1, 50, num_gt_ids).astype(float)
+    tracker_id_count = rng.integers(1, 50, num_tracker_ids).astype(float)
+    max_count = np.minimum(gt_id_count[:, np.newaxis], tracker_id_count[np.newaxis, :])
+    potential_matches_count = np.round(max_count * rng.random(max_count.shape))
+    potential_matches_count[rng.random(max_count.shape) >= 0.05] = 0
+    return potential_matches_count, gt_id_count, tracker_id_count
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('shape', [(30, 30), (20, 150), (150, 20), (90, 60)])
+def test_compute_stda(seed, shape):
+    potential_matches_count, gt_id_count, tracker_id_count = _random_tracks(np.random.default_rng(seed), *shape)
+    union_count = gt_id_count[:, np.newaxis] + tracker_id_count[np.newaxis, :] - potential_matches_count
+    temporal_iou = potential_matches_count / union_count
+    match_rows, match_cols = linear_sum_assignment(-temporal_iou)
+
+    pair_gt_ids, pair_tracker_ids = np.nonzero(potential_matches_count)
+    stda = VACE._compute_stda(pair_gt_ids, pair_tracker_ids, potential_matches_count[pair_gt_ids, pair_tracker_ids],
+                              gt_id_count, tracker_id_count,
+                              potential_matches_count[pair_gt_ids, pair_tracker_ids])
+    assert stda == temporal_iou[match_rows, match_cols].sum()
@@ -0,0 +1,144 @@
+'''
+This file contains an optional tile server for the zoomable viewer. Annotated frames are served as multi-resolution tile
+pyramids (as used by OpenSeadragon), so the browser first loads a small downscaled preview and only fetches the full
+resolution tiles of the region it zooms into. Levels and tiles are generated lazily and cached.
+
+The tiles are loaded by the browser directly from this server, not through the Streamlit server, so it is only used
+when it is configured with the address under which browsers reach it (see is_enabled()). The viewer shows the whole
+frame inline otherwise.
+'''
+import os
+import re
+import math
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+
+from trackeval.utils import LRUCache
+
+TILE_SIZE = 256
+JPEG_QUALITY = 85
+# The server is opt-in: it is only started if both the port it listens on and the public URL under which browsers reach
+# it (e.g. 'https://example.com/tiles-proxy' behind an HTTPS reverse proxy forwarding to the port) are set.
+TILE_SERVER_HOST = os.environ.get('TILE_SERVER_HOST', '127.0.0.1')
+TILE_SERVER_PORT = int(os.environ.get('TILE_SERVER_PORT', 0))
+TILE_SERVER_URL = os.environ.get('TILE_SERVER_URL')
+# Script of the OpenSeadragon viewer of the tiles (and the folder of its button images), which can be self-hosted
+OPENSEADRAGON_URL = os.environ.get('OPENSEADRAGON_URL',
+                                   'https://cdn.jsdelivr.net/npm/openseadragon@4.1/build/openseadragon/')
+MAX_SOURCES = 256
+
+_TILE_PATH = re.compile(r'^/tiles/([\w-]+)/(\d+)/(\d+)_(\d+)\.jpg$')
+
+_sources = OrderedDict()  # source id: (width, height, function rendering the full resolution image)
+_level_images = LRUCache(max_bytes=512 * 1024 ** 2)  # (source id, level): image
+_tiles = LRUCache(max_bytes=128 * 1024 ** 2)  # (source id, level, x, y): JPEG bytes
+_lock = threading.Lock()
+_server_url = None
+
+
+def is_enabled():
+    """Whether the tile server is configured (TILE_SERVER_PORT and TILE_SERVER_URL)"""
+    return TILE_SERVER_PORT > 0 and bool(TILE_SERVER_URL)
+
+
+def get_max_level(width, height):
+    """The level of the full resolution image, as level 0 is a single pixel and each level doubles the size"""
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+
+def register_source(source_id, width, height, render):
+    """
+    Make a (width, height) image available to the viewer as a tile pyramid, starting the tile server if needed (it
+    must be enabled, see is_enabled())
+    Args:
+        source_id (str): A unique id of the image (letters, digits, '_' and '-'), which must change with its content
+        width (int): The width of the full resolution image
+        height (int): The height of the full resolution image
+        render (callable): Returns the full resolution BGR image, only called when tiles are requested
+    Returns:
+        str: The base URL of the tiles, followed by '<level>/<x>_<y>.jpg'
+    """
+    with _lock:
+        _sources[source_id] = (width, height, render)
+        _sources.move_to_end(source_id)
+        while len(_sources) > MAX_SOURCES:
+            _sources.popitem(last=False)
+    return f'{start_tile_server()}/tiles/{source_id}/'
+
+
+def get_level_image(source_id, level):
+    """Return the image of a source at a level of its pyramid, or None if the source or level does not exist"""
+    image = _level_images.get((source_id, level))
+    if image is not None:
+        return image
+    with _lock:
+        source = _sources.get(source_id)
+    if source is None:
+        return None
+    width, height, render = source
+    max_level = get_max_level(width, height)
+    if level > max_level:
+        return None
+    if level == max_level:
+        image = render()
+    else:
+        full_image = get_level_image(source_id, max_level)
+        scale = 2 ** (max_level - level)
+        size = (max(int(math.ceil(width / scale)), 1), max(int(math.ceil(height / scale)), 1))
+        image = cv2.resize(full_image, size, interpolation=cv2.INTER_AREA)
+    _level_images.put((source_id, level), image)
+    return image
+
+
+def get_tile(source_id, level, x, y):
+    """Return the JPEG bytes of a tile, or None if it does not exist"""
+    key = (source_id, level, x, y)
+    tile = _tiles.get(key)
+    if tile is None:
+        image = get_level_image(source_id, level)
+        if image is None:
+            return None
+        tile = image[y * TILE_SIZE:(y + 1) * TILE_SIZE, x * TILE_SIZE:(x + 1) * TILE_SIZE]
+        if tile.size == 0:
+            return None
+        tile = cv2.imencode('.jpg', tile, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+        _tiles.put(key, tile, num_bytes=len(tile))
+    return tile
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        match = _TILE_PATH.match(self.path)
+        tile = get_tile(match.group(1), *map(int, match.groups()[1:])) if match else None
+        if tile is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(tile)))
+        # Source ids change with the content of the image, so tiles can be cached by the browser
+        self.send_header('Cache-Control', 'public, max-age=86400, immutable')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        # Do not log every tile request
+        pass
+
+
+def start_tile_server():
+    """Start the tile server in a background thread (once per process), returning its public URL"""
+    global _server_url
+    if not is_enabled():
+        raise RuntimeError('The tile server needs TILE_SERVER_PORT and TILE_SERVER_URL to be set.')
+    with _lock:
+        if _server_url is None:
+            server = ThreadingHTTPServer((TILE_SERVER_HOST, TILE_SERVER_PORT), _TileHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name='tile-server', daemon=True).start()
+            _server_url = TILE_SERVER_URL.rstrip('/')
+    return _server_url
@@ -0,0 +1,135 @@
+"""Optimal one-to-one matching of dets, decomposed into independent sub-problems.
+
+Matching scores between dets are non-negative and mostly zero (dets only overlap with a few other dets), so the
+bipartite graph of positive scores splits into many small connected components, most of which are a single pair or a
+single det overlapping several others. For large score matrices (crowded frames), these are matched directly, and the
+Hungarian algorithm is only run on each of the remaining components, instead of on the whole score matrix.
+
+The same holds for scores between ids accumulated over a sequence (e.g. the potential matches of gt and tracker ids),
+which are only positive for the pairs of ids which co-occur. These are given as lists of pairs and matched without a
+dense score matrix of all ids, so that sequences with many thousands of (fragmented) ids can be matched.
+"""
+import numpy as np
+from scipy import sparse
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse.csgraph import connected_components
+
+
+# Matrices with fewer rows or cols than this are matched directly, as the Hungarian algorithm is faster than finding
+# connected components for them.
+MIN_DECOMPOSED_SIZE = 500
+
+
+def match_positive(score_mat):
+    """ Finds the assignment maximising the total score, for a score matrix without negative values.
+    Returns the matched (rows, cols) which have a positive score, sorted by row. These are the same pairs as those with
+    a positive score in linear_sum_assignment(-score_mat), as long as the optimal assignment is unique (it may only
+    differ where several assignments have exactly the same total score).
+    """
+    num_rows, num_cols = score_mat.shape
+    if min(num_rows, num_cols) < MIN_DECOMPOSED_SIZE:
+        match_rows, match_cols = linear_sum_assignment(-score_mat)
+        is_positive = score_mat[match_rows, match_cols] > 0
+        return match_rows[is_positive], match_cols[is_positive]
+
+    edge_rows, edge_cols = np.nonzero(score_mat > 0)
+    matches = _match_edges(edge_rows, edge_cols, score_mat[edge_rows, edge_cols], num_rows, num_cols)
+    return edge_rows[matches], edge_cols[matches]
+
+
+def _match_edges(edge_rows, edge_cols, edge_scores, num_rows, num_cols):
+    """ Finds the assignment maximising the total score, for a bipartite graph given as a list of edges with positive
+    scores (sorted by row and then col) between num_rows rows and num_cols cols. Returns the indices of the matched
+    edges, sorted by row. The assignment is the one linear_sum_assignment() finds for the dense score matrix of the
+    edges, as long as it is unique.
+    """
+    # Connected components of the bipartite graph of positive scores (with rows as nodes 0 to num_rows - 1, and cols as
+    # the following nodes).
+    graph = sparse.csr_matrix((np.ones(len(edge_rows)), (edge_rows, num_rows + edge_cols)),
+                              shape=(num_rows + num_cols,) * 2)
+    num_components, labels = connected_components(graph, directed=False)
+    row_labels = labels[:num_rows]
+    col_labels = labels[num_rows:]
+    component_num_rows = np.bincount(row_labels, minlength=num_components)
+    component_num_cols = np.bincount(col_labels, minlength=num_components)
+    edge_components = row_labels[edge_rows]
+
+    # Components with a single row or col (1xN, Nx1, and most commonly 1x1) are matched directly to their highest
+    # score. Equal highest scores are resolved as linear_sum_assignment does, by taking the first.
+    is_star = (component_num_rows[edge_components] == 1) | (component_num_cols[edge_components] == 1)
+    star_edges = np.flatnonzero(is_star)
+    star_edges = star_edges[np.lexsort((edge_rows[star_edges], edge_cols[star_edges], -edge_scores[star_edges],
+                                        edge_components[star_edges]))]
+    is_best = np.ones(len(star_edges), dtype=bool)
+    is_best[1:] = edge_components[star_edges[1:]] != edge_components[star_edges[:-1]]
+    matches = [star_edges[is_best]]
+
+    # Every other component is solved with the Hungarian algorithm, on the dense score matrix of its rows and cols
+    # (in order). Edges are grouped by component (keeping their order) so that the edges of each component are slices.
+    components = np.unique(edge_components[~is_star])
+    edge_order = np.argsort(edge_components, kind='stable')
+    edge_starts, edge_ends = _group_bounds(edge_components[edge_order], components)
+    for edge_start, edge_end in zip(edge_starts, edge_ends):
+        component_edges = edge_order[edge_start:edge_end]
+        component_rows, edge_component_rows = np.unique(edge_rows[component_edges], return_inverse=True)
+        component_cols, edge_component_cols = np.unique(edge_cols[component_edges], return_inverse=True)
+        component_scores = np.zeros((len(component_rows), len(component_cols)))
+        component_scores[edge_component_rows, edge_component_cols] = edge_scores[component_edges]
+        edge_idx = np.full(component_scores.shape, -1)
+        edge_idx[edge_component_rows, edge_component_cols] = component_edges
+        rows, cols = linear_sum_assignment(-component_scores)
+        matches.append(edge_idx[rows, cols][component_scores[rows, cols] > 0])
+
+    matches = np.concatenate(matches)
+    return matches[np.argsort(edge_rows[matches])]
+
+
+def _group_bounds(sorted_labels, labels):
+    """Start and end index of each of the given labels in an array of sorted labels"""
+    return np.searchsorted(sorted_labels, labels, side='left'), np.searchsorted(sorted_labels, labels, side='right')
+
+
+def assignment_sum(score_mat):
+    """ Total score of the optimal assignment of a score matrix without negative values. This is identical (to the
+    bit) to score_mat[linear_sum_assignment(-score_mat)].sum(), where zero scores of unmatched rows are also summed.
+    """
+    num_rows, num_cols = score_mat.shape
+    if min(num_rows, num_cols) < MIN_DECOMPOSED_SIZE:
+        return score_mat[linear_sum_assignment(-score_mat)].sum()
+    match_rows, match_cols = match_positive(score_mat)
+    if num_rows <= num_cols:
+        # Every row is assigned, so the summed scores are those of all rows in order (zero if not positively matched).
+        scores = np.zeros(num_rows)
+        scores[match_rows] = score_mat[match_rows, match_cols]
+    elif len(match_cols) == num_cols:
+        # Every col is positively matched, so no zero scores are summed.
+        scores = score_mat[match_rows, match_cols]
+    else:
+        # Which rows are assigned zero scores (and so the order of the summation) depends on the full assignment.
+        scores = score_mat[linear_sum_assignment(-score_mat)]
+    return scores.sum()
+
+
+def match_pairs(rows, cols, scores):
+    """ Finds the assignment maximising the total score between rows and cols (e.g. gt and tracker ids) when only some
+    (row, col) pairs have a score and all other pairs score zero. The pairs must be unique and sorted by row and then
+    col (as returned by _sparse.sum_by_pair), and scores must not be negative.
+    Rows and cols which are in no pair are never matched with a positive score, so the assignment is only solved over
+    the rows and cols of the given pairs, and large problems are decomposed without ever building a dense score matrix
+    of all rows and cols. Returns the indices of the pairs which are matched with a positive score, sorted by row.
+    """
+    pairs = np.flatnonzero(scores > 0)
+    unique_rows, pair_rows = np.unique(rows[pairs], return_inverse=True)
+    unique_cols, pair_cols = np.unique(cols[pairs], return_inverse=True)
+    pair_rows = pair_rows.ravel()
+    pair_cols = pair_cols.ravel()
+    if min(len(unique_rows), len(unique_cols)) < MIN_DECOMPOSED_SIZE:
+        score_mat = np.zeros((len(unique_rows), len(unique_cols)))
+        score_mat[pair_rows, pair_cols] = scores[pairs]
+        match_rows, match_cols = match_positive(score_mat)
+        # Pairs are sorted by row and then col, and so are their keys in the reduced score matrix.
+        matches = np.searchsorted(pair_rows * len(unique_cols) + pair_cols,
+                                  match_rows * len(unique_cols) + match_cols)
+    else:
+        matches = _match_edges(pair_rows, pair_cols, scores[pairs], len(unique_rows), len(unique_cols))
+    return pairs[matches]
@@ -0,0 +1,118 @@
+"""Helpers for sparse data: similarity scores which may be stored as scipy sparse matrices, and values accumulated for
+pairs of ids.
+
+Datasets can return the similarity scores of each timestep as a scipy.sparse.csr_matrix instead of a dense array
+(e.g. MotChallenge2DBox_CHUNK with SPARSE_SIMILARITY), which in crowded scenes stores only the few overlapping pairs of
+dets. Values which are not stored are zero, so converting back to a dense array gives exactly the dense similarities.
+
+Metrics accumulate statistics for pairs of gt and tracker ids over a sequence. Only pairs which co-occur are stored, as
+sorted integer pair keys with their values, so that memory scales with the number of such pairs rather than with
+num_gt_ids * num_tracker_ids.
+"""
+import numpy as np
+from scipy import sparse
+
+
+def is_sparse(similarity):
+    """Whether the similarity scores of a timestep are stored as a sparse matrix"""
+    return sparse.issparse(similarity)
+
+
+def to_dense(similarity):
+    """Returns the similarity scores of a timestep as a dense 2D array (without copying dense arrays)"""
+    if sparse.issparse(similarity):
+        return similarity.toarray()
+    return similarity
+
+
+def select(similarity, rows, cols):
+    """Returns the similarity scores between the given rows (gt dets) and cols (tracker dets), as integer index arrays.
+    Sparse matrices stay sparse."""
+    if sparse.issparse(similarity):
+        return similarity[np.asarray(rows, dtype=int)][:, np.asarray(cols, dtype=int)]
+    return similarity[np.ix_(rows, cols)]
+
+
+def csr_matrices(data, row_ptr, indices, num_rows, num_cols):
+    """ Splits one CSR buffer holding the rows of all timesteps into a list (for each timestep) of csr_matrix views.
+    row_ptr (of length sum(num_rows) + 1) gives the start of each row in data and indices, which hold the values and
+    (timestep local) column indices of all rows of all timesteps in order.
+    """
+    # Index arrays are converted once to the (32 bit) index type scipy would choose, which is much faster than letting
+    # each csr_matrix check and convert its own slice.
+    index_dtype = np.int32 if max(len(data), max(num_cols, default=0)) < np.iinfo(np.int32).max else np.int64
+    row_ptr = np.asarray(row_ptr, dtype=index_dtype)
+    indices = np.asarray(indices, dtype=index_dtype)
+    matrices = []
+    row_offset = 0
+    for num_rows_t, num_cols_t in zip(num_rows, num_cols):
+        ptr_t = row_ptr[row_offset:row_offset + num_rows_t + 1]
+        matrices.append(sparse.csr_matrix((data[ptr_t[0]:ptr_t[-1]], indices[ptr_t[0]:ptr_t[-1]], ptr_t - ptr_t[0]),
+                                          shape=(num_rows_t, num_cols_t)))
+        row_offset += num_rows_t
+    return matrices
+
+
+def pair_keys(rows, cols, num_cols):
+    """Integer key of each (row, col) pair (e.g. of gt and tracker ids), ordered by row and then col"""
+    return np.asarray(rows, dtype=np.int64) * num_cols + np.asarray(cols, dtype=np.int64)
+
+
+def sum_by_pair(keys, values=None):
+    """ Sums values (or counts entries, if values is None) for each unique pair key, returning the sorted unique keys and
+    their sums. Values of a pair are added one at a time in their given order, so sums are identical to adding the
+    values into a dense array one at a time (e.g. in a loop over timesteps)."""
+    unique_keys, key_idx = np.unique(keys, return_inverse=True)
+    sums = np.bincount(key_idx.ravel(), weights=values, minlength=len(unique_keys)).astype(float)
+    return unique_keys, sums
+
+
+def lookup_pairs(keys, values, query_keys):
+    """Values of the pairs with the given query keys (of any shape), where keys are sorted and pairs not in keys are
+    zero"""
+    query_keys = np.asarray(query_keys)
+    if len(keys) == 0:
+        return np.zeros(query_keys.shape)
+    pos = np.minimum(np.searchsorted(keys, query_keys), len(keys) - 1)
+    return np.where(keys[pos] == query_keys, values[pos], 0)
+
+
+# Block size of numpy's pairwise summation (PW_BLOCKSIZE), see dense_sum()
+_PAIRWISE_BLOCKSIZE = 128
+
+
+def dense_sum(keys, values, size):
+    """ Sum of a dense array of size elements holding values at the sorted positions keys (e.g. pair keys) and zero
+    elsewhere, bit-identical to np.sum of the dense (C-contiguous) array. np.sum adds the elements of a contiguous array
+    in a fixed pairwise order: blocks of at most 128 elements, split in halves (at a multiple of 8) until they fit,
+    are summed with 8 interleaved partial sums. Adding zeros does not change a sum, so only the stored values need to
+    be added, each into the same partial sum as in the dense array. If values is 2D, its columns are summed separately.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    values = np.asarray(values, dtype=float)
+    return _pairwise_sum(keys, values, 0, size, 0, len(keys))
+
+
+def _pairwise_sum(keys, values, start, n, lo, hi):
+    """Sum of the n elements from start of the dense array of dense_sum(), which holds values[lo:hi]"""
+    res = np.zeros(values.shape[1:])
+    if lo == hi:
+        return res
+    if n < 8:
+        for i in range(lo, hi):
+            res += values[i]
+        return res
+    if n <= _PAIRWISE_BLOCKSIZE:
+        # 8 partial sums over the elements before the last n % 8, which are then added one at a time
+        num_blocked = lo + int(np.searchsorted(keys[lo:hi], start + n - n % 8))
+        partial = np.zeros((8,) + values.shape[1:])
+        np.add.at(partial, (keys[lo:num_blocked] - start) % 8, values[lo:num_blocked])
+        res = ((partial[0] + partial[1]) + (partial[2] + partial[3])) + \
+              ((partial[4] + partial[5]) + (partial[6] + partial[7]))
+        for i in range(num_blocked, hi):
+            res += values[i]
+        return res
+    n2 = n // 2
+    n2 -= n2 % 8
+    mid = lo + int(np.searchsorted(keys[lo:hi], start + n2))
+    return _pairwise_sum(keys, values, start, n2, lo, mid) + _pairwise_sum(keys, values, start + n2, n - n2, mid, hi)
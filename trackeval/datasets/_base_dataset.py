@@ -7,7 +7,13 @@ import numpy as np
 from copy import deepcopy
 from abc import ABC, abstractmethod
 from .. import _timing
-from ..utils import TrackEvalException
+from .. import _sparse
+from ..utils import TrackEvalException, LRUCache
+
+# Gt data (raw and preprocessed) of recently evaluated sequences, shared by all datasets, trackers and evaluations in
+# the process (e.g. the repeated evaluations of the apps). Datasets can change its memory budget (see
+# _get_gt_cache_key()).
+gt_cache = LRUCache(max_bytes=1024 ** 3)
 
 
 class _BaseDataset(ABC):
@@ -63,6 +69,34 @@ class _BaseDataset(ABC):
         """Return info about the dataset needed for the Evaluator"""
         return self.tracker_list, self.seq_list, self.class_list
 
+    def _get_gt_cache_key(self, seq):
+        """ Key identifying the version of the gt data of a sequence (e.g. the dataset, the gt file and its modification
+        time, and a hash of the config used to load it), under which its raw and preprocessed gt data is kept in the
+        gt cache. Returns None by default, so gt data is not cached unless a dataset implements this.
+        """
+        return None
+
+    @staticmethod
+    def _get_cached_gt(gt_cache_key, name, compute):
+        """Returns the gt data called name cached for gt_cache_key, computing (and caching) it if it is not cached.
+        Nothing is cached if gt_cache_key is None."""
+        if gt_cache_key is None:
+            return compute()
+        key = (name,) + tuple(gt_cache_key)
+        value = gt_cache.get(key)
+        if value is None:
+            value = compute()
+            gt_cache.put(key, value)
+        return value
+
+    def _calculate_sequence_similarities(self, gt_dets, tracker_dets):
+        """ Calculates the similarities of all timesteps of a sequence, as a list (for each timestep) of 2D arrays.
+        By default this calls _calculate_similarities() for each timestep, datasets can overwrite it to calculate the
+        similarities of all timesteps at once.
+        """
+        return [self._calculate_similarities(gt_dets_t, tracker_dets_t)
+                for gt_dets_t, tracker_dets_t in zip(gt_dets, tracker_dets)]
+
     @_timing.time
     def get_raw_seq_data(self, tracker, seq):
         """ Loads raw data (tracker and ground-truth) for a single tracker on a single sequence.
@@ -77,6 +111,7 @@ class _BaseDataset(ABC):
         [gt_dets, tracker_dets, gt_crowd_ignore_regions]: list (for each timestep) of lists of detections.
         [similarity_scores]: list (for each timestep) of 2D NDArrays.
         [gt_extras]: dict (for each extra) of lists (for each timestep) of 1D NDArrays (for each det).
+        [gt_cache_key]: key of the gt data in the gt cache (see _get_gt_cache_key()), or None if it is not cached.
 
         gt_extras contains dataset specific information used for preprocessing such as occlusion and truncation levels.
 
@@ -88,17 +123,17 @@ class _BaseDataset(ABC):
         We calculate similarity between all gt and tracker classes (not just each class individually) to allow for
         calculation of metrics such as class confusion matrices. Typically the impact of this on performance is low.
         """
-        # Load raw data.
-        raw_gt_data = self._load_raw_file(tracker, seq, is_gt=True)
+        # Load raw data. Gt data is the same for all trackers, so it is cached (if the dataset supports it).
+        gt_cache_key = self._get_gt_cache_key(seq)
+        raw_gt_data = self._get_cached_gt(gt_cache_key, 'raw_gt',
+                                          lambda: self._load_raw_file(tracker, seq, is_gt=True))
         raw_tracker_data = self._load_raw_file(tracker, seq, is_gt=False)
         raw_data = {**raw_tracker_data, **raw_gt_data}  # Merges dictionaries
+        raw_data['gt_cache_key'] = gt_cache_key
 
         # Calculate similarities for each timestep.
-        similarity_scores = []
-        for t, (gt_dets_t, tracker_dets_t) in enumerate(zip(raw_data['gt_dets'], raw_data['tracker_dets'])):
-            ious = self._calculate_similarities(gt_dets_t, tracker_dets_t)
-            similarity_scores.append(ious)
-        raw_data['similarity_scores'] = similarity_scores
+        raw_data['similarity_scores'] = self._calculate_sequence_similarities(raw_data['gt_dets'],
+                                                                              raw_data['tracker_dets'])
         return raw_data
     '''
     raw_data combines the raw data from the tracker and ground-truth data for a single tracker on a single sequence.
@@ -335,6 +370,131 @@ class _BaseDataset(ABC):
             ious = intersection / union
             return ious
 
+    @staticmethod
+    def _calculate_sequence_box_ious(bboxes1, bboxes2, box_format='xywh'):
+        """ Calculates the IOU between the boxes of each timestep of a sequence in one vectorized pass.
+        bboxes1 and bboxes2 are lists (for each timestep) of 2D arrays of boxes, and this returns a list (for each
+        timestep) of 2D arrays of IOUs, which are views into one flat buffer holding the IOUs of all timesteps. The
+        values are identical to calling _calculate_box_ious() for each timestep.
+        """
+        num_timesteps = len(bboxes1)
+        num_boxes1 = np.array([len(b) for b in bboxes1], dtype=int)
+        num_boxes2 = np.array([len(b) for b in bboxes2], dtype=int)
+        num_pairs = num_boxes1 * num_boxes2
+        pair_offsets = np.zeros(num_timesteps + 1, dtype=int)
+        pair_offsets[1:] = np.cumsum(num_pairs)
+        if pair_offsets[-1] == 0:
+            return [np.zeros((n1, n2)) for n1, n2 in zip(num_boxes1, num_boxes2)]
+
+        boxes1 = _BaseDataset._concat_box_columns(bboxes1, box_format)
+        boxes2 = _BaseDataset._concat_box_columns(bboxes2, box_format)
+
+        # Index (into the concatenated boxes of all timesteps) of both boxes of every pair. Pairs are ordered by
+        # timestep and then row-major within the timestep, so that each timestep's pairs reshape into its IOU matrix,
+        # i.e. each box1 has a contiguous run of pairs with all boxes2 of its timestep.
+        run_lengths = np.repeat(num_boxes2, num_boxes1)
+        run_starts = np.cumsum(run_lengths) - run_lengths
+        first_box2 = np.repeat(np.cumsum(num_boxes2) - num_boxes2, num_boxes1)
+        idx1 = np.repeat(np.arange(len(run_lengths)), run_lengths)
+        idx2 = np.arange(pair_offsets[-1]) - np.repeat(run_starts - first_box2, run_lengths)
+
+        ious = _BaseDataset._box_pair_ious(boxes1, boxes2, idx1, idx2)
+        return [ious[pair_offsets[t]:pair_offsets[t + 1]].reshape(num_boxes1[t], num_boxes2[t])
+                for t in range(num_timesteps)]
+
+    @staticmethod
+    def _calculate_sequence_sparse_box_ious(bboxes1, bboxes2, box_format='xywh'):
+        """ Calculates the IOU between the boxes of each timestep of a sequence, returning a list (for each timestep) of
+        scipy.sparse.csr_matrix holding only the non-zero IOUs (as views into one buffer for the whole sequence).
+        Their dense values are identical to those of _calculate_sequence_box_ious().
+
+        Only candidate pairs whose boxes may overlap are evaluated, found by sort-and-sweep: boxes2 are sorted by
+        timestep and then x0, and each box1 is compared only to the boxes2 of its timestep with x0 in
+        [box1 x0 - 2 * max box2 width, box1 x1), as no other box2 can overlap it in x.
+        """
+        num_timesteps = len(bboxes1)
+        num_boxes1 = np.array([len(b) for b in bboxes1], dtype=int)
+        num_boxes2 = np.array([len(b) for b in bboxes2], dtype=int)
+        boxes1 = _BaseDataset._concat_box_columns(bboxes1, box_format)
+        boxes2 = _BaseDataset._concat_box_columns(bboxes2, box_format)
+        box_offsets1 = np.cumsum(num_boxes1) - num_boxes1
+        box_offsets2 = np.cumsum(num_boxes2) - num_boxes2
+        timestep1 = np.repeat(np.arange(num_timesteps), num_boxes1)
+        timestep2 = np.repeat(np.arange(num_timesteps), num_boxes2)
+
+        # Only boxes with a positive extent can overlap.
+        x0_1, y0_1, x1_1, y1_1 = boxes1
+        x0_2, y0_2, x1_2, y1_2 = boxes2
+        valid1 = np.flatnonzero((x1_1 > x0_1) & (y1_1 > y0_1))
+        valid2 = np.flatnonzero((x1_2 > x0_2) & (y1_2 > y0_2))
+        if len(valid1) > 0 and len(valid2) > 0:
+            # Sort boxes2 by timestep and then x0, as an exact integer key built from the rank of x0.
+            x0_values = np.unique(x0_2[valid2])
+            key_stride = len(x0_values) + 1
+            sweep_keys = timestep2[valid2] * key_stride + np.searchsorted(x0_values, x0_2[valid2])
+            order = np.argsort(sweep_keys, kind='stable')
+            sweep_keys = sweep_keys[order]
+            sweep_boxes = valid2[order]
+
+            # Range of sorted boxes2 of the same timestep with x0 in [x0 - 2 * max width, x1) for each box1.
+            max_width = np.max(x1_2[valid2] - x0_2[valid2])
+            low = timestep1[valid1] * key_stride + np.searchsorted(x0_values, x0_1[valid1] - 2 * max_width)
+            high = timestep1[valid1] * key_stride + np.searchsorted(x0_values, x1_1[valid1])
+            starts = np.searchsorted(sweep_keys, low)
+            num_candidates = np.maximum(np.searchsorted(sweep_keys, high) - starts, 0)
+            run_starts = np.cumsum(num_candidates) - num_candidates
+            idx1 = np.repeat(valid1, num_candidates)
+            idx2 = sweep_boxes[np.arange(np.sum(num_candidates))
+                               + np.repeat(starts - run_starts, num_candidates)]
+
+            # Keep the pairs with a non-zero IOU, sorted by box1 and then box2.
+            ious = _BaseDataset._box_pair_ious(boxes1, boxes2, idx1, idx2)
+            is_overlap = ious > 0
+            idx1, idx2, ious = idx1[is_overlap], idx2[is_overlap], ious[is_overlap]
+            order = np.lexsort((idx2, idx1))
+            idx1, idx2, ious = idx1[order], idx2[order], ious[order]
+        else:
+            idx1 = idx2 = np.empty(0, dtype=int)
+            ious = np.empty(0)
+
+        row_ptr = np.zeros(len(timestep1) + 1, dtype=int)
+        row_ptr[1:] = np.cumsum(np.bincount(idx1, minlength=len(timestep1)))
+        indices = idx2 - box_offsets2[timestep2[idx2]]
+        return _sparse.csr_matrices(ious, row_ptr, indices, num_boxes1, num_boxes2)
+
+    @staticmethod
+    def _concat_box_columns(bboxes, box_format='xywh'):
+        """Concatenates a list (for each timestep) of 2D arrays of boxes into a (4, num_boxes) float array with rows
+        x0, y0, x1, y1 (each contiguous)"""
+        if sum(len(b) for b in bboxes) == 0:
+            return np.empty((4, 0))
+        boxes = np.concatenate([b for b in bboxes if len(b)]).astype(float).T.copy()
+        if box_format in 'xywh':
+            # layout: (x0, y0, w, h)
+            boxes[2] = boxes[0] + boxes[2]
+            boxes[3] = boxes[1] + boxes[3]
+        elif box_format not in 'x0y0x1y1':
+            raise (TrackEvalException('box_format %s is not implemented' % box_format))
+        return boxes
+
+    @staticmethod
+    def _box_pair_ious(boxes1, boxes2, idx1, idx2):
+        """ Calculates the IOU of pairs (boxes1[:, idx1], boxes2[:, idx2]) of boxes given as in _concat_box_columns(),
+        with exactly the same operations as _calculate_box_ious() so that values are identical."""
+        x0_1, y0_1, x1_1, y1_1 = boxes1
+        x0_2, y0_2, x1_2, y1_2 = boxes2
+        # layout: (x0, y0, x1, y1)
+        intersection = (np.maximum(np.minimum(x1_1[idx1], x1_2[idx2]) - np.maximum(x0_1[idx1], x0_2[idx2]), 0)
+                        * np.maximum(np.minimum(y1_1[idx1], y1_2[idx2]) - np.maximum(y0_1[idx1], y0_2[idx2]), 0))
+        area1 = ((x1_1 - x0_1) * (y1_1 - y0_1))[idx1]
+        area2 = ((x1_2 - x0_2) * (y1_2 - y0_2))[idx2]
+        union = area1 + area2 - intersection
+        intersection[area1 <= 0 + np.finfo('float').eps] = 0
+        intersection[area2 <= 0 + np.finfo('float').eps] = 0
+        intersection[union <= 0 + np.finfo('float').eps] = 0
+        union[union <= 0 + np.finfo('float').eps] = 1
+        return intersection / union
+
     @staticmethod
     def _calculate_euclidean_similarity(dets1, dets2, zero_distance=2.0):
         """ Calculates the euclidean distance between two sets of detections, and then converts this into a similarity
@@ -351,7 +511,10 @@ class _BaseDataset(ABC):
         """Check the requirement that the tracker_ids and gt_ids are unique per timestep"""
         gt_ids = data['gt_ids']
         tracker_ids = data['tracker_ids']
-        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(gt_ids, tracker_ids)):
+        # Timesteps are only checked one by one (to report the duplicate ids) from the first one with any duplicates.
+        first_t = min(_BaseDataset._first_duplicate_timestep(gt_ids),
+                      _BaseDataset._first_duplicate_timestep(tracker_ids))
+        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(gt_ids[first_t:], tracker_ids[first_t:]), start=first_t):
             if len(tracker_ids_t) > 0:
                 unique_ids, counts = np.unique(tracker_ids_t, return_counts=True)
                 if np.max(counts) != 1:
@@ -374,3 +537,19 @@ class _BaseDataset(ABC):
                         exc_str_init += '\n Note that this error occurred after preprocessing (but not before), ' \
                                         'so ids may not be as in file, and something seems wrong with preproc.'
                     raise TrackEvalException(exc_str)
+
+    @staticmethod
+    def _first_duplicate_timestep(ids):
+        """First timestep in which an id occurs more than once, given a list (for each timestep) of 1D NDArrays of ids.
+        Returns the number of timesteps if all ids are unique per timestep."""
+        timesteps = np.repeat(np.arange(len(ids)), [len(ids_t) for ids_t in ids])
+        if len(timesteps) == 0:
+            return len(ids)
+        ids_all = np.concatenate(ids)
+        order = np.lexsort((ids_all, timesteps))
+        timesteps = timesteps[order]
+        ids_all = ids_all[order]
+        is_duplicate = (timesteps[1:] == timesteps[:-1]) & (ids_all[1:] == ids_all[:-1])
+        if not np.any(is_duplicate):
+            return len(ids)
+        return timesteps[1:][is_duplicate][0]
@@ -481,3 +481,7 @@ class MotChallenge2DBox(_BaseDataset):
     def _calculate_similarities(self, gt_dets_t, tracker_dets_t):
         similarity_scores = self._calculate_box_ious(gt_dets_t, tracker_dets_t, box_format='xywh')
         return similarity_scores
+
+    def _calculate_sequence_similarities(self, gt_dets, tracker_dets):
+        similarity_scores = self._calculate_sequence_box_ious(gt_dets, tracker_dets, box_format='xywh')
+        return similarity_scores
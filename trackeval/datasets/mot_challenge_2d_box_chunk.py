@@ -1,11 +1,15 @@
 import os
 import csv
+import hashlib
+import zipfile
 import configparser
 import numpy as np
-from scipy.optimize import linear_sum_assignment
-from ._base_dataset import _BaseDataset
+from ._base_dataset import _BaseDataset, gt_cache
+from . import mot_rows
 from .. import utils
 from .. import _timing
+from .. import _sparse
+from .. import _matching
 from ..utils import TrackEvalException
 
 
@@ -39,6 +43,20 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
                                       # If True, then the middle 'benchmark-split' folder is skipped for both.
             't0': 1,  # Start time for evaluation
             't1': None,  # End time for evaluation (if None, last timestep is used)
+            'TRACKER_FILES': None,  # If not None, dict {tracker: {seq: file}} of tracker files to read instead of
+                                    # TRACKERS_FOLDER/tracker/TRACKER_SUB_FOLDER/seq.txt (e.g. uploaded files)
+            'TRACKER_ZIP_FILES': None,  # If not None, dict {tracker: zip_file} of zip files holding the tracker files as
+                                        # seq.txt (in any folder of the zip), which are read without extracting them
+            'TRACKER_ROWS': None,  # If not None, dict {tracker: {seq: rows}} of already parsed tracker data (float arrays
+                                   # of file rows sorted by frame, see mot_rows) to use instead of any tracker file
+            'ROWS_CACHE_FOLDER': os.path.join(code_path, '.cache/mot_rows/'),  # Where parsed gt and tracker files are
+                                                                               # cached as .npy files (None: no cache)
+            'ROWS_CACHE_BYTES': 1024 ** 3,  # Disk budget of ROWS_CACHE_FOLDER, beyond which the least recently used
+                                            # files are removed (e.g. those of old uploads)
+            'SPARSE_SIMILARITY': False,  # Whether to store similarity scores as sparse matrices (saves memory and IOU
+                                         # time in crowded sequences, where most gt and tracker dets do not overlap)
+            'GT_CACHE_BYTES': 1024 ** 3,  # Memory budget of the process-wide cache of raw and preprocessed gt data,
+                                          # which is shared by all evaluations of a sequence (0: no cache)
         }
         return default_config
 
@@ -84,10 +102,21 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
         self.valid_class_numbers = list(self.class_name_to_class_id.values())
 
         # Get sequences to eval and check gt files exist
-        self.seq_list, self.seq_lengths = self._get_seq_info()
+        self.seq_list, self.full_seq_lengths = self._get_seq_info()
         if len(self.seq_list) < 1:
             raise TrackEvalException('No sequences are selected to be evaluated.')
 
+        # Only frames [t0, t1] of each sequence are evaluated, as timesteps 0 to t1 - t0.
+        self.seq_windows = {}
+        self.seq_lengths = {}
+        for seq in self.seq_list:
+            t1 = self.full_seq_lengths[seq] if self.t1 is None else self.t1
+            if not 1 <= self.t0 <= t1 <= self.full_seq_lengths[seq]:
+                raise TrackEvalException('Invalid frame range [%s, %s] for sequence %s with %i frames.' % (
+                    self.t0, self.t1, seq, self.full_seq_lengths[seq]))
+            self.seq_windows[seq] = (self.t0, t1)
+            self.seq_lengths[seq] = t1 - self.t0 + 1
+
         # Check gt files exist
         for seq in self.seq_list:
             if not self.data_is_zipped:
@@ -115,8 +144,27 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
         else:
             raise TrackEvalException('List of tracker files and tracker display names do not match.')
 
+        self.rows_cache_fol = self.config['ROWS_CACHE_FOLDER']
+        self.rows_cache_bytes = self.config['ROWS_CACHE_BYTES']
+        self.sparse_similarity = self.config['SPARSE_SIMILARITY']
+        gt_cache.resize(self.config['GT_CACHE_BYTES'])
+
+        self.tracker_files = self.config['TRACKER_FILES'] or {}
+        self.tracker_rows = self.config['TRACKER_ROWS'] or {}
+        self.tracker_zip_files = self.config['TRACKER_ZIP_FILES'] or {}
+        self.tracker_zip_members = {}
         for tracker in self.tracker_list:
-            if self.data_is_zipped:
+            if tracker in self.tracker_rows:
+                for seq in self.seq_list:
+                    if seq not in self.tracker_rows[tracker]:
+                        raise TrackEvalException('Tracker data not given: ' + tracker + '/' + seq)
+            elif tracker in self.tracker_zip_files:
+                self.tracker_zip_members[tracker] = self._get_zip_members(self.tracker_zip_files[tracker], tracker)
+            elif tracker in self.tracker_files:
+                for seq in self.seq_list:
+                    if not os.path.isfile(self.tracker_files[tracker].get(seq, '')):
+                        raise TrackEvalException('Tracker file not found: ' + tracker + '/' + seq)
+            elif self.data_is_zipped:
                 curr_file = os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol + '.zip')
                 if not os.path.isfile(curr_file):
                     print('Tracker file not found: ' + curr_file)
@@ -177,6 +225,66 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
                     seq_lengths[seq] = int(ini_data['Sequence']['seqLength'])
         return seq_list, seq_lengths
 
+    def _get_zip_members(self, zip_file, tracker):
+        """Returns {seq: file in the zip} for the tracker files of all sequences in a zip file (seq.txt files can be in
+        any folder of the zip)"""
+        try:
+            with zipfile.ZipFile(zip_file, 'r') as archive:
+                names = archive.namelist()
+        except (OSError, zipfile.BadZipFile):
+            raise TrackEvalException('Tracker zip file cannot be read: ' + tracker + '/' + os.path.basename(zip_file))
+        members = {}
+        for name in names:
+            seq = os.path.splitext(os.path.basename(name))[0]
+            if seq in self.seq_list and name.endswith('.txt') and seq not in members:
+                members[seq] = name
+        for seq in self.seq_list:
+            if seq not in members:
+                raise TrackEvalException('Tracker file not found: ' + tracker + '/' + seq + '.txt in ' +
+                                         os.path.basename(zip_file))
+        return members
+
+    def _get_file_location(self, tracker, seq, is_gt):
+        """Returns the (file, is_zipped, zip_file) from which the gt or tracker data of a sequence is loaded"""
+        if not is_gt and tracker in self.tracker_zip_files:
+            zip_file = self.tracker_zip_files[tracker]
+            file = self.tracker_zip_members[tracker][seq]
+            is_zipped = True
+        elif not is_gt and tracker in self.tracker_files:
+            zip_file = None
+            file = self.tracker_files[tracker][seq]
+            is_zipped = False
+        elif self.data_is_zipped:
+            if is_gt:
+                zip_file = os.path.join(self.gt_fol, 'data.zip')
+            else:
+                zip_file = os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol + '.zip')
+            file = seq + '.txt'
+            is_zipped = True
+        else:
+            zip_file = None
+            if is_gt:
+                file = self.config["GT_LOC_FORMAT"].format(gt_folder=self.gt_fol, seq=seq)
+            else:
+                file = os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol, seq + '.txt')
+            is_zipped = False
+        return file, is_zipped, zip_file
+
+    def _get_gt_cache_key(self, seq):
+        """Gt data is identified by the gt file version (path, modification time and size), the frames evaluated and a
+        hash of the config options used to load and preprocess it"""
+        file, is_zipped, zip_file = self._get_file_location(None, seq, is_gt=True)
+        try:
+            file_key = mot_rows._file_key(file, is_zipped, zip_file)
+        except OSError:
+            return None
+        gt_config = {key: self.config[key] for key in ['BENCHMARK', 'SPLIT_TO_EVAL', 'INPUT_AS_ZIP', 'DO_PREPROC',
+                                                       'GT_LOC_FORMAT']}
+        gt_config['seq_window'] = self.seq_windows[seq]
+        gt_config['full_seq_length'] = self.full_seq_lengths[seq]
+        config_hash = hashlib.sha1(repr(sorted(gt_config.items())).encode('utf-8')).hexdigest()
+        return self.get_name(), seq, config_hash, file_key
+
     def _load_raw_file(self, tracker, seq, is_gt):
         """Load a file (gt or tracker) in the MOT Challenge 2D box format
         Handles both the data format and any exceptions or errors that might arise due to the data's structure or content
@@ -191,27 +299,29 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
         [tracker_dets]: list (for each timestep) of lists of detections. dets: Lists of bounding box coordinates for each detection
         """
         # File location
-        if self.data_is_zipped:
-            if is_gt:
-                zip_file = os.path.join(self.gt_fol, 'data.zip')
+        file, is_zipped, zip_file = self._get_file_location(tracker, seq, is_gt)
+
+        # Load all rows of the file (parsed once and then kept in memory and in the rows cache), sorted by frame
+        try:
+            if not is_gt and tracker in self.tracker_rows:
+                rows = self.tracker_rows[tracker][seq]
             else:
-                zip_file = os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol + '.zip')
-            file = seq + '.txt'
-        else:
-            zip_file = None
+                rows = mot_rows.load_rows(file, is_zipped=is_zipped, zip_file=zip_file,
+                                          cache_folder=self.rows_cache_fol, cache_max_bytes=self.rows_cache_bytes)
+        except ValueError:
             if is_gt:
-                file = self.config["GT_LOC_FORMAT"].format(gt_folder=self.gt_fol, seq=seq)
+                raise TrackEvalException(
+                    'Cannot convert gt data for sequence %s to float. Is data corrupted?' % seq)
             else:
-                file = os.path.join(self.tracker_fol, tracker, self.tracker_sub_fol, seq + '.txt')
-
-        # Load raw data from text file
-        read_data, ignore_data = self._load_simple_text_file(file, is_zipped=self.data_is_zipped, zip_file=zip_file)
-        # read_data is a dict, with keys as time steps and values as list of detections for that time step
-        # check the end of _load_simple_text_file() in _base_dataset.py for more details
+                raise TrackEvalException(
+                    'Cannot convert tracking data from tracker %s, sequence %s to float. Is data corrupted?' % (
+                        tracker, seq))
 
         # Convert data to required format
-        num_timesteps = self.seq_lengths[seq] 
+        num_timesteps = self.seq_lengths[seq]
         # e.g self.seq_lengths = {'MOT16-02': 600, 'MOT16-04': 1050, 'MOT16-05': 837} -> num_timesteps = 600
+        # timestep t holds frame t0 + t of the sequence
+        t0, t1 = self.seq_windows[seq]
 
         data_keys = ['ids', 'classes', 'dets']
         if is_gt:
@@ -221,21 +331,9 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
         raw_data = {key: [None] * num_timesteps for key in data_keys}
         # e.g raw_data = {'ids': [None, None, None, ..., None], 'classes': [None, None, None, ..., None], 'dets': [None, None, None, ..., None], 'gt_crowd_ignore_regions': [None, None, None, ..., None], 'gt_extras': [None, None, None, ..., None]}
 
-        # Check for any extra time keys
-
-        assert self.t1 + 1 - self.t0 == num_timesteps
-
-        current_time_keys = [str(t) for t in range(self.t0, self.t1+1)]
-        extra_time_keys = [x for x in read_data.keys() if x not in current_time_keys]
-
-        ###debug#####
-        # print('==========debug==========')
-        # print('seq:', seq)
-        # print('num_timesteps:', num_timesteps)
-        # print('current_time_keys:', current_time_keys)
-        # print('extra_time_keys:', extra_time_keys)
-        # print('==========end debug==========')
-        #############
+        # Check for any extra time keys (frames outside of the whole sequence, frames outside of [t0, t1] are skipped)
+        frames = mot_rows.get_frames(rows)
+        extra_time_keys = np.unique(frames[(frames < 1) | (frames > self.full_seq_lengths[seq])])
         if len(extra_time_keys) > 0:
             if is_gt:
                 text = 'Ground-truth'
@@ -245,23 +343,10 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
                 text + ' data contains the following invalid timesteps in seq %s: ' % seq + ', '.join(
                     [str(x) + ', ' for x in extra_time_keys]))
 
-        for t in range(num_timesteps):
-            time_key = str(t+1)
-            if time_key in read_data.keys():
-                try:
-                    time_data = np.asarray(read_data[time_key], dtype=np.float)
-                except ValueError:
-                    if is_gt:
-                        raise TrackEvalException(
-                            'Cannot convert gt data for sequence %s to float. Is data corrupted?' % seq)
-                    else:
-                        raise TrackEvalException(
-                            'Cannot convert tracking data from tracker %s, sequence %s to float. Is data corrupted?' % (
-                                tracker, seq))
-                try:
-                    raw_data['dets'][t] = np.atleast_2d(time_data[:, 2:6])
-                    raw_data['ids'][t] = np.atleast_1d(time_data[:, 1]).astype(int)
-                except IndexError:
+        for t, time_data in enumerate(mot_rows.split_by_frame(rows, t0, t1)):
+            if len(time_data) > 0:
+                num_cols = mot_rows.num_columns(time_data)
+                if num_cols < 7:
                     if is_gt:
                         err = 'Cannot load gt data from sequence %s, because there is not enough ' \
                               'columns in the data.' % seq
@@ -270,7 +355,9 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
                         err = 'Cannot load tracker data from tracker %s, sequence %s, because there is not enough ' \
                               'columns in the data.' % (tracker, seq)
                         raise TrackEvalException(err)
-                if time_data.shape[1] >= 8:
+                raw_data['dets'][t] = np.atleast_2d(time_data[:, 2:6])
+                raw_data['ids'][t] = np.atleast_1d(time_data[:, 1]).astype(int)
+                if num_cols >= 8:
                     raw_data['classes'][t] = np.atleast_1d(time_data[:, 7]).astype(int)
                 else:
                     if not is_gt:
@@ -308,8 +395,6 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
             raw_data[v] = raw_data.pop(k)
         raw_data['num_timesteps'] = num_timesteps
         raw_data['seq'] = seq
-        # print('='*50)
-        # print('raw_data:', raw_data)
         return raw_data
         '''
         raw_data is a dic with different keys, each key have a list of values, each value is a numpy array, 
@@ -354,7 +439,9 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
                     [num_timesteps, num_gt_ids, num_tracker_ids, num_gt_dets, num_tracker_dets] : integers.
                     [gt_ids, tracker_ids, tracker_confidences]: list (for each timestep) of 1D NDArrays (for each det).
                     [gt_dets, tracker_dets]: list (for each timestep) of lists of detections.
-                    [similarity_scores]: list (for each timestep) of 2D NDArrays.
+                    [similarity_scores]: list (for each timestep) of 2D NDArrays (or sparse matrices if
+                                         SPARSE_SIMILARITY).
+                    [gt_id_values, tracker_id_values]: 1D NDArrays of the original id of each relabelled id.
         Notes:
             General preprocessing (preproc) occurs in 4 steps. Some datasets may not use all of these steps.
                 1) Extract only detections relevant for the class to be evaluated (including distractor detections).
@@ -378,109 +465,93 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
         # Check that input data has unique ids
         self._check_unique_ids(raw_data)
 
-        distractor_class_names = ['person_on_vehicle', 'static_person', 'distractor', 'reflection']
-        if self.benchmark == 'MOT20':
-            distractor_class_names.append('non_mot_vehicle')
-        distractor_classes = [self.class_name_to_class_id[x] for x in distractor_class_names]
-        cls_id = self.class_name_to_class_id[cls]
-
-        data_keys = ['gt_ids', 'tracker_ids', 'gt_dets', 'tracker_dets', 'tracker_confidences', 'similarity_scores']
-        data = {key: [None] * raw_data['num_timesteps'] for key in data_keys}
-        unique_gt_ids = []
-        unique_tracker_ids = []
-        num_gt_dets = 0
-        num_tracker_dets = 0
-        for t in range(raw_data['num_timesteps']):
-
-            # Get all data
-            gt_ids = raw_data['gt_ids'][t]
-            gt_dets = raw_data['gt_dets'][t]
-            gt_classes = raw_data['gt_classes'][t]
-            gt_zero_marked = raw_data['gt_extras'][t]['zero_marked']
-
-            tracker_ids = raw_data['tracker_ids'][t]
-            tracker_dets = raw_data['tracker_dets'][t]
-            tracker_classes = raw_data['tracker_classes'][t]
-            tracker_confidences = raw_data['tracker_confidences'][t]
-            similarity_scores = raw_data['similarity_scores'][t]
-
-            # Evaluation is ONLY valid for pedestrian class
-            if len(tracker_classes) > 0 and np.max(tracker_classes) > 1:
-                raise TrackEvalException(
-                    'Evaluation is only valid for pedestrian class. Non pedestrian class (%i) found in sequence %s at '
-                    'timestep %i.' % (np.max(tracker_classes), raw_data['seq'], t))
-
-            # Match tracker and gt dets (with hungarian algorithm) and remove tracker dets which match with gt dets
-            # which are labeled as belonging to a distractor class.
-            to_remove_tracker = np.array([], np.int)
-            if self.do_preproc and self.benchmark != 'MOT15' and gt_ids.shape[0] > 0 and tracker_ids.shape[0] > 0:
-
-                # Check all classes are valid:
-                invalid_classes = np.setdiff1d(np.unique(gt_classes), self.valid_class_numbers)
-                if len(invalid_classes) > 0:
-                    print(' '.join([str(x) for x in invalid_classes]))
-                    raise(TrackEvalException('Attempting to evaluate using invalid gt classes. '
-                                             'This warning only triggers if preprocessing is performed, '
-                                             'e.g. not for MOT15 or where prepropressing is explicitly disabled. '
-                                             'Please either check your gt data, or disable preprocessing. '
-                                             'The following invalid classes were found in timestep ' + str(t) + ': ' +
-                                             ' '.join([str(x) for x in invalid_classes])))
-
-                matching_scores = similarity_scores.copy()
+        # Gt-side preprocessing does not depend on the tracker, so it is shared by all trackers (and evaluations) of
+        # the sequence through the gt cache.
+        gt_data = self._get_cached_gt(raw_data.get('gt_cache_key'), 'preprocessed_gt_' + cls,
+                                      lambda: self._preprocess_gt(raw_data, cls))
+        num_timesteps = raw_data['num_timesteps']
+        gt_offsets = gt_data['gt_offsets']
+
+        # Concatenate the tracker dets of all timesteps, so that preprocessing is applied to the whole sequence at
+        # once. The dets of timestep t are [offsets[t], offsets[t + 1]) of the concatenated arrays.
+        tracker_offsets = np.concatenate(([0], np.cumsum([len(ids) for ids in raw_data['tracker_ids']])))
+        tracker_timesteps = np.repeat(np.arange(num_timesteps), np.diff(tracker_offsets))
+        tracker_ids = np.concatenate(raw_data['tracker_ids'])
+        tracker_dets = np.concatenate(raw_data['tracker_dets'])
+        tracker_classes = np.concatenate(raw_data['tracker_classes'])
+        tracker_confidences = np.concatenate(raw_data['tracker_confidences'])
+
+        do_matching = self.do_preproc and self.benchmark != 'MOT15'
+        is_matched_timestep = (np.diff(gt_offsets) > 0) & (np.diff(tracker_offsets) > 0)
+
+        # Evaluation is ONLY valid for pedestrian class, and all gt classes must be valid in timesteps which are
+        # matched. Errors are raised for the first timestep with either problem.
+        invalid_tracker_timesteps = tracker_timesteps[tracker_classes > 1]
+        first_invalid_tracker_t = invalid_tracker_timesteps[0] if len(invalid_tracker_timesteps) > 0 else num_timesteps
+        first_invalid_gt_t = num_timesteps
+        if do_matching:
+            invalid_gt_timesteps = gt_data['invalid_class_timesteps']
+            invalid_gt_timesteps = invalid_gt_timesteps[is_matched_timestep[invalid_gt_timesteps]]
+            if len(invalid_gt_timesteps) > 0:
+                first_invalid_gt_t = invalid_gt_timesteps[0]
+        if first_invalid_tracker_t < num_timesteps and first_invalid_tracker_t <= first_invalid_gt_t:
+            t = first_invalid_tracker_t
+            raise TrackEvalException(
+                'Evaluation is only valid for pedestrian class. Non pedestrian class (%i) found in sequence %s at '
+                'timestep %i.' % (np.max(tracker_classes[tracker_offsets[t]:tracker_offsets[t + 1]]), raw_data['seq'],
+                                  t))
+        if first_invalid_gt_t < num_timesteps:
+            t = first_invalid_gt_t
+            invalid_classes = np.setdiff1d(np.unique(raw_data['gt_classes'][t]), self.valid_class_numbers)
+            print(' '.join([str(x) for x in invalid_classes]))
+            raise(TrackEvalException('Attempting to evaluate using invalid gt classes. '
+                                     'This warning only triggers if preprocessing is performed, '
+                                     'e.g. not for MOT15 or where prepropressing is explicitly disabled. '
+                                     'Please either check your gt data, or disable preprocessing. '
+                                     'The following invalid classes were found in timestep ' + str(t) + ': ' +
+                                     ' '.join([str(x) for x in invalid_classes])))
+
+        # Match tracker and gt dets (with hungarian algorithm) and remove tracker dets which match with gt dets
+        # which are labeled as belonging to a distractor class. Only tracker dets matched to a distractor can be
+        # removed, so only timesteps which have gt dets of a distractor class need to be matched.
+        tracker_to_keep_mask = np.ones(len(tracker_ids), dtype=bool)
+        if do_matching:
+            for t in np.flatnonzero(gt_data['is_distractor_timestep'] & is_matched_timestep):
+                matching_scores = _sparse.to_dense(raw_data['similarity_scores'][t]).copy()
                 matching_scores[matching_scores < 0.5 - np.finfo('float').eps] = 0
-                match_rows, match_cols = linear_sum_assignment(-matching_scores)
+                match_rows, match_cols = _matching.match_positive(matching_scores)
                 actually_matched_mask = matching_scores[match_rows, match_cols] > 0 + np.finfo('float').eps
                 match_rows = match_rows[actually_matched_mask]
                 match_cols = match_cols[actually_matched_mask]
 
-                is_distractor_class = np.isin(gt_classes[match_rows], distractor_classes)
-                to_remove_tracker = match_cols[is_distractor_class]
-
-            # Apply preprocessing to remove all unwanted tracker dets.
-            data['tracker_ids'][t] = np.delete(tracker_ids, to_remove_tracker, axis=0)
-            data['tracker_dets'][t] = np.delete(tracker_dets, to_remove_tracker, axis=0)
-            data['tracker_confidences'][t] = np.delete(tracker_confidences, to_remove_tracker, axis=0)
-            similarity_scores = np.delete(similarity_scores, to_remove_tracker, axis=1)
-
-            # Remove gt detections marked as to remove (zero marked), and also remove gt detections not in pedestrian
-            # class (not applicable for MOT15)
-            if self.do_preproc and self.benchmark != 'MOT15':
-                gt_to_keep_mask = (np.not_equal(gt_zero_marked, 0)) & \
-                                  (np.equal(gt_classes, cls_id))
-            else:
-                # There are no classes for MOT15
-                gt_to_keep_mask = np.not_equal(gt_zero_marked, 0)
-            data['gt_ids'][t] = gt_ids[gt_to_keep_mask]
-            data['gt_dets'][t] = gt_dets[gt_to_keep_mask, :]
-            data['similarity_scores'][t] = similarity_scores[gt_to_keep_mask]
-
-            unique_gt_ids += list(np.unique(data['gt_ids'][t]))
-            unique_tracker_ids += list(np.unique(data['tracker_ids'][t]))
-            num_tracker_dets += len(data['tracker_ids'][t])
-            num_gt_dets += len(data['gt_ids'][t])
+                is_distractor_class = gt_data['is_distractor'][gt_offsets[t] + match_rows]
+                tracker_to_keep_mask[tracker_offsets[t] + match_cols[is_distractor_class]] = False
 
         # Re-label IDs such that there are no empty IDs
-        if len(unique_gt_ids) > 0:
-            unique_gt_ids = np.unique(unique_gt_ids)
-            gt_id_map = np.nan * np.ones((np.max(unique_gt_ids) + 1))
-            gt_id_map[unique_gt_ids] = np.arange(len(unique_gt_ids))
-            for t in range(raw_data['num_timesteps']):
-                if len(data['gt_ids'][t]) > 0:
-                    data['gt_ids'][t] = gt_id_map[data['gt_ids'][t]].astype(np.int)
-        if len(unique_tracker_ids) > 0:
-            unique_tracker_ids = np.unique(unique_tracker_ids)
-            tracker_id_map = np.nan * np.ones((np.max(unique_tracker_ids) + 1))
-            tracker_id_map[unique_tracker_ids] = np.arange(len(unique_tracker_ids))
-            for t in range(raw_data['num_timesteps']):
-                if len(data['tracker_ids'][t]) > 0:
-                    data['tracker_ids'][t] = tracker_id_map[data['tracker_ids'][t]].astype(np.int)
+        unique_tracker_ids, tracker_ids = np.unique(tracker_ids[tracker_to_keep_mask], return_inverse=True)
+
+        # Apply preprocessing to the dets of each timestep
+        gt_to_keep_mask = gt_data['gt_to_keep_mask']
+        tracker_split = np.concatenate(([0], np.cumsum(tracker_to_keep_mask)))[tracker_offsets[1:-1]]
+        data = {'gt_ids': gt_data['gt_ids'],
+                'gt_dets': gt_data['gt_dets'],
+                'tracker_ids': np.split(tracker_ids.ravel(), tracker_split),
+                'tracker_dets': np.split(tracker_dets[tracker_to_keep_mask], tracker_split),
+                'tracker_confidences': np.split(tracker_confidences[tracker_to_keep_mask], tracker_split),
+                'similarity_scores': [None] * num_timesteps}
+        for t in range(num_timesteps):
+            data['similarity_scores'][t] = _sparse.select(
+                raw_data['similarity_scores'][t], np.flatnonzero(gt_to_keep_mask[gt_offsets[t]:gt_offsets[t + 1]]),
+                np.flatnonzero(tracker_to_keep_mask[tracker_offsets[t]:tracker_offsets[t + 1]]))
 
         # Record overview statistics.
-        data['num_tracker_dets'] = num_tracker_dets
-        data['num_gt_dets'] = num_gt_dets
+        data['num_tracker_dets'] = len(tracker_ids)
+        data['num_gt_dets'] = gt_data['num_gt_dets']
         data['num_tracker_ids'] = len(unique_tracker_ids)
-        data['num_gt_ids'] = len(unique_gt_ids)
+        data['num_gt_ids'] = gt_data['num_gt_ids']
         data['num_timesteps'] = raw_data['num_timesteps']
+        data['gt_id_values'] = gt_data['gt_id_values']
+        data['tracker_id_values'] = unique_tracker_ids.astype(int)
         data['seq'] = raw_data['seq']
 
         # Ensure again that ids are unique per timestep after preproc.
@@ -488,6 +559,64 @@ class MotChallenge2DBox_CHUNK(_BaseDataset):
 
         return data
 
+    def _preprocess_gt(self, raw_data, cls):
+        """ Gt-side preprocessing of a sequence for the class to be evaluated (see get_preprocessed_seq_data()), which
+        only depends on the gt data. Returns a dict with the preprocessed gt_ids (relabelled to be contiguous) and
+        gt_dets of each timestep, their numbers of ids and dets, and the concatenated per-det arrays (and gt_offsets
+        of each timestep in them) used to preprocess the tracker dets.
+        """
+        distractor_class_names = ['person_on_vehicle', 'static_person', 'distractor', 'reflection']
+        if self.benchmark == 'MOT20':
+            distractor_class_names.append('non_mot_vehicle')
+        distractor_classes = [self.class_name_to_class_id[x] for x in distractor_class_names]
+        cls_id = self.class_name_to_class_id[cls]
+
+        # Concatenate the gt dets of all timesteps. The dets of timestep t are [gt_offsets[t], gt_offsets[t + 1]).
+        num_timesteps = raw_data['num_timesteps']
+        gt_offsets = np.concatenate(([0], np.cumsum([len(ids) for ids in raw_data['gt_ids']])))
+        gt_timesteps = np.repeat(np.arange(num_timesteps), np.diff(gt_offsets))
+        gt_ids = np.concatenate(raw_data['gt_ids'])
+        gt_dets = np.concatenate(raw_data['gt_dets'])
+        gt_classes = np.concatenate(raw_data['gt_classes'])
+        gt_zero_marked = np.concatenate([extras['zero_marked'] for extras in raw_data['gt_extras']])
+
+        # Gt dets which can remove the tracker dets they are matched to
+        is_distractor = np.isin(gt_classes, distractor_classes)
+        is_distractor_timestep = np.zeros(num_timesteps, dtype=bool)
+        is_distractor_timestep[gt_timesteps[is_distractor]] = True
+
+        # Remove gt detections marked as to remove (zero marked), and also remove gt detections not in pedestrian
+        # class (not applicable for MOT15)
+        if self.do_preproc and self.benchmark != 'MOT15':
+            gt_to_keep_mask = (np.not_equal(gt_zero_marked, 0)) & \
+                              (np.equal(gt_classes, cls_id))
+        else:
+            # There are no classes for MOT15
+            gt_to_keep_mask = np.not_equal(gt_zero_marked, 0)
+
+        # Re-label IDs such that there are no empty IDs
+        unique_gt_ids, gt_ids = np.unique(gt_ids[gt_to_keep_mask], return_inverse=True)
+        gt_split = np.concatenate(([0], np.cumsum(gt_to_keep_mask)))[gt_offsets[1:-1]]
+
+        gt_data = {'gt_ids': np.split(gt_ids.ravel(), gt_split),
+                   'gt_dets': np.split(gt_dets[gt_to_keep_mask], gt_split),
+                   'num_gt_ids': len(unique_gt_ids),
+                   'gt_id_values': unique_gt_ids.astype(int),
+                   'num_gt_dets': len(gt_ids),
+                   'gt_offsets': gt_offsets,
+                   'gt_to_keep_mask': gt_to_keep_mask,
+                   'is_distractor': is_distractor,
+                   'is_distractor_timestep': is_distractor_timestep,
+                   'invalid_class_timesteps': gt_timesteps[~np.isin(gt_classes, self.valid_class_numbers)]}
+        return gt_data
+
     def _calculate_similarities(self, gt_dets_t, tracker_dets_t):
         similarity_scores = self._calculate_box_ious(gt_dets_t, tracker_dets_t, box_format='xywh')
         return similarity_scores
+
+    def _calculate_sequence_similarities(self, gt_dets, tracker_dets):
+        if self.sparse_similarity:
+            similarity_scores = self._calculate_sequence_sparse_box_ious(gt_dets, tracker_dets, box_format='xywh')
+        else:
+            similarity_scores = self._calculate_sequence_box_ious(gt_dets, tracker_dets, box_format='xywh')
+        return similarity_scores
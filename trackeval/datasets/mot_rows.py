@@ -0,0 +1,220 @@
+"""Frame-sorted array representation of MOT Challenge style text files.
+
+A file is held as a single 2D float array (one row per det, columns as in the text file), stably sorted by the frame
+column. Any window of frames [t0, t1] is then a contiguous slice of this array which can be found with a binary search,
+so files only need to be parsed once and can be cut into frame windows without touching the filesystem.
+
+Parsed rows can also be cached on disk as .npy files (one per version of a file), which later loads memory-map instead
+of parsing the text file again, also across processes and runs. The offsets of each frame are not stored, as the frame
+column is sorted and they are found with a binary search. Both caches have a size budget, beyond which the least
+recently used files are dropped.
+"""
+import io
+import os
+import hashlib
+import zipfile
+import warnings
+import numpy as np
+from ._base_dataset import _BaseDataset
+from ..utils import LRUCache, TrackEvalException
+
+# Parsed rows of recently read files, keyed by (path, mtime, size) so that edited files are re-read.
+rows_cache = LRUCache(max_bytes=1024 ** 3)
+
+
+def _file_key(file, is_zipped=False, zip_file=None):
+    """Key used to identify a (possibly zipped) file and its version"""
+    path = zip_file if is_zipped else file
+    stat = os.stat(path)
+    return os.path.abspath(path), file if is_zipped else None, stat.st_mtime_ns, stat.st_size
+
+
+def _cache_file(key, cache_folder):
+    """Location of the .npy file caching the rows of the file version identified by key"""
+    return os.path.join(cache_folder, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.npy')
+
+
+def load_rows(file, is_zipped=False, zip_file=None, cache_folder=None, cache_max_bytes=1024 ** 3):
+    """ Loads a MOT Challenge text file as a (num_dets, num_cols) float array sorted by frame.
+    The parsed array is cached in memory (rows_cache), so later calls for an unchanged file do not read it again. If
+    cache_folder is given, it is also cached there as a .npy file, which is memory-mapped by later loads (in any
+    process). The least recently used .npy files are removed when they take more than cache_max_bytes.
+    Raises a TrackEvalException if the file cannot be read, and a ValueError if its values cannot be converted to
+    float (e.g. non-numeric values or an inconsistent number of columns).
+    """
+    key = _file_key(file, is_zipped, zip_file)
+    rows = rows_cache.get(key)
+    if rows is None:
+        if cache_folder is not None:
+            rows = _load_cached_rows(_cache_file(key, cache_folder))
+        if rows is None:
+            rows = read_rows(file, is_zipped=is_zipped, zip_file=zip_file)
+            if cache_folder is not None:
+                _save_cached_rows(rows, _cache_file(key, cache_folder))
+                _prune_cache_folder(cache_folder, cache_max_bytes)
+        # Rows are shared by every later load, so they must never be modified in place.
+        rows.flags.writeable = False
+        rows_cache.put(key, rows)
+    return rows
+
+
+def _load_cached_rows(cache_file):
+    """Memory-maps rows cached on disk, returning None if they are not cached (or the cache file is unreadable)"""
+    if not os.path.isfile(cache_file):
+        return None
+    try:
+        rows = np.load(cache_file, mmap_mode='r')
+        # Mark the file as recently used for _prune_cache_folder()
+        os.utime(cache_file)
+    except (OSError, ValueError):
+        return None
+    if rows.size == 0:
+        # Empty arrays cannot be memory-mapped.
+        rows = np.empty(rows.shape)
+    return rows
+
+
+def _save_cached_rows(rows, cache_file):
+    """Writes rows to the disk cache. The file is written under a temporary name and then renamed, so that other
+    processes never read a partially written file. Failing to write the cache is not an error."""
+    tmp_file = '%s.%i.tmp' % (cache_file, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp_file, 'wb') as fp:
+            np.save(fp, rows)
+        os.replace(tmp_file, cache_file)
+    except OSError:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+
+
+def _prune_cache_folder(cache_folder, max_bytes):
+    """Removes the least recently used (written or loaded) .npy files of the disk cache until they take at most
+    max_bytes. Files which cannot be removed (e.g. memory-mapped on Windows) are skipped."""
+    try:
+        cache_files = [(entry.stat().st_mtime_ns, entry.stat().st_size, entry.path)
+                       for entry in os.scandir(cache_folder) if entry.name.endswith('.npy')]
+    except OSError:
+        return
+    num_bytes = 0
+    for _, size, cache_file in sorted(cache_files, reverse=True):
+        num_bytes += size
+        if num_bytes > max_bytes:
+            try:
+                os.remove(cache_file)
+            except OSError:
+                pass
+
+
+def read_rows(file, is_zipped=False, zip_file=None):
+    """ Parses a MOT Challenge text file (without any caching) into a float array of rows sorted by frame.
+    Files in the usual format (comma separated, the same number of numeric columns in every row) are parsed with a
+    single bulk numpy call. Anything else falls back to _load_simple_text_file(), which handles other delimiters and
+    raises the same errors as before for unreadable or invalid files.
+    """
+    rows = None
+    content = _read_bytes(file, is_zipped, zip_file)
+    if content is not None:
+        rows = parse_rows(content)
+    if rows is None:
+        read_data, _ = _BaseDataset._load_simple_text_file(file, is_zipped=is_zipped, zip_file=zip_file)
+        return rows_from_read_data(read_data)
+    return sort_rows(rows)
+
+
+def _read_bytes(file, is_zipped=False, zip_file=None):
+    """Reads the content of a (possibly zipped) file, returning None if it cannot be read"""
+    try:
+        if is_zipped:
+            with zipfile.ZipFile(zip_file, 'r') as archive:
+                return archive.read(file)
+        with io.open(file, 'rb') as fp:
+            return fp.read()
+    except (OSError, KeyError, TypeError, zipfile.BadZipFile):
+        return None
+
+
+def parse_rows(content):
+    """ Parses the bytes of a comma separated text file of numbers into a (num_rows, num_cols) float array, in file
+    order. Returns None if the content is not in this format (e.g. other delimiters, empty lines or values, a
+    different number of columns in some rows, or non-numeric values), so that it can be parsed row by row instead.
+    """
+    content = content.replace(b'\r\n', b'\n').strip()
+    if len(content) == 0:
+        return np.empty((0, 0))
+
+    # Every line must have the same number of columns
+    chars = np.frombuffer(content, dtype=np.uint8)
+    line_ends = np.append(np.flatnonzero(chars == ord('\n')), len(chars))
+    commas = np.flatnonzero(chars == ord(','))
+    commas_per_line = np.diff(np.searchsorted(commas, line_ends), prepend=0)
+    num_cols = commas_per_line[0] + 1
+    if num_cols == 1 or np.any(commas_per_line != num_cols - 1):
+        return None
+
+    # Parsing stops at the first value which is not a number, leaving too few values (with a DeprecationWarning,
+    # which newer numpy versions turn into a ValueError)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            values = np.fromstring(content.replace(b'\n', b','), sep=',')
+    except ValueError:
+        return None
+    if len(values) != len(line_ends) * num_cols:
+        return None
+    return values.reshape(len(line_ends), num_cols)
+
+
+def rows_from_read_data(read_data):
+    """ Converts the dict returned by _load_simple_text_file() into a float array of rows sorted by frame.
+    As when frames are loaded one by one, the rows of each frame must have the same number of columns, but different
+    frames may have different numbers of columns: frames with fewer columns are then padded with NaN (see
+    num_columns()).
+    """
+    frame_rows = []
+    for time_key, time_rows in read_data.items():
+        if len({len(row) for row in time_rows}) > 1:
+            raise TrackEvalException('Rows of frame %s have an inconsistent number of columns (%s).' % (
+                time_key, ', '.join(str(num_cols) for num_cols in sorted({len(row) for row in time_rows}))))
+        frame_rows.append(np.asarray(time_rows, dtype=float))
+    if len(frame_rows) == 0:
+        return np.empty((0, 0))
+    num_cols = max(time_rows.shape[1] for time_rows in frame_rows)
+    frame_rows = [np.pad(time_rows, ((0, 0), (0, num_cols - time_rows.shape[1])), constant_values=np.nan)
+                  for time_rows in frame_rows]
+    return sort_rows(np.concatenate(frame_rows))
+
+
+def num_columns(time_rows):
+    """Number of columns of the rows of one frame, without the NaN padding of rows_from_read_data() (trailing columns
+    which are NaN in every row)"""
+    num_cols = time_rows.shape[1]
+    while num_cols > 0 and np.all(np.isnan(time_rows[:, num_cols - 1])):
+        num_cols -= 1
+    return num_cols
+
+
+def sort_rows(rows):
+    """Stable sort of rows by frame, keeping the file order of dets within a frame"""
+    return rows[np.argsort(get_frames(rows), kind='stable')]
+
+
+def get_frames(rows):
+    """Integer frame number of each row"""
+    if len(rows) == 0:
+        return np.empty(0, dtype=int)
+    return rows[:, 0].astype(int)
+
+
+def get_frame_range(rows, t0, t1):
+    """Returns the contiguous block of rows with frame numbers in [t0, t1] (both inclusive)"""
+    frames = get_frames(rows)
+    start, end = np.searchsorted(frames, [t0, t1 + 1])
+    return rows[start:end]
+
+
+def split_by_frame(rows, t0, t1):
+    """Splits rows into a list with one (possibly empty) array of rows for each frame in [t0, t1]"""
+    window = get_frame_range(rows, t0, t1)
+    offsets = np.searchsorted(get_frames(window), np.arange(t0, t1 + 2))
+    return [window[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
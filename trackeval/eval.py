@@ -1,7 +1,6 @@
 import time
 import traceback
-from multiprocessing.pool import Pool
-from functools import partial
+import multiprocessing
 import os
 from . import utils
 from .utils import TrackEvalException
@@ -25,6 +24,9 @@ class Evaluator:
         default_config = {
             'USE_PARALLEL': False,
             'NUM_PARALLEL_CORES': 8,
+            # How worker processes are started ('fork', 'spawn' or 'forkserver', None for the platform default). Use
+            # 'spawn' when evaluating from a multi-threaded process (e.g. a web app), where forking may deadlock.
+            'PARALLEL_START_METHOD': None,
             'BREAK_ON_ERROR': True,  # Raises exception and exits with error
             'RETURN_ON_ERROR': False,  # if not BREAK_ON_ERROR, then returns from function on error
             'LOG_ON_ERROR': os.path.join(code_path, 'error_log.txt'),  # if not None, save any errors into a log file.
@@ -76,6 +78,19 @@ class Evaluator:
                   'metrics: %s\n' % (len(tracker_list), len(seq_list), len(class_list), dataset_name,
                                      ', '.join(metric_names)))
 
+            # Evaluate the sequences of all trackers in parallel, as a single queue of (tracker, sequence) tasks
+            if config['USE_PARALLEL']:
+                time_start = time.time()
+                try:
+                    parallel_res = self._eval_parallel(dataset, tracker_list, seq_list, class_list, metrics_list,
+                                                       metric_names, show_progressbar)
+                    if config['TIME_PROGRESS']:
+                        print('\nAll sequences of all trackers finished in %.2f seconds' % (time.time() - time_start))
+                except Exception as err:
+                    # The pool itself failed (e.g. starting the workers or pickling the dataset): this is the error of
+                    # every tracker, handled (logged, raised or skipped) for each tracker below
+                    parallel_res = {(tracker, seq): (None, err) for tracker in tracker_list for seq in seq_list}
+
             # Evaluate each tracker
             for tracker in tracker_list:
                 # if not config['BREAK_ON_ERROR'] then go to next tracker without breaking
@@ -86,27 +101,12 @@ class Evaluator:
                     print('\nEvaluating %s\n' % tracker)
                     time_start = time.time()
                     if config['USE_PARALLEL']:
-                        if show_progressbar and TQDM_IMPORTED:
-                            seq_list_sorted = sorted(seq_list)
-
-                            with Pool(config['NUM_PARALLEL_CORES']) as pool, tqdm.tqdm(total=len(seq_list)) as pbar:
-                                _eval_sequence = partial(eval_sequence, dataset=dataset, tracker=tracker,
-                                                         class_list=class_list, metrics_list=metrics_list,
-                                                         metric_names=metric_names)
-                                results = []
-                                for r in pool.imap(_eval_sequence, seq_list_sorted,
-                                                   chunksize=20):
-                                    results.append(r)
-                                    pbar.update()
-                                res = dict(zip(seq_list_sorted, results))
-
-                        else:
-                            with Pool(config['NUM_PARALLEL_CORES']) as pool:
-                                _eval_sequence = partial(eval_sequence, dataset=dataset, tracker=tracker,
-                                                         class_list=class_list, metrics_list=metrics_list,
-                                                         metric_names=metric_names)
-                                results = pool.map(_eval_sequence, seq_list)
-                                res = dict(zip(seq_list, results))
+                        # Regroup the results of the tracker's sequences (raising the first error of any of them)
+                        res = {}
+                        for curr_seq in (sorted(seq_list) if show_progressbar and TQDM_IMPORTED else seq_list):
+                            res[curr_seq], seq_err = parallel_res[tracker, curr_seq]
+                            if seq_err is not None:
+                                raise seq_err
                     else:
                         res = {}
                         if show_progressbar and TQDM_IMPORTED:
@@ -157,7 +157,7 @@ class Evaluator:
                                 res['COMBINED_SEQ'][cat][metric_name] = metric.combine_classes_det_averaged(cat_res)
 
                     # Print and output results in various formats
-                    if config['TIME_PROGRESS']:
+                    if config['TIME_PROGRESS'] and not config['USE_PARALLEL']:
                         print('\nAll sequences for %s finished in %.2f seconds' % (tracker, time.time() - time_start))
                     output_fol = dataset.get_output_fol(tracker)
                     tracker_display_name = dataset.get_display_name(tracker)
@@ -219,6 +219,50 @@ class Evaluator:
 
         return output_res, output_msg
 
+    def _eval_parallel(self, dataset, tracker_list, seq_list, class_list, metrics_list, metric_names,
+                       show_progressbar=False):
+        """ Evaluates all sequences of all trackers with a pool of workers, as a single queue of (tracker, seq) tasks,
+        so that all workers are busy even when there are fewer sequences than workers.
+        The dataset and metrics are given to each worker once, when it starts (see init_worker()), so tasks only carry
+        the (tracker, seq) to evaluate instead of pickling the dataset and metrics for every task.
+        Tasks are ordered by sequence, and consecutive tasks are sent to the same worker in chunks, so that each worker
+        mostly evaluates several trackers on the same sequence and only loads its gt data once (it is then kept in the
+        gt cache of the worker process).
+        Returns a dict {(tracker, seq): (seq_res, err)}, where err is the exception raised when evaluating the sequence
+        (or None), so that errors can be handled separately for each tracker.
+        """
+        tasks = [(tracker, seq) for seq in sorted(seq_list) for tracker in tracker_list]
+        chunksize = max(1, len(tasks) // (4 * self.config['NUM_PARALLEL_CORES']))
+        mp_context = multiprocessing.get_context(self.config['PARALLEL_START_METHOD'])
+        with mp_context.Pool(self.config['NUM_PARALLEL_CORES'], initializer=init_worker,
+                             initargs=(dataset, class_list, metrics_list, metric_names)) as pool:
+            results = pool.imap(eval_worker_task, tasks, chunksize=chunksize)
+            if show_progressbar and TQDM_IMPORTED:
+                results = tqdm.tqdm(results, total=len(tasks))
+            return dict(zip(tasks, results))
+
+
+# Dataset and metrics used by eval_worker_task() in each worker process of Evaluator._eval_parallel()
+_worker_eval_args = {}
+
+
+def init_worker(dataset, class_list, metrics_list, metric_names):
+    """Initializer of the worker processes of Evaluator._eval_parallel(), keeping the dataset and metrics to evaluate"""
+    _worker_eval_args.update(dataset=dataset, class_list=class_list, metrics_list=metrics_list,
+                             metric_names=metric_names)
+
+
+def eval_worker_task(task):
+    """Function for evaluating a single (tracker, seq) task in a worker process, returning the results of
+    eval_sequence() and the exception it raised (or None)"""
+    tracker, seq = task
+    try:
+        return eval_sequence(seq, _worker_eval_args['dataset'], tracker, _worker_eval_args['class_list'],
+                             _worker_eval_args['metrics_list'], _worker_eval_args['metric_names']), None
+    except Exception as err:
+        traceback.print_exc()
+        return None, err
+
 
 @_timing.time
 def eval_sequence(seq, dataset, tracker, class_list, metrics_list, metric_names):
@@ -5,4 +5,5 @@ from .count import Count
 from .j_and_f import JAndF
 from .track_map import TrackMAP
 from .vace import VACE
-from .ideucl import IDEucl
\ No newline at end of file
+from .ideucl import IDEucl
+from .frame_index import FrameIndex
@@ -17,6 +17,7 @@ class _BaseMetric(ABC):
         self.fields = []
         self.summary_fields = []
         self.registered = False
+        self.exact_window_eval = False
 
     #####################################################################
     # Abstract functions for subclasses to implement
@@ -38,6 +39,19 @@ class _BaseMetric(ABC):
     def combine_classes_det_averaged(self, all_res):
         ...
 
+    #####################################################################
+    # Functions for evaluating windows of timesteps (see FrameIndex), only implemented by some metrics
+
+    def get_frame_stats(self, data):
+        """Returns per-timestep statistics of one sequence, from which eval_window() calculates the metrics of any
+        window of timesteps without re-evaluating the sequence."""
+        raise NotImplementedError('Window evaluation is not implemented for metric %s' % self.get_name())
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Calculates the metrics for timesteps [t_start, t_end) of a sequence from its get_frame_stats().
+        If self.exact_window_eval, the results are identical to running eval_sequence() on just these timesteps."""
+        raise NotImplementedError('Window evaluation is not implemented for metric %s' % self.get_name())
+
     def plot_single_tracker_results(self, all_res, tracker, output_folder, cls):
         """Plot results of metrics, only valid for metrics with self.plottable"""
         if self.plottable:
@@ -63,6 +77,42 @@ class _BaseMetric(ABC):
         return sum([all_res[k][field] * all_res[k][weight_field] for k in all_res.keys()]) / np.maximum(1.0, comb_res[
             weight_field])
 
+    @staticmethod
+    def _concat_timesteps(arrays, dtype=int):
+        """Concatenates a list (over timesteps) of 1D arrays, returning the flat array and the offsets (of length
+        num_timesteps + 1) at which each timestep starts, so that timesteps [t_start, t_end) are
+        flat[offsets[t_start]:offsets[t_end]]"""
+        offsets = np.zeros(len(arrays) + 1, dtype=int)
+        offsets[1:] = np.cumsum([len(a) for a in arrays])
+        if offsets[-1] == 0:
+            return np.empty(0, dtype=dtype), offsets
+        return np.concatenate(arrays).astype(dtype, copy=False), offsets
+
+    @staticmethod
+    def _prefix_sum(per_timestep):
+        """Cumulative sum over timesteps (the first axis) with a leading zero, so that the sum over timesteps
+        [t_start, t_end) is prefix[t_end] - prefix[t_start]"""
+        per_timestep = np.asarray(per_timestep)
+        if per_timestep.dtype == bool:
+            per_timestep = per_timestep.astype(int)
+        prefix = np.zeros((len(per_timestep) + 1,) + per_timestep.shape[1:], dtype=per_timestep.dtype)
+        np.cumsum(per_timestep, axis=0, out=prefix[1:])
+        return prefix
+
+    @staticmethod
+    def _window_sum(per_timestep, t_start, t_end):
+        """Sum of float values over timesteps [t_start, t_end), added up one timestep at a time (rather than
+        pairwise by np.sum, or from a prefix sum) so that it is identical to accumulating them in eval_sequence()"""
+        if t_end <= t_start:
+            return np.zeros(per_timestep.shape[1:]) if per_timestep.ndim > 1 else 0
+        return np.cumsum(per_timestep[t_start:t_end], axis=0)[-1]
+
+    @staticmethod
+    def _window_ids(ids, offsets, t_start, t_end):
+        """Returns the ids present in timesteps [t_start, t_end) (sorted, as relabelled by preprocessing when only
+        these timesteps are evaluated) and the number of dets of each of them"""
+        return np.unique(ids[offsets[t_start]:offsets[t_end]], return_counts=True)
+
     def print_table(self, table_res, tracker, cls):
         """Prints table of results for all sequences"""
         print('')
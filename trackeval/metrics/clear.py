@@ -1,19 +1,28 @@
 
 import numpy as np
-from scipy.optimize import linear_sum_assignment
 from ._base_metric import _BaseMetric
 from .. import _timing
+from .. import _sparse
+from .. import _matching
 from .. import utils
 
 class CLEAR(_BaseMetric):
     """Class which implements the CLEAR metrics"""
 
+    # Per-timestep events recorded by eval_sequence() if RECORD_EVENTS (as res['CLR_Events']). 'type' is the index of
+    # the event in EVENT_TYPES, and ids which do not apply to an event are -1. IDSW and FRAG events hold the tracker_id
+    # matched to the gt_id before the switch or the start of the new track as prev_tracker_id.
+    EVENT_TYPES = ('FP', 'FN', 'IDSW', 'FRAG')
+    EVENT_DTYPE = np.dtype([('timestep', np.int32), ('type', np.int8), ('gt_id', np.int32), ('tracker_id', np.int32),
+                            ('prev_tracker_id', np.int32)])
+
     @staticmethod
     def get_default_config():
         """Default class config values"""
         default_config = {
             'THRESHOLD': 0.5,  # Similarity score threshold required for a TP match. Default 0.5.
             'PRINT_CONFIG': True,  # Whether to print the config information on init. Default: False.
+            'RECORD_EVENTS': False,  # Whether to record the FP, FN, IDSW and Frag events per timestep. Default: False.
         }
         return default_config
 
@@ -32,6 +41,7 @@ class CLEAR(_BaseMetric):
         # Configuration options:
         self.config = utils.init_config(config, self.get_default_config(), self.get_name())
         self.threshold = float(self.config['THRESHOLD'])
+        self.record_events = self.config['RECORD_EVENTS']
 
 
     @_timing.time
@@ -47,12 +57,21 @@ class CLEAR(_BaseMetric):
             res['CLR_FN'] = data['num_gt_dets']
             res['ML'] = data['num_gt_ids']
             res['MLR'] = 1.0
+            if self.record_events:
+                res['CLR_Events'] = self._concat_events(
+                    [self._make_events(t, 'FN', gt_ids=gt_ids_t) for t, gt_ids_t in enumerate(data['gt_ids'])], data)
             return res
         if data['num_gt_dets'] == 0:
             res['CLR_FP'] = data['num_tracker_dets']
             res['MLR'] = 1.0
+            if self.record_events:
+                res['CLR_Events'] = self._concat_events(
+                    [self._make_events(t, 'FP', tracker_ids=tracker_ids_t)
+                     for t, tracker_ids_t in enumerate(data['tracker_ids'])], data)
             return res
 
+        events = []  # Only filled if record_events
+
         # Variables counting global association
         num_gt_ids = data['num_gt_ids']
         gt_id_count = np.zeros(num_gt_ids)  # For MT/ML/PT
@@ -69,23 +88,20 @@ class CLEAR(_BaseMetric):
             # Deal with the case that there are no gt_det/tracker_det in a timestep.
             if len(gt_ids_t) == 0:
                 res['CLR_FP'] += len(tracker_ids_t)
+                if self.record_events:
+                    events.append(self._make_events(t, 'FP', tracker_ids=tracker_ids_t))
                 continue
             if len(tracker_ids_t) == 0:
                 res['CLR_FN'] += len(gt_ids_t)
                 gt_id_count[gt_ids_t] += 1
+                if self.record_events:
+                    events.append(self._make_events(t, 'FN', gt_ids=gt_ids_t))
                 continue
 
-            # Calc score matrix to first minimise IDSWs from previous frame, and then maximise MOTP secondarily
-            similarity = data['similarity_scores'][t]
-            score_mat = (tracker_ids_t[np.newaxis, :] == prev_timestep_tracker_id[gt_ids_t[:, np.newaxis]])
-            score_mat = 1000 * score_mat + similarity
-            score_mat[similarity < self.threshold - np.finfo('float').eps] = 0
-
             # Hungarian algorithm to find best matches
-            match_rows, match_cols = linear_sum_assignment(-score_mat)
-            actually_matched_mask = score_mat[match_rows, match_cols] > 0 + np.finfo('float').eps
-            match_rows = match_rows[actually_matched_mask]
-            match_cols = match_cols[actually_matched_mask]
+            similarity = _sparse.to_dense(data['similarity_scores'][t])
+            match_rows, match_cols = self._match_timestep(similarity, gt_ids_t, tracker_ids_t,
+                                                          prev_timestep_tracker_id)
 
             matched_gt_ids = gt_ids_t[match_rows]
             matched_tracker_ids = tracker_ids_t[match_cols]
@@ -96,6 +112,10 @@ class CLEAR(_BaseMetric):
                 np.not_equal(matched_tracker_ids, prev_matched_tracker_ids))
             res['IDSW'] += np.sum(is_idsw)
 
+            if self.record_events:
+                events.append(self._timestep_events(t, gt_ids_t, tracker_ids_t, match_rows, match_cols, is_idsw,
+                                                    prev_tracker_id, prev_timestep_tracker_id, gt_frag_count))
+
             # Update counters for MT/ML/PT/Frag and record for IDSW/Frag for next timestep
             gt_id_count[gt_ids_t] += 1
             gt_matched_count[matched_gt_ids] += 1
@@ -124,6 +144,195 @@ class CLEAR(_BaseMetric):
 
         res['CLR_Frames'] = data['num_timesteps']
 
+        # Calculate final CLEAR scores
+        res = self._compute_final_fields(res)
+        if self.record_events:
+            res['CLR_Events'] = self._concat_events(events, data)
+        return res
+
+    def _timestep_events(self, t, gt_ids_t, tracker_ids_t, match_rows, match_cols, is_idsw, prev_tracker_id,
+                         prev_timestep_tracker_id, gt_frag_count):
+        """Events of one matched timestep: unmatched tracker dets (FP) and gt dets (FN), IDSWs, and tracks of gt_ids
+        starting again after they were tracked before (FRAG). Must be called before the IDSW and Frag state of
+        eval_sequence() is updated for the timestep.
+        """
+        matched_gt_ids = gt_ids_t[match_rows]
+        matched_tracker_ids = tracker_ids_t[match_cols]
+        is_fp = np.ones(len(tracker_ids_t), dtype=bool)
+        is_fp[match_cols] = False
+        is_fn = np.ones(len(gt_ids_t), dtype=bool)
+        is_fn[match_rows] = False
+        is_frag = np.isnan(prev_timestep_tracker_id[matched_gt_ids]) & (gt_frag_count[matched_gt_ids] > 0)
+        return np.concatenate([
+            self._make_events(t, 'FP', tracker_ids=tracker_ids_t[is_fp]),
+            self._make_events(t, 'FN', gt_ids=gt_ids_t[is_fn]),
+            self._make_events(t, 'IDSW', matched_gt_ids[is_idsw], matched_tracker_ids[is_idsw],
+                              prev_tracker_id[matched_gt_ids[is_idsw]]),
+            self._make_events(t, 'FRAG', matched_gt_ids[is_frag], matched_tracker_ids[is_frag],
+                              prev_tracker_id[matched_gt_ids[is_frag]])])
+
+    def _make_events(self, t, event_type, gt_ids=None, tracker_ids=None, prev_tracker_ids=None):
+        """Events of one type at timestep t, for each of the given gt_ids or tracker_ids"""
+        events = np.empty(len(gt_ids if gt_ids is not None else tracker_ids), dtype=self.EVENT_DTYPE)
+        events['timestep'] = t
+        events['type'] = self.EVENT_TYPES.index(event_type)
+        events['gt_id'] = -1 if gt_ids is None else gt_ids
+        events['tracker_id'] = -1 if tracker_ids is None else tracker_ids
+        events['prev_tracker_id'] = -1 if prev_tracker_ids is None else prev_tracker_ids
+        return events
+
+    def _concat_events(self, events, data):
+        """Concatenates the events of all timesteps. Ids are mapped back to the ids of the input data if the dataset
+        gives them ('gt_id_values' and 'tracker_id_values', indexed by the contiguous ids used for evaluation)."""
+        events = np.concatenate(events) if len(events) > 0 else np.empty(0, dtype=self.EVENT_DTYPE)
+        for field, id_values in [('gt_id', data.get('gt_id_values')), ('tracker_id', data.get('tracker_id_values')),
+                                 ('prev_tracker_id', data.get('tracker_id_values'))]:
+            if id_values is not None:
+                has_id = events[field] >= 0
+                events[field][has_id] = id_values[events[field][has_id]]
+        return events
+
+    @staticmethod
+    def write_events(events, out_file):
+        """Writes the events recorded by eval_sequence() (res['CLR_Events']) to a Parquet file (a path or a file
+        object), with the event types as strings."""
+        # Only loaded when run to reduce minimum requirements
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise utils.TrackEvalException('pyarrow is required to write CLEAR events to Parquet.')
+        columns = {name: events[name] for name in CLEAR.EVENT_DTYPE.names}
+        columns['type'] = pyarrow.DictionaryArray.from_arrays(events['type'], list(CLEAR.EVENT_TYPES))
+        pyarrow.parquet.write_table(pyarrow.table(columns), out_file)
+
+    def _match_timestep(self, similarity, gt_ids_t, tracker_ids_t, prev_timestep_tracker_id):
+        """Matches the dets of one timestep, continuing the matches of the previous timestep where possible"""
+        # Calc score matrix to first minimise IDSWs from previous frame, and then maximise MOTP secondarily
+        score_mat = (tracker_ids_t[np.newaxis, :] == prev_timestep_tracker_id[gt_ids_t[:, np.newaxis]])
+        score_mat = 1000 * score_mat + similarity
+        score_mat[similarity < self.threshold - np.finfo('float').eps] = 0
+
+        # Hungarian algorithm to find best matches
+        match_rows, match_cols = _matching.match_positive(score_mat)
+        actually_matched_mask = score_mat[match_rows, match_cols] > 0 + np.finfo('float').eps
+        match_rows = match_rows[actually_matched_mask]
+        match_cols = match_cols[actually_matched_mask]
+        return match_rows, match_cols
+
+    def get_frame_stats(self, data):
+        """Per-timestep CLEAR statistics of one sequence, used by eval_window() to score any window of timesteps.
+        Dets are matched once for the whole sequence, in the same way as in eval_sequence().
+        """
+        num_timesteps = data['num_timesteps']
+        num_gt_ids = data['num_gt_ids']
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        _, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+        is_matched_timestep = np.zeros(num_timesteps, dtype=bool)  # Timesteps with both gt and tracker dets
+        motp_sum = np.zeros(num_timesteps)
+        match_keys = ['gt_ids', 'tracker_ids', 'prev_tracker_ids', 'prev_timesteps', 'is_track_start']
+        matches = {key: [np.empty(0)] * num_timesteps for key in match_keys}
+
+        # For each gt_id, the tracker_id and timestep of its last match, and its match in the last matched timestep.
+        prev_tracker_id = np.nan * np.zeros(num_gt_ids)
+        prev_timestep = -np.ones(num_gt_ids, dtype=int)
+        prev_timestep_tracker_id = np.nan * np.zeros(num_gt_ids)
+        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+            if len(gt_ids_t) == 0 or len(tracker_ids_t) == 0:
+                continue
+            is_matched_timestep[t] = True
+            similarity = _sparse.to_dense(data['similarity_scores'][t])
+            match_rows, match_cols = self._match_timestep(similarity, gt_ids_t, tracker_ids_t,
+                                                          prev_timestep_tracker_id)
+            matched_gt_ids = gt_ids_t[match_rows]
+            matched_tracker_ids = tracker_ids_t[match_cols]
+            matches['gt_ids'][t] = matched_gt_ids
+            matches['tracker_ids'][t] = matched_tracker_ids
+            matches['prev_tracker_ids'][t] = prev_tracker_id[matched_gt_ids]
+            matches['prev_timesteps'][t] = prev_timestep[matched_gt_ids]
+            matches['is_track_start'][t] = np.isnan(prev_timestep_tracker_id[matched_gt_ids])
+            if len(match_rows) > 0:
+                motp_sum[t] = sum(similarity[match_rows, match_cols])
+
+            prev_tracker_id[matched_gt_ids] = matched_tracker_ids
+            prev_timestep[matched_gt_ids] = t
+            prev_timestep_tracker_id[:] = np.nan
+            prev_timestep_tracker_id[matched_gt_ids] = matched_tracker_ids
+
+        frame_stats = {'gt_ids': gt_ids, 'gt_offsets': gt_offsets, 'tracker_offsets': tracker_offsets,
+                       'is_matched_timestep': is_matched_timestep, 'MOTP_sum': motp_sum}
+        frame_stats['match_gt_ids'], frame_stats['match_offsets'] = self._concat_timesteps(matches['gt_ids'])
+        frame_stats['match_tracker_ids'], _ = self._concat_timesteps(matches['tracker_ids'])
+        frame_stats['match_prev_tracker_ids'], _ = self._concat_timesteps(matches['prev_tracker_ids'], dtype=float)
+        frame_stats['match_prev_timesteps'], _ = self._concat_timesteps(matches['prev_timesteps'])
+        frame_stats['match_is_track_start'], _ = self._concat_timesteps(matches['is_track_start'], dtype=bool)
+        frame_stats['match_timesteps'] = np.repeat(np.arange(num_timesteps), np.diff(frame_stats['match_offsets']))
+        return frame_stats
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Calculates CLEAR metrics for timesteps [t_start, t_end) of a sequence from its get_frame_stats().
+        This is approximate: matches are taken from the whole sequence, where the first timesteps of the window may
+        continue tracks from before the window, so results are only identical to eval_sequence() on just the window
+        when the window starts at the first timestep. Given these matches, IDSW, MT/PT/ML and Frag are computed exactly
+        as eval_sequence() would (e.g. only IDSWs relative to earlier matches within the window are counted).
+        """
+        # Initialise results
+        res = {}
+        for field in self.fields:
+            res[field] = 0
+
+        gt_offsets = frame_stats['gt_offsets']
+        tracker_offsets = frame_stats['tracker_offsets']
+        num_gt_dets = gt_offsets[t_end] - gt_offsets[t_start]
+        num_tracker_dets = tracker_offsets[t_end] - tracker_offsets[t_start]
+        window_gt_ids, gt_id_count = self._window_ids(frame_stats['gt_ids'], gt_offsets, t_start, t_end)
+        num_gt_ids = len(window_gt_ids)
+
+        # Return result quickly if tracker or gt window is empty
+        if num_tracker_dets == 0:
+            res['CLR_FN'] = num_gt_dets
+            res['ML'] = num_gt_ids
+            res['MLR'] = 1.0
+            return res
+        if num_gt_dets == 0:
+            res['CLR_FP'] = num_tracker_dets
+            res['MLR'] = 1.0
+            return res
+
+        matches = slice(frame_stats['match_offsets'][t_start], frame_stats['match_offsets'][t_end])
+        matched_gt_ids = np.searchsorted(window_gt_ids, frame_stats['match_gt_ids'][matches])
+        matched_tracker_ids = frame_stats['match_tracker_ids'][matches]
+
+        # IDSWs are only counted if the gt_id was previously matched within the window
+        is_idsw = (frame_stats['match_prev_timesteps'][matches] >= t_start) & (
+            np.not_equal(matched_tracker_ids, frame_stats['match_prev_tracker_ids'][matches]))
+        res['IDSW'] = np.sum(is_idsw)
+
+        # Tracks start at the first timestep of the window with both gt and tracker dets, or after not being matched.
+        matched_timesteps = t_start + np.flatnonzero(frame_stats['is_matched_timestep'][t_start:t_end])
+        first_matched_timestep = matched_timesteps[0] if len(matched_timesteps) > 0 else -1
+        is_track_start = frame_stats['match_is_track_start'][matches] | (
+            frame_stats['match_timesteps'][matches] == first_matched_timestep)
+
+        # Calculate MT/ML/PT/Frag/MOTP
+        gt_matched_count = np.bincount(matched_gt_ids, minlength=num_gt_ids)
+        gt_frag_count = np.bincount(matched_gt_ids[is_track_start], minlength=num_gt_ids)
+        tracked_ratio = gt_matched_count / gt_id_count
+        res['MT'] = np.sum(np.greater(tracked_ratio, 0.8))
+        res['PT'] = np.sum(np.greater_equal(tracked_ratio, 0.2)) - res['MT']
+        res['ML'] = num_gt_ids - res['MT'] - res['PT']
+        res['Frag'] = np.sum(np.subtract(gt_frag_count[gt_frag_count > 0], 1))
+
+        # Calculate basic statistics
+        num_matches = len(matched_gt_ids)
+        res['CLR_TP'] = num_matches
+        res['CLR_FN'] = num_gt_dets - num_matches
+        res['CLR_FP'] = num_tracker_dets - num_matches
+        res['MOTP_sum'] = self._window_sum(frame_stats['MOTP_sum'], t_start, t_end)
+        res['MOTP'] = res['MOTP_sum'] / np.maximum(1.0, res['CLR_TP'])
+
+        res['CLR_Frames'] = t_end - t_start
+
         # Calculate final CLEAR scores
         res = self._compute_final_fields(res)
         return res
@@ -10,6 +10,7 @@ class Count(_BaseMetric):
         self.integer_fields = ['Dets', 'GT_Dets', 'IDs', 'GT_IDs']
         self.fields = self.integer_fields
         self.summary_fields = self.fields
+        self.exact_window_eval = True
 
     @_timing.time
     def eval_sequence(self, data):
@@ -22,6 +23,23 @@ class Count(_BaseMetric):
                'Frames': data['num_timesteps']}
         return res
 
+    def get_frame_stats(self, data):
+        """Per-timestep ids of one sequence, used by eval_window() to count the dets and ids of any window"""
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        tracker_ids, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+        return {'gt_ids': gt_ids, 'gt_offsets': gt_offsets,
+                'tracker_ids': tracker_ids, 'tracker_offsets': tracker_offsets}
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Returns counts for timesteps [t_start, t_end) of a sequence from its get_frame_stats() (exact)"""
+        res = {'Dets': frame_stats['tracker_offsets'][t_end] - frame_stats['tracker_offsets'][t_start],
+               'GT_Dets': frame_stats['gt_offsets'][t_end] - frame_stats['gt_offsets'][t_start],
+               'IDs': len(self._window_ids(frame_stats['tracker_ids'], frame_stats['tracker_offsets'],
+                                           t_start, t_end)[0]),
+               'GT_IDs': len(self._window_ids(frame_stats['gt_ids'], frame_stats['gt_offsets'], t_start, t_end)[0]),
+               'Frames': t_end - t_start}
+        return res
+
     def combine_sequences(self, all_res):
         """Combines metrics across all sequences"""
         res = {}
@@ -0,0 +1,34 @@
+from ..utils import TrackEvalException
+
+
+class FrameIndex:
+    """Index of per-timestep statistics of one preprocessed sequence (for one class), built once so that the metrics
+    of any window of timesteps can be calculated without re-loading, re-preprocessing or re-evaluating the sequence.
+
+    Example:
+        data = dataset.get_preprocessed_seq_data(dataset.get_raw_seq_data(tracker, seq), cls)
+        index = FrameIndex(data, [HOTA(), CLEAR(), Identity()])
+        window_res = index.eval_window(20, 100)  # {metric_name: res} for timesteps 20..100
+
+    Count, Identity and VACE window results are identical to evaluating the window on its own. HOTA and CLEAR match
+    dets once over the whole sequence (HOTA uses global alignment scores, CLEAR carries matches over from previous
+    timesteps), so their window results are approximate, and only exact when the window is the whole sequence.
+    Use is_exact() to check this for a metric.
+    """
+
+    def __init__(self, data, metrics_list):
+        self.num_timesteps = data['num_timesteps']
+        self.metrics = {metric.get_name(): metric for metric in metrics_list}
+        self.frame_stats = {name: metric.get_frame_stats(data) for name, metric in self.metrics.items()}
+
+    def is_exact(self, metric_name):
+        """Whether window results of this metric are identical to evaluating the window on its own"""
+        return self.metrics[metric_name].exact_window_eval
+
+    def eval_window(self, t0, t1):
+        """Calculates the metrics for timesteps t0 to t1 (1-based and both inclusive, as frames in MOT files)"""
+        if not 1 <= t0 <= t1 <= self.num_timesteps:
+            raise TrackEvalException('Invalid window [%i, %i] for a sequence with %i timesteps.'
+                                     % (t0, t1, self.num_timesteps))
+        return {name: metric.eval_window(self.frame_stats[name], t0 - 1, t1)
+                for name, metric in self.metrics.items()}
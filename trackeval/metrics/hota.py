@@ -1,13 +1,11 @@
 
 import os
 import numpy as np
-from scipy.optimize import linear_sum_assignment
 from ._base_metric import _BaseMetric
 from .. import _timing
+from .. import _sparse
+from .. import _matching
 
-import matplotlib
-matplotlib.use('Agg')  # This line configures Matplotlib to work without a display (non-interactive)
-from matplotlib import pyplot as plt
 
 class HOTA(_BaseMetric):
     """Class which implements the HOTA metrics.
@@ -47,76 +45,257 @@ class HOTA(_BaseMetric):
             res['LocA(0)'] = 1.0
             return res
 
-        # Variables counting global association
-        potential_matches_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
-        gt_id_count = np.zeros((data['num_gt_ids'], 1))
-        tracker_id_count = np.zeros((1, data['num_tracker_ids']))
+        # Calculate overall jaccard alignment score (before unique matching) between IDs
+        global_alignment_score, gt_id_count, tracker_id_count = self._compute_global_alignment_score(data)
+
+        # Hungarian algorithm to find best matches in each timestep
+        match_timesteps, match_gt_ids, match_tracker_ids, match_sims = self._match_sequence(data,
+                                                                                            global_alignment_score)
+
+        # Calculate and accumulate basic statistics, for all alpha values at once
+        match_levels = self._alpha_levels(match_sims)
+        res['HOTA_TP'] = np.sum(self._is_matched_at_alphas(match_levels), axis=0).astype(np.float)
+        res['HOTA_FN'] = data['num_gt_dets'] - res['HOTA_TP']
+        res['HOTA_FP'] = data['num_tracker_dets'] - res['HOTA_TP']
+        loca = self._timestep_loca(match_timesteps, match_sims, match_levels, data['num_timesteps'])
+        res['LocA'] = self._window_sum(loca, 0, data['num_timesteps'])
+
+        # Calculate association scores (AssA, AssRe, AssPr) for the alpha value.
+        pair_gt_ids, pair_tracker_ids, matches_counts = self._matches_counts(match_gt_ids, match_tracker_ids,
+                                                                             match_levels, data['num_tracker_ids'])
+        res = self._compute_association_scores(res, pair_gt_ids, pair_tracker_ids, matches_counts, gt_id_count,
+                                               tracker_id_count)
+
+        # Calculate final scores
+        res['LocA'] = np.maximum(1e-10, res['LocA']) / np.maximum(1e-10, res['HOTA_TP'])
+        res = self._compute_final_fields(res)
+        return res
+
+    def get_frame_stats(self, data):
+        """Per-timestep HOTA statistics of one sequence, used by eval_window() to score any window of timesteps.
+        Dets are matched once for the whole sequence, in the same way as in eval_sequence().
+        """
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        tracker_ids, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+        hota_tp = np.zeros((data['num_timesteps'], len(self.array_labels)), dtype=int)
+        loca = np.zeros((data['num_timesteps'], len(self.array_labels)))
+        match_timesteps = match_gt_ids = match_tracker_ids = np.empty(0, dtype=int)
+        match_sims = np.empty(0)
+
+        if data['num_tracker_dets'] > 0 and data['num_gt_dets'] > 0:
+            global_alignment_score, _, _ = self._compute_global_alignment_score(data)
+            match_timesteps, match_gt_ids, match_tracker_ids, match_sims = self._match_sequence(
+                data, global_alignment_score)
+            match_levels = self._alpha_levels(match_sims)
+            np.add.at(hota_tp, match_timesteps, self._is_matched_at_alphas(match_levels))
+            loca = self._timestep_loca(match_timesteps, match_sims, match_levels, data['num_timesteps'])
+
+            # Matches below the lowest alpha are never counted, so they are not stored.
+            is_match = match_levels > 0
+            match_timesteps = match_timesteps[is_match]
+            match_gt_ids = match_gt_ids[is_match]
+            match_tracker_ids = match_tracker_ids[is_match]
+            match_sims = match_sims[is_match]
+
+        match_offsets = np.searchsorted(match_timesteps, np.arange(data['num_timesteps'] + 1))
+        frame_stats = {'gt_ids': gt_ids, 'gt_offsets': gt_offsets,
+                       'tracker_ids': tracker_ids, 'tracker_offsets': tracker_offsets,
+                       'HOTA_TP': self._prefix_sum(hota_tp), 'LocA': loca,
+                       'match_gt_ids': match_gt_ids, 'match_tracker_ids': match_tracker_ids,
+                       'match_sims': match_sims, 'match_offsets': match_offsets}
+        return frame_stats
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Calculates the HOTA metrics for timesteps [t_start, t_end) of a sequence from its get_frame_stats().
+        This is approximate: dets are matched using the global alignment score of the whole sequence rather than that
+        of the window, so results are only identical to eval_sequence() when the window is the whole sequence.
+        Det counts and association scores are otherwise computed exactly as in eval_sequence() from these matches.
+        """
+        # Initialise results
+        res = {}
+        for field in self.float_array_fields + self.integer_array_fields:
+            res[field] = np.zeros((len(self.array_labels)), dtype=np.float)
+        for field in self.float_fields:
+            res[field] = 0
+
+        gt_offsets = frame_stats['gt_offsets']
+        tracker_offsets = frame_stats['tracker_offsets']
+        num_gt_dets = gt_offsets[t_end] - gt_offsets[t_start]
+        num_tracker_dets = tracker_offsets[t_end] - tracker_offsets[t_start]
+
+        # Return result quickly if tracker or gt window is empty
+        if num_tracker_dets == 0:
+            res['HOTA_FN'] = num_gt_dets * np.ones((len(self.array_labels)), dtype=np.float)
+            res['LocA'] = np.ones((len(self.array_labels)), dtype=np.float)
+            res['LocA(0)'] = 1.0
+            return res
+        if num_gt_dets == 0:
+            res['HOTA_FP'] = num_tracker_dets * np.ones((len(self.array_labels)), dtype=np.float)
+            res['LocA'] = np.ones((len(self.array_labels)), dtype=np.float)
+            res['LocA(0)'] = 1.0
+            return res
+
+        # Det statistics are sums over the timesteps of the window
+        res['HOTA_TP'] = (frame_stats['HOTA_TP'][t_end] - frame_stats['HOTA_TP'][t_start]).astype(np.float)
+        res['HOTA_FN'] = num_gt_dets - res['HOTA_TP']
+        res['HOTA_FP'] = num_tracker_dets - res['HOTA_TP']
+        res['LocA'] = self._window_sum(frame_stats['LocA'], t_start, t_end)
+
+        # Count matches between the ids present in the window
+        window_gt_ids, gt_id_count = self._window_ids(frame_stats['gt_ids'], gt_offsets, t_start, t_end)
+        window_tracker_ids, tracker_id_count = self._window_ids(frame_stats['tracker_ids'], tracker_offsets,
+                                                                t_start, t_end)
+        matches = slice(frame_stats['match_offsets'][t_start], frame_stats['match_offsets'][t_end])
+        match_gt_ids = np.searchsorted(window_gt_ids, frame_stats['match_gt_ids'][matches])
+        match_tracker_ids = np.searchsorted(window_tracker_ids, frame_stats['match_tracker_ids'][matches])
+        match_levels = self._alpha_levels(frame_stats['match_sims'][matches])
+        pair_gt_ids, pair_tracker_ids, matches_counts = self._matches_counts(match_gt_ids, match_tracker_ids,
+                                                                             match_levels, len(window_tracker_ids))
+
+        # Calculate association scores (AssA, AssRe, AssPr) for the alpha value.
+        res = self._compute_association_scores(res, pair_gt_ids, pair_tracker_ids, matches_counts,
+                                               gt_id_count.astype(np.float), tracker_id_count.astype(np.float))
+
+        # Calculate final scores
+        res['LocA'] = np.maximum(1e-10, res['LocA']) / np.maximum(1e-10, res['HOTA_TP'])
+        res = self._compute_final_fields(res)
+        return res
+
+    @staticmethod
+    def _compute_global_alignment_score(data):
+        """Calculates the jaccard alignment score (before unique matching) between all gt and tracker ids over the
+        whole sequence, which is used to weight the per-timestep matching. Also returns the number of dets of each id.
+        The score is only non-zero for pairs of ids with overlapping dets, so it is stored sparsely as the sorted keys
+        of these pairs (see _sparse.pair_keys) and their scores.
+        """
+        # Potential matches between ids, only for the pairs of ids which overlap in some timestep
+        pair_keys = []
+        pair_sim_ious = []
 
         # First loop through each timestep and accumulate global track information.
         for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
             # Count the potential matches between ids in each timestep
             # These are normalised, weighted by the match similarity.
-            similarity = data['similarity_scores'][t]
+            similarity = _sparse.to_dense(data['similarity_scores'][t])
             sim_iou_denom = similarity.sum(0)[np.newaxis, :] + similarity.sum(1)[:, np.newaxis] - similarity
             sim_iou = np.zeros_like(similarity)
             sim_iou_mask = sim_iou_denom > 0 + np.finfo('float').eps
             sim_iou[sim_iou_mask] = similarity[sim_iou_mask] / sim_iou_denom[sim_iou_mask]
-            potential_matches_count[gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :]] += sim_iou
+            match_idx_gt, match_idx_tracker = np.nonzero(sim_iou)
+            pair_keys.append(_sparse.pair_keys(gt_ids_t[match_idx_gt], tracker_ids_t[match_idx_tracker],
+                                               data['num_tracker_ids']))
+            pair_sim_ious.append(sim_iou[match_idx_gt, match_idx_tracker])
+        pair_keys, potential_matches_count = _sparse.sum_by_pair(np.concatenate(pair_keys),
+                                                                 np.concatenate(pair_sim_ious))
 
-            # Calculate the total number of dets for each gt_id and tracker_id.
-            gt_id_count[gt_ids_t] += 1
-            tracker_id_count[0, tracker_ids_t] += 1
+        # Calculate the total number of dets for each gt_id and tracker_id.
+        gt_id_count = np.bincount(np.concatenate(data['gt_ids']).astype(int),
+                                  minlength=data['num_gt_ids']).astype(np.float)
+        tracker_id_count = np.bincount(np.concatenate(data['tracker_ids']).astype(int),
+                                       minlength=data['num_tracker_ids']).astype(np.float)
 
-        # Calculate overall jaccard alignment score (before unique matching) between IDs
-        global_alignment_score = potential_matches_count / (gt_id_count + tracker_id_count - potential_matches_count)
-        matches_counts = [np.zeros_like(potential_matches_count) for _ in self.array_labels]
+        pair_gt_ids = pair_keys // data['num_tracker_ids']
+        pair_tracker_ids = pair_keys % data['num_tracker_ids']
+        global_alignment_score = potential_matches_count / (gt_id_count[pair_gt_ids]
+                                                            + tracker_id_count[pair_tracker_ids]
+                                                            - potential_matches_count)
+        return (pair_keys, global_alignment_score), gt_id_count, tracker_id_count
+
+    @staticmethod
+    def _match_timestep(similarity, gt_ids_t, tracker_ids_t, global_alignment_score, num_tracker_ids):
+        """Matches the dets of one timestep, optimising the similarity weighted by the global alignment of their ids"""
+        # Get matching scores between pairs of dets for optimizing HOTA
+        pair_keys, pair_scores = global_alignment_score
+        alignment = _sparse.lookup_pairs(pair_keys, pair_scores, _sparse.pair_keys(
+            gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :], num_tracker_ids))
+        score_mat = alignment * similarity
+
+        # Hungarian algorithm to find best matches (pairs with a zero score are never counted as matches)
+        match_rows, match_cols = _matching.match_positive(score_mat)
+        return match_rows, match_cols
 
-        # Calculate scores for each timestep
+    def _match_sequence(self, data, global_alignment_score):
+        """Matches the dets of each timestep of a sequence, returning the timestep, gt_id, tracker_id and similarity
+        of all matches (ordered by timestep and then gt det)"""
+        match_timesteps = []
+        match_gt_ids = []
+        match_tracker_ids = []
+        match_sims = []
         for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
             # Deal with the case that there are no gt_det/tracker_det in a timestep.
-            if len(gt_ids_t) == 0:
-                for a, alpha in enumerate(self.array_labels):
-                    res['HOTA_FP'][a] += len(tracker_ids_t)
-                continue
-            if len(tracker_ids_t) == 0:
-                for a, alpha in enumerate(self.array_labels):
-                    res['HOTA_FN'][a] += len(gt_ids_t)
+            if len(gt_ids_t) == 0 or len(tracker_ids_t) == 0:
                 continue
+            similarity = _sparse.to_dense(data['similarity_scores'][t])
+            match_rows, match_cols = self._match_timestep(similarity, gt_ids_t, tracker_ids_t, global_alignment_score,
+                                                          data['num_tracker_ids'])
+            match_timesteps.append(np.full(len(match_rows), t))
+            match_gt_ids.append(gt_ids_t[match_rows])
+            match_tracker_ids.append(tracker_ids_t[match_cols])
+            match_sims.append(similarity[match_rows, match_cols])
+        if len(match_timesteps) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=int), np.empty(0)
+        return (np.concatenate(match_timesteps), np.concatenate(match_gt_ids).astype(int),
+                np.concatenate(match_tracker_ids).astype(int), np.concatenate(match_sims))
 
-            # Get matching scores between pairs of dets for optimizing HOTA
-            similarity = data['similarity_scores'][t]
-            score_mat = global_alignment_score[gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :]] * similarity
-
-            # Hungarian algorithm to find best matches
-            match_rows, match_cols = linear_sum_assignment(-score_mat)
-
-            # Calculate and accumulate basic statistics
-            for a, alpha in enumerate(self.array_labels):
-                actually_matched_mask = similarity[match_rows, match_cols] >= alpha - np.finfo('float').eps
-                alpha_match_rows = match_rows[actually_matched_mask]
-                alpha_match_cols = match_cols[actually_matched_mask]
-                num_matches = len(alpha_match_rows)
-                res['HOTA_TP'][a] += num_matches
-                res['HOTA_FN'][a] += len(gt_ids_t) - num_matches
-                res['HOTA_FP'][a] += len(tracker_ids_t) - num_matches
-                if num_matches > 0:
-                    res['LocA'][a] += sum(similarity[alpha_match_rows, alpha_match_cols])
-                    matches_counts[a][gt_ids_t[alpha_match_rows], tracker_ids_t[alpha_match_cols]] += 1
+    def _alpha_levels(self, match_sims):
+        """Number of alpha values at which each match is counted, i.e. for which sim >= alpha (up to eps). A match
+        is counted at the first 'level' alpha values, as they are sorted."""
+        return np.searchsorted(self.array_labels - np.finfo('float').eps, match_sims, side='right')
 
-        # Calculate association scores (AssA, AssRe, AssPr) for the alpha value.
-        # First calculate scores per gt_id/tracker_id combo and then average over the number of detections.
-        for a, alpha in enumerate(self.array_labels):
-            matches_count = matches_counts[a]
-            ass_a = matches_count / np.maximum(1, gt_id_count + tracker_id_count - matches_count)
-            res['AssA'][a] = np.sum(matches_count * ass_a) / np.maximum(1, res['HOTA_TP'][a])
-            ass_re = matches_count / np.maximum(1, gt_id_count)
-            res['AssRe'][a] = np.sum(matches_count * ass_re) / np.maximum(1, res['HOTA_TP'][a])
-            ass_pr = matches_count / np.maximum(1, tracker_id_count)
-            res['AssPr'][a] = np.sum(matches_count * ass_pr) / np.maximum(1, res['HOTA_TP'][a])
+    def _is_matched_at_alphas(self, match_levels):
+        """(num_matches, num_alphas) bool array of whether each match is counted at each alpha value"""
+        return match_levels[:, np.newaxis] > np.arange(len(self.array_labels))[np.newaxis, :]
 
-        # Calculate final scores
-        res['LocA'] = np.maximum(1e-10, res['LocA']) / np.maximum(1e-10, res['HOTA_TP'])
-        res = self._compute_final_fields(res)
+    def _timestep_loca(self, match_timesteps, match_sims, match_levels, num_timesteps):
+        """(num_timesteps, num_alphas) array of the sum of similarities of the matches counted at each alpha value in
+        each timestep. Each sum is added up one match at a time in the order of the matches (with zeros for matches
+        not counted at an alpha), which is exactly how sum() adds up the similarities of these matches. This is done
+        for the n-th match of all timesteps at once, so it takes as many steps as the most matches in a timestep."""
+        loca = np.zeros((num_timesteps, len(self.array_labels)))
+        if len(match_sims) == 0:
+            return loca
+        match_pos = np.arange(len(match_sims)) - np.searchsorted(match_timesteps, match_timesteps)
+        match_order = np.argsort(match_pos, kind='stable')
+        pos_offsets = np.searchsorted(match_pos[match_order], np.arange(np.max(match_pos) + 2))
+        sims = np.where(self._is_matched_at_alphas(match_levels), match_sims[:, np.newaxis], 0)
+        for pos_start, pos_end in zip(pos_offsets[:-1], pos_offsets[1:]):
+            # Matches at the same position are in different timesteps
+            matches = match_order[pos_start:pos_end]
+            loca[match_timesteps[matches]] += sims[matches]
+        return loca
+
+    def _matches_counts(self, match_gt_ids, match_tracker_ids, match_levels, num_tracker_ids):
+        """Counts the number of matches between each gt_id/tracker_id combo for each alpha value. Only the id pairs
+        which are matched at all are counted, returning their gt_ids and tracker_ids (sorted by gt_id and then
+        tracker_id) and a (num_pairs, num_alphas) array of their number of matches at each alpha value."""
+        pairs, pair_idx = np.unique(_sparse.pair_keys(match_gt_ids, match_tracker_ids, num_tracker_ids),
+                                    return_inverse=True)
+        level_counts = np.zeros((len(pairs), len(self.array_labels) + 1))
+        np.add.at(level_counts, (pair_idx.ravel(), match_levels), 1)
+        # Matches at a level higher than the alpha index are counted at that alpha.
+        pair_counts = np.cumsum(level_counts[:, ::-1], axis=1)[:, ::-1]
+        return pairs // num_tracker_ids, pairs % num_tracker_ids, pair_counts[:, 1:]
+
+    def _compute_association_scores(self, res, pair_gt_ids, pair_tracker_ids, matches_counts, gt_id_count,
+                                    tracker_id_count):
+        """Calculates the association scores (AssA, AssRe, AssPr) for each alpha value from the number of matches
+        between each matched gt_id/tracker_id combo (as returned by _matches_counts(), sorted by gt_id and then
+        tracker_id) and the number of dets of each gt_id and tracker_id. Combos which are never matched have no effect
+        on the scores, so they are not needed. The scores of the combos are summed as np.sum sums them over the dense
+        num_gt_ids x num_tracker_ids array (see _sparse.dense_sum()), so results are identical to the dense computation.
+        """
+        num_tracker_ids = len(tracker_id_count)
+        pair_keys = _sparse.pair_keys(pair_gt_ids, pair_tracker_ids, num_tracker_ids)
+        num_pairs = len(gt_id_count) * num_tracker_ids
+        # First calculate scores per gt_id/tracker_id combo and then average over the number of detections.
+        gt_id_count = gt_id_count[pair_gt_ids][:, np.newaxis]
+        tracker_id_count = tracker_id_count[pair_tracker_ids][:, np.newaxis]
+        ass_a = matches_counts / np.maximum(1, gt_id_count + tracker_id_count - matches_counts)
+        res['AssA'] = _sparse.dense_sum(pair_keys, matches_counts * ass_a, num_pairs) / np.maximum(1, res['HOTA_TP'])
+        ass_re = matches_counts / np.maximum(1, gt_id_count)
+        res['AssRe'] = _sparse.dense_sum(pair_keys, matches_counts * ass_re, num_pairs) / np.maximum(1, res['HOTA_TP'])
+        ass_pr = matches_counts / np.maximum(1, tracker_id_count)
+        res['AssPr'] = _sparse.dense_sum(pair_keys, matches_counts * ass_pr, num_pairs) / np.maximum(1, res['HOTA_TP'])
         return res
 
     def combine_sequences(self, all_res):
@@ -184,7 +363,9 @@ class HOTA(_BaseMetric):
     def plot_single_tracker_results(self, table_res, tracker, cls, output_folder):
         """Create plot of results"""
 
-        # Only loaded when run to reduce minimum requirements
+        # Only loaded when run to reduce minimum requirements (and to keep evaluation without plots free of matplotlib)
+        import matplotlib
+        matplotlib.use('Agg')  # This line configures Matplotlib to work without a display (non-interactive)
         from matplotlib import pyplot as plt
 
         res = table_res['COMBINED_SEQ']
@@ -1,7 +1,8 @@
 import numpy as np
-from scipy.optimize import linear_sum_assignment
 from ._base_metric import _BaseMetric
 from .. import _timing
+from .. import _sparse
+from .. import _matching
 from .. import utils
 
 
@@ -23,6 +24,7 @@ class Identity(_BaseMetric):
         self.float_fields = ['IDF1', 'IDR', 'IDP']
         self.fields = self.float_fields + self.integer_fields
         self.summary_fields = self.fields
+        self.exact_window_eval = True
 
         # Configuration options:
         self.config = utils.init_config(config, self.get_default_config(), self.get_name())
@@ -44,50 +46,112 @@ class Identity(_BaseMetric):
             res['IDFP'] = data['num_tracker_dets']
             return res
 
-        # Variables counting global association
-        potential_matches_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
-        gt_id_count = np.zeros(data['num_gt_ids'])
-        tracker_id_count = np.zeros(data['num_tracker_ids'])
+        # Variables counting global association, only for the pairs of ids which are potential matches
+        match_keys = []
 
         # First loop through each timestep and accumulate global track information.
         for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
             # Count the potential matches between ids in each timestep
-            matches_mask = np.greater_equal(data['similarity_scores'][t], self.threshold)
+            matches_mask = np.greater_equal(_sparse.to_dense(data['similarity_scores'][t]), self.threshold)
             match_idx_gt, match_idx_tracker = np.nonzero(matches_mask)
-            potential_matches_count[gt_ids_t[match_idx_gt], tracker_ids_t[match_idx_tracker]] += 1
-
-            # Calculate the total number of dets for each gt_id and tracker_id.
-            gt_id_count[gt_ids_t] += 1
-            tracker_id_count[tracker_ids_t] += 1
-
-        # Calculate optimal assignment cost matrix for ID metrics
-        num_gt_ids = data['num_gt_ids']
-        num_tracker_ids = data['num_tracker_ids']
-        fp_mat = np.zeros((num_gt_ids + num_tracker_ids, num_gt_ids + num_tracker_ids))
-        fn_mat = np.zeros((num_gt_ids + num_tracker_ids, num_gt_ids + num_tracker_ids))
-        fp_mat[num_gt_ids:, :num_tracker_ids] = 1e10
-        fn_mat[:num_gt_ids, num_tracker_ids:] = 1e10
-        for gt_id in range(num_gt_ids):
-            fn_mat[gt_id, :num_tracker_ids] = gt_id_count[gt_id]
-            fn_mat[gt_id, num_tracker_ids + gt_id] = gt_id_count[gt_id]
-        for tracker_id in range(num_tracker_ids):
-            fp_mat[:num_gt_ids, tracker_id] = tracker_id_count[tracker_id]
-            fp_mat[tracker_id + num_gt_ids, tracker_id] = tracker_id_count[tracker_id]
-        fn_mat[:num_gt_ids, :num_tracker_ids] -= potential_matches_count
-        fp_mat[:num_gt_ids, :num_tracker_ids] -= potential_matches_count
-
-        # Hungarian algorithm
-        match_rows, match_cols = linear_sum_assignment(fn_mat + fp_mat)
+            match_keys.append(_sparse.pair_keys(gt_ids_t[match_idx_gt], tracker_ids_t[match_idx_tracker],
+                                                data['num_tracker_ids']))
+        pair_keys, potential_matches_count = _sparse.sum_by_pair(np.concatenate(match_keys))
 
-        # Accumulate basic statistics
-        res['IDFN'] = fn_mat[match_rows, match_cols].sum().astype(np.int)
-        res['IDFP'] = fp_mat[match_rows, match_cols].sum().astype(np.int)
-        res['IDTP'] = (gt_id_count.sum() - res['IDFN']).astype(np.int)
+        # Calculate the total number of dets for each gt_id and tracker_id.
+        gt_id_count = np.bincount(np.concatenate(data['gt_ids']).astype(int),
+                                  minlength=data['num_gt_ids']).astype(np.float)
+        tracker_id_count = np.bincount(np.concatenate(data['tracker_ids']).astype(int),
+                                       minlength=data['num_tracker_ids']).astype(np.float)
+
+        # Calculate optimal assignment between ids and accumulate basic statistics
+        res = self._compute_id_assignment(res, pair_keys // data['num_tracker_ids'],
+                                          pair_keys % data['num_tracker_ids'], potential_matches_count,
+                                          gt_id_count, tracker_id_count)
 
         # Calculate final ID scores
         res = self._compute_final_fields(res)
         return res
 
+    def get_frame_stats(self, data):
+        """Per-timestep ID statistics of one sequence, used by eval_window() to score any window of timesteps"""
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        tracker_ids, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+
+        # Pairs of ids which are potential matches in each timestep
+        match_gt_ids = []
+        match_tracker_ids = []
+        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+            matches_mask = np.greater_equal(_sparse.to_dense(data['similarity_scores'][t]), self.threshold)
+            match_idx_gt, match_idx_tracker = np.nonzero(matches_mask)
+            match_gt_ids.append(gt_ids_t[match_idx_gt])
+            match_tracker_ids.append(tracker_ids_t[match_idx_tracker])
+
+        frame_stats = {'gt_ids': gt_ids, 'gt_offsets': gt_offsets,
+                       'tracker_ids': tracker_ids, 'tracker_offsets': tracker_offsets}
+        frame_stats['match_gt_ids'], frame_stats['match_offsets'] = self._concat_timesteps(match_gt_ids)
+        frame_stats['match_tracker_ids'], _ = self._concat_timesteps(match_tracker_ids)
+        return frame_stats
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Calculates ID metrics for timesteps [t_start, t_end) of a sequence from its get_frame_stats().
+        This is exact: the potential matches and det counts of the window are summed over its timesteps, and the
+        optimal id assignment is then found for the window only, so results are identical to eval_sequence().
+        """
+        # Initialise results
+        res = {}
+        for field in self.fields:
+            res[field] = 0
+
+        window_gt_ids, gt_id_count = self._window_ids(frame_stats['gt_ids'], frame_stats['gt_offsets'],
+                                                      t_start, t_end)
+        window_tracker_ids, tracker_id_count = self._window_ids(frame_stats['tracker_ids'],
+                                                                frame_stats['tracker_offsets'], t_start, t_end)
+
+        # Return result quickly if tracker or gt window is empty
+        if len(window_tracker_ids) == 0:
+            res['IDFN'] = np.sum(gt_id_count)
+            return res
+        if len(window_gt_ids) == 0:
+            res['IDFP'] = np.sum(tracker_id_count)
+            return res
+
+        # Count the potential matches between the ids of the window
+        matches = slice(frame_stats['match_offsets'][t_start], frame_stats['match_offsets'][t_end])
+        pair_keys, potential_matches_count = _sparse.sum_by_pair(_sparse.pair_keys(
+            np.searchsorted(window_gt_ids, frame_stats['match_gt_ids'][matches]),
+            np.searchsorted(window_tracker_ids, frame_stats['match_tracker_ids'][matches]), len(window_tracker_ids)))
+
+        # Calculate optimal assignment between ids and accumulate basic statistics
+        res = self._compute_id_assignment(res, pair_keys // len(window_tracker_ids),
+                                          pair_keys % len(window_tracker_ids), potential_matches_count,
+                                          gt_id_count.astype(np.float), tracker_id_count.astype(np.float))
+
+        # Calculate final ID scores
+        res = self._compute_final_fields(res)
+        return res
+
+    @staticmethod
+    def _compute_id_assignment(res, pair_gt_ids, pair_tracker_ids, potential_matches_count, gt_id_count,
+                               tracker_id_count):
+        """Finds the optimal one-to-one assignment between gt and tracker ids (where ids may also be unassigned) and
+        calculates IDTP, IDFN and IDFP from it. Potential matches are given for the pairs of ids which have any (with
+        their gt_ids and tracker_ids sorted as by _sparse.sum_by_pair()).
+
+        Assigning a gt_id to a tracker_id costs gt_id_count + tracker_id_count - 2 * potential_matches_count (IDFN +
+        IDFP), and leaving both unassigned costs gt_id_count + tracker_id_count. The optimal assignment (of the full
+        block cost matrix of real and dummy 'unassigned' ids) therefore maximises the total number of potential matches
+        of the assigned pairs, which is IDTP. Only pairs with potential matches can improve on leaving ids unassigned,
+        so this is solved over these pairs only, decomposed into their independent connected components.
+        """
+        matches = _matching.match_pairs(pair_gt_ids, pair_tracker_ids, potential_matches_count)
+
+        # Accumulate basic statistics
+        res['IDTP'] = potential_matches_count[matches].sum().astype(np.int)
+        res['IDFN'] = (gt_id_count.sum() - res['IDTP']).astype(np.int)
+        res['IDFP'] = (tracker_id_count.sum() - res['IDTP']).astype(np.int)
+        return res
+
     def combine_classes_class_averaged(self, all_res, ignore_empty_classes=False):
         """Combines metrics across all classes by averaging over the class values.
         If 'ignore_empty_classes' is True, then it only sums over classes with at least one gt or predicted detection.
@@ -1,7 +1,10 @@
 import numpy as np
+from scipy import sparse
 from scipy.optimize import linear_sum_assignment
 from ._base_metric import _BaseMetric
 from .. import _timing
+from .. import _sparse
+from .. import _matching
 
 
 class VACE(_BaseMetric):
@@ -26,6 +29,7 @@ class VACE(_BaseMetric):
         self._additive_fields = self.integer_fields + ['STDA', 'FDA']
 
         self.threshold = 0.5
+        self.exact_window_eval = True
 
     @_timing.time
     def eval_sequence(self, data):
@@ -41,31 +45,26 @@ class VACE(_BaseMetric):
         res = {}
 
         # Obtain Average Tracking Accuracy (ATA) using track correspondence.
-        # Obtain counts necessary to compute temporal IOU.
+        # Obtain counts necessary to compute temporal IOU, only for the pairs of tracks which satisfy the overlap
+        # criterion in some frame (the temporal IOU of any other pair is zero).
         # Assume that integer counts can be represented exactly as floats.
-        potential_matches_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
-        gt_id_count = np.zeros(data['num_gt_ids'])
-        tracker_id_count = np.zeros(data['num_tracker_ids'])
-        both_present_count = np.zeros((data['num_gt_ids'], data['num_tracker_ids']))
+        match_keys = []
         for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
             # Count the number of frames in which two tracks satisfy the overlap criterion.
-            matches_mask = np.greater_equal(data['similarity_scores'][t], self.threshold)
+            matches_mask = np.greater_equal(_sparse.to_dense(data['similarity_scores'][t]), self.threshold)
             match_idx_gt, match_idx_tracker = np.nonzero(matches_mask)
-            potential_matches_count[gt_ids_t[match_idx_gt], tracker_ids_t[match_idx_tracker]] += 1
-            # Count the number of frames in which the tracks are present.
-            gt_id_count[gt_ids_t] += 1
-            tracker_id_count[tracker_ids_t] += 1
-            both_present_count[gt_ids_t[:, np.newaxis], tracker_ids_t[np.newaxis, :]] += 1
-        # Number of frames in which either track is present (union of the two sets of frames).
-        union_count = (gt_id_count[:, np.newaxis]
-                       + tracker_id_count[np.newaxis, :]
-                       - both_present_count)
-        # The denominator should always be non-zero if all tracks are non-empty.
-        with np.errstate(divide='raise', invalid='raise'):
-            temporal_iou = potential_matches_count / union_count
-        # Find assignment that maximizes temporal IOU.
-        match_rows, match_cols = linear_sum_assignment(-temporal_iou)
-        res['STDA'] = temporal_iou[match_rows, match_cols].sum()
+            match_keys.append(_sparse.pair_keys(gt_ids_t[match_idx_gt], tracker_ids_t[match_idx_tracker],
+                                                data['num_tracker_ids']))
+        pair_keys, potential_matches_count = _sparse.sum_by_pair(np.concatenate(match_keys))
+        # Count the number of frames in which the tracks are present.
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        tracker_ids, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+        gt_id_count = np.bincount(gt_ids, minlength=data['num_gt_ids']).astype(np.float)
+        tracker_id_count = np.bincount(tracker_ids, minlength=data['num_tracker_ids']).astype(np.float)
+        both_present_count = self._both_present_count(gt_ids, gt_offsets, tracker_ids, tracker_offsets,
+                                                      data['num_gt_ids'], data['num_tracker_ids'], pair_keys)
+        res['STDA'] = self._compute_stda(pair_keys // data['num_tracker_ids'], pair_keys % data['num_tracker_ids'],
+                                         potential_matches_count, gt_id_count, tracker_id_count, both_present_count)
         res['VACE_IDs'] = data['num_tracker_ids']
         res['VACE_GT_IDs'] = data['num_gt_ids']
 
@@ -82,16 +81,136 @@ class VACE(_BaseMetric):
             if not (n_g and n_d):
                 continue
             # n_g > 0 and n_d > 0
-            spatial_overlap = data['similarity_scores'][t]
-            match_rows, match_cols = linear_sum_assignment(-spatial_overlap)
-            overlap_ratio = spatial_overlap[match_rows, match_cols].sum()
-            fda += overlap_ratio / (0.5 * (n_g + n_d))
+            fda += self._compute_timestep_fda(_sparse.to_dense(data['similarity_scores'][t]))
         res['FDA'] = fda
         res['num_non_empty_timesteps'] = non_empty_count
 
         res.update(self._compute_final_fields(res))
         return res
 
+    def get_frame_stats(self, data):
+        """Per-timestep VACE statistics of one sequence, used by eval_window() to score any window of timesteps"""
+        gt_ids, gt_offsets = self._concat_timesteps(data['gt_ids'])
+        tracker_ids, tracker_offsets = self._concat_timesteps(data['tracker_ids'])
+
+        # Pairs of ids satisfying the overlap criterion, and the FDA, of each timestep
+        match_gt_ids = []
+        match_tracker_ids = []
+        fda = np.zeros(data['num_timesteps'])
+        for t, (gt_ids_t, tracker_ids_t) in enumerate(zip(data['gt_ids'], data['tracker_ids'])):
+            matches_mask = np.greater_equal(_sparse.to_dense(data['similarity_scores'][t]), self.threshold)
+            match_idx_gt, match_idx_tracker = np.nonzero(matches_mask)
+            match_gt_ids.append(gt_ids_t[match_idx_gt])
+            match_tracker_ids.append(tracker_ids_t[match_idx_tracker])
+            if len(gt_ids_t) and len(tracker_ids_t):
+                fda[t] = self._compute_timestep_fda(_sparse.to_dense(data['similarity_scores'][t]))
+
+        frame_stats = {'gt_ids': gt_ids, 'gt_offsets': gt_offsets,
+                       'tracker_ids': tracker_ids, 'tracker_offsets': tracker_offsets, 'FDA': fda,
+                       'num_non_empty_timesteps': self._prefix_sum((np.diff(gt_offsets) + np.diff(tracker_offsets)) > 0)}
+        frame_stats['match_gt_ids'], frame_stats['match_offsets'] = self._concat_timesteps(match_gt_ids)
+        frame_stats['match_tracker_ids'], _ = self._concat_timesteps(match_tracker_ids)
+        return frame_stats
+
+    def eval_window(self, frame_stats, t_start, t_end):
+        """Calculates VACE metrics for timesteps [t_start, t_end) of a sequence from its get_frame_stats().
+        This is exact: the temporal overlaps of the ids of the window are counted over its timesteps, and the optimal
+        track correspondence is then found for the window only, so results are identical to eval_sequence().
+        """
+        res = {}
+        gt_offsets = frame_stats['gt_offsets']
+        tracker_offsets = frame_stats['tracker_offsets']
+        window_gt_ids, gt_id_count = self._window_ids(frame_stats['gt_ids'], gt_offsets, t_start, t_end)
+        window_tracker_ids, tracker_id_count = self._window_ids(frame_stats['tracker_ids'], tracker_offsets,
+                                                                t_start, t_end)
+
+        # Count the number of frames in which two tracks satisfy the overlap criterion.
+        num_window_tracker_ids = len(window_tracker_ids)
+        matches = slice(frame_stats['match_offsets'][t_start], frame_stats['match_offsets'][t_end])
+        pair_keys, potential_matches_count = _sparse.sum_by_pair(_sparse.pair_keys(
+            np.searchsorted(window_gt_ids, frame_stats['match_gt_ids'][matches]),
+            np.searchsorted(window_tracker_ids, frame_stats['match_tracker_ids'][matches]), num_window_tracker_ids))
+
+        # Count the number of frames in which both tracks are present.
+        gt_dets = slice(gt_offsets[t_start], gt_offsets[t_end])
+        tracker_dets = slice(tracker_offsets[t_start], tracker_offsets[t_end])
+        both_present_count = self._both_present_count(
+            np.searchsorted(window_gt_ids, frame_stats['gt_ids'][gt_dets]), gt_offsets[t_start:t_end + 1],
+            np.searchsorted(window_tracker_ids, frame_stats['tracker_ids'][tracker_dets]),
+            tracker_offsets[t_start:t_end + 1], len(window_gt_ids), num_window_tracker_ids, pair_keys)
+
+        res['STDA'] = self._compute_stda(pair_keys // num_window_tracker_ids, pair_keys % num_window_tracker_ids,
+                                         potential_matches_count, gt_id_count.astype(np.float),
+                                         tracker_id_count.astype(np.float), both_present_count)
+        res['VACE_IDs'] = len(window_tracker_ids)
+        res['VACE_GT_IDs'] = len(window_gt_ids)
+
+        # Obtain Frame Detection Accuracy (FDA) by summing the per-frame correspondences of the window.
+        res['FDA'] = self._window_sum(frame_stats['FDA'], t_start, t_end)
+        res['num_non_empty_timesteps'] = (frame_stats['num_non_empty_timesteps'][t_end]
+                                          - frame_stats['num_non_empty_timesteps'][t_start])
+
+        res.update(self._compute_final_fields(res))
+        return res
+
+    @staticmethod
+    def _both_present_count(gt_ids, gt_offsets, tracker_ids, tracker_offsets, num_gt_ids, num_tracker_ids,
+                            pair_keys):
+        """Counts the number of timesteps in which both tracks of each pair (given by its key) are present, from the
+        concatenated ids of consecutive timesteps and their offsets (see _concat_timesteps()). These are the product of
+        the sparse per-timestep presence of the gt and tracker ids, which has one entry per co-occurring pair of ids.
+        """
+        num_timesteps = len(gt_offsets) - 1
+        gt_present = sparse.csr_matrix(
+            (np.ones(len(gt_ids)), (np.repeat(np.arange(num_timesteps), np.diff(gt_offsets)), gt_ids)),
+            shape=(num_timesteps, num_gt_ids))
+        tracker_present = sparse.csr_matrix(
+            (np.ones(len(tracker_ids)), (np.repeat(np.arange(num_timesteps), np.diff(tracker_offsets)), tracker_ids)),
+            shape=(num_timesteps, num_tracker_ids))
+        both_present = (gt_present.T @ tracker_present).tocoo()
+        both_present_keys = _sparse.pair_keys(both_present.row, both_present.col, num_tracker_ids)
+        order = np.argsort(both_present_keys)
+        return _sparse.lookup_pairs(both_present_keys[order], both_present.data[order], pair_keys)
+
+    @staticmethod
+    def _compute_stda(pair_gt_ids, pair_tracker_ids, potential_matches_count, gt_id_count, tracker_id_count,
+                      both_present_count):
+        """Calculates the Sequence Track Detection Accuracy (STDA) from the temporal overlap of the pairs of tracks
+        which satisfy the overlap criterion in some frame (sorted as by _sparse.sum_by_pair()). All other pairs have no
+        temporal overlap, so the assignment is only solved over the tracks of these pairs if there are at least as many
+        tracker as gt tracks (the usual case). The STDA is identical to solving it over all pairs of tracks.
+        """
+        # Number of frames in which either track is present (union of the two sets of frames).
+        union_count = (gt_id_count[pair_gt_ids]
+                       + tracker_id_count[pair_tracker_ids]
+                       - both_present_count)
+        # The denominator should always be non-zero if all tracks are non-empty.
+        with np.errstate(divide='raise', invalid='raise'):
+            temporal_iou = potential_matches_count / union_count
+        # Find assignment that maximizes temporal IOU.
+        if len(gt_id_count) > len(tracker_id_count):
+            # Only some gt tracks are assigned, and the temporal IOUs are summed in the order of the assigned gt tracks,
+            # which include the tracks the solver assigns without any overlap. The sum therefore depends on the
+            # assignment over all pairs of tracks, which is solved as such (the matrix is smaller than
+            # num_gt_ids ** 2, as there are fewer tracker tracks).
+            all_temporal_iou = np.zeros((len(gt_id_count), len(tracker_id_count)))
+            all_temporal_iou[pair_gt_ids, pair_tracker_ids] = temporal_iou
+            match_rows, match_cols = linear_sum_assignment(-all_temporal_iou)
+            return all_temporal_iou[match_rows, match_cols].sum()
+        matches = _matching.match_pairs(pair_gt_ids, pair_tracker_ids, temporal_iou)
+        # Every gt track is assigned, so the temporal IOUs of all gt tracks are summed in order (zero if the track is
+        # not matched), as when assigning over all pairs of tracks.
+        scores = np.zeros(len(gt_id_count))
+        scores[pair_gt_ids[matches]] = temporal_iou[matches]
+        return scores.sum()
+
+    @staticmethod
+    def _compute_timestep_fda(spatial_overlap):
+        """Calculates the Frame Detection Accuracy (FDA) of a timestep with both gt and tracker dets"""
+        n_g, n_d = spatial_overlap.shape
+        overlap_ratio = _matching.assignment_sum(spatial_overlap)
+        return overlap_ratio / (0.5 * (n_g + n_d))
+
     def combine_classes_class_averaged(self, all_res, ignore_empty_classes=True):
         """Combines metrics across all classes by averaging over the class values.
         If 'ignore_empty_classes' is True, then it only sums over classes with at least one gt or predicted detection.
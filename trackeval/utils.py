@@ -1,7 +1,9 @@
 
 import os
 import csv
+import sys
 import argparse
+import threading
 from collections import OrderedDict
 
 
@@ -141,6 +143,80 @@ def load_detail(file):
     return data
 
 
+class LRUCache:
+    """ Least recently used cache with a memory budget, which can be shared between threads.
+    Values are stored without copying them, so they must not be modified once they are in the cache. When the total
+    size of the cached values exceeds max_bytes, the least recently used values are evicted. Values larger than the
+    whole budget are never cached (so a budget of 0 disables the cache).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._items = OrderedDict()  # key: (value, num_bytes), from least to most recently used
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Returns the value cached for key (marking it as most recently used), or default if it is not cached"""
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value, num_bytes=None):
+        """Caches value for key, evicting the least recently used values if needed. The size of the value is estimated
+        with get_num_bytes() unless num_bytes is given."""
+        if num_bytes is None:
+            num_bytes = get_num_bytes(value)
+        with self._lock:
+            if key in self._items:
+                self.num_bytes -= self._items.pop(key)[1]
+            if num_bytes > self.max_bytes:
+                return
+            self._items[key] = (value, num_bytes)
+            self.num_bytes += num_bytes
+            self._evict()
+
+    def resize(self, max_bytes):
+        """Changes the memory budget, evicting the least recently used values if it is exceeded"""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def clear(self):
+        """Removes all cached values"""
+        with self._lock:
+            self._items.clear()
+            self.num_bytes = 0
+
+    def _evict(self):
+        while self.num_bytes > self.max_bytes:
+            _, (_, num_bytes) = self._items.popitem(last=False)
+            self.num_bytes -= num_bytes
+
+
+def get_num_bytes(value):
+    """Estimates the memory used by a value: the data of numpy arrays and scipy sparse matrices (also within dicts,
+    lists and tuples), and the size of any other object."""
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(get_num_bytes(k) + get_num_bytes(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(get_num_bytes(v) for v in value)
+    if hasattr(value, 'nbytes'):
+        return value.nbytes
+    if hasattr(value, 'indptr'):
+        # scipy sparse (csr or csc) matrix
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return sys.getsizeof(value)
+
+
 class TrackEvalException(Exception):
     """Custom exception for catching expected errors."""
     ...
@@ -0,0 +1,295 @@
+'''
+This file contains the ingestion of uploaded model outcomes. Uploads are read once, chunk by chunk: each chunk is
+hashed, written to disk and parsed into the rows format used by the evaluator (a float array of file rows sorted by
+frame, see trackeval.datasets.mot_rows), which is validated on the way. Valid uploads are stored under the hash of their
+content, so sessions uploading the same file share it. The upload folder is pruned from the least recently used files
+once it exceeds UPLOAD_FOLDER_MAX_BYTES.
+'''
+import os
+import time
+import hashlib
+import zipfile
+import threading
+import configparser
+import numpy as np
+from trackeval.datasets import mot_rows
+from trackeval.utils import LRUCache, TrackEvalException
+
+GT_FOLDER = 'data/gt/mot_challenge/MOT16-train'
+UPLOAD_FOLDER = 'uploads'
+UPLOAD_FOLDER_MAX_BYTES = 10 * 1024 ** 3
+# Uploads used more recently than this (in seconds) are never pruned, as they may still be read by an evaluation
+UPLOAD_MIN_AGE = 3600
+CHUNK_SIZE = 4 * 1024 ** 2
+MIN_COLUMNS = 7  # frame, id, x, y, w, h, confidence
+
+# Ingested uploads ((file, rows) or (file, seqs) for zips, or the error of an invalid upload), keyed by the id of the
+# upload and the sequence, so that the reruns of a session do not read the same upload again
+ingested_uploads = LRUCache(max_bytes=1024 ** 3)
+
+
+def get_seq_length(video_sequence):
+    """Number of frames of a sequence, as given by its seqinfo.ini"""
+    ini_file = os.path.join(GT_FOLDER, video_sequence, 'seqinfo.ini')
+    if not os.path.isfile(ini_file):
+        raise TrackEvalException('ini file does not exist: ' + video_sequence + '/' + os.path.basename(ini_file))
+    ini_data = configparser.ConfigParser()
+    ini_data.read(ini_file)
+    return int(ini_data['Sequence']['seqLength'])
+
+
+def ingest_upload(my_upload, video_sequence):
+    """
+    Parse and validate an uploaded model outcome of a sequence, and store it under the hash of its content
+    Args:
+        my_upload (UploadedFile): The uploaded txt file
+        video_sequence (str): The sequence of the model outcome (e.g. 'MOT16-02')
+    Returns:
+        file (str): The path of the stored upload
+        rows (np.ndarray): The rows of the upload sorted by frame, which can be given to the evaluator (TRACKER_ROWS)
+    Raises:
+        TrackEvalException: If the upload is not a valid model outcome for the sequence
+    """
+    return _ingest(my_upload, video_sequence, lambda: _ingest_txt(my_upload, video_sequence))
+
+
+def ingest_zip_upload(my_upload, seq_list):
+    """
+    Store an uploaded zip of model outcomes (a seq.txt file per sequence, in any folder of the zip) under the hash of
+    its content. The zip is read directly by the evaluator, so it is neither extracted nor parsed here.
+    Args:
+        my_upload (UploadedFile): The uploaded zip file
+        seq_list (list): The sequences which may be in the zip
+    Returns:
+        file (str): The path of the stored zip
+        seqs (list): The sequences of seq_list which have a model outcome in the zip
+    Raises:
+        TrackEvalException: If the upload is not a zip file or has no model outcome for any sequence
+    """
+    return _ingest(my_upload, tuple(seq_list), lambda: _ingest_zip(my_upload, seq_list))
+
+
+def _ingest(my_upload, key, ingest):
+    """Ingest an upload, unless it has been ingested (for the same key) before and its file has not been pruned"""
+    cache_key = (my_upload.id, key)
+    result = ingested_uploads.get(cache_key)
+    if result is None or (not isinstance(result, TrackEvalException) and not _touch(result[0])):
+        try:
+            result = ingest()
+        except TrackEvalException as err:
+            result = err
+        ingested_uploads.put(cache_key, result)
+        if not isinstance(result, TrackEvalException):
+            _prune_upload_folder(keep=result[0])
+    if isinstance(result, TrackEvalException):
+        raise result
+    return result
+
+
+def _ingest_txt(my_upload, video_sequence):
+    seq_length = get_seq_length(video_sequence)
+    with _UploadWriter(my_upload) as writer:
+        chunks = writer.chunks()
+        rows = _parse_upload(chunks, video_sequence, seq_length)
+        # The parse stops early at the first chunk which is not comma separated, write the rest of the upload
+        for _ in chunks:
+            pass
+        if rows is None:
+            # Not comma separated, parse the written file row by row (as the evaluator does for such files)
+            try:
+                rows = mot_rows.read_rows(writer.tmp_file)
+            except (ValueError, TrackEvalException):
+                # (the error of the reader names the temporary file, not the upload)
+                raise TrackEvalException(
+                    'Cannot read the uploaded data for sequence %s. Is data corrupted?' % video_sequence) from None
+            _check_rows(rows, video_sequence, seq_length)
+            _check_duplicates(rows, video_sequence)
+        if len(rows) == 0:
+            raise TrackEvalException('The uploaded data for sequence %s has no rows.' % video_sequence)
+        file = writer.store(f'{video_sequence}_{writer.hexdigest()}.txt')
+    # Rows are shared by every rerun of the session, so they must never be modified in place.
+    rows.flags.writeable = False
+    return file, rows
+
+
+def _ingest_zip(my_upload, seq_list):
+    with _UploadWriter(my_upload) as writer:
+        for _ in writer.chunks(split_lines=False):
+            pass
+        try:
+            with zipfile.ZipFile(writer.tmp_file, 'r') as archive:
+                names = archive.namelist()
+        except zipfile.BadZipFile:
+            raise TrackEvalException('The uploaded file is not a valid zip file.')
+        found = {os.path.splitext(os.path.basename(name))[0] for name in names if name.endswith('.txt')}
+        seqs = [seq for seq in seq_list if seq in found]
+        if len(seqs) == 0:
+            raise TrackEvalException('The uploaded zip has no model outcome for any sequence (' + ', '.join(seq_list) +
+                                     '), expected files like ' + seq_list[0] + '.txt')
+        file = writer.store(f'{writer.hexdigest()}.zip')
+    return file, seqs
+
+
+def _iter_chunks(my_upload, split_lines=False):
+    """Read an upload in chunks of about CHUNK_SIZE bytes, which end at a line end if split_lines"""
+    my_upload.seek(0)
+    remainder = b''
+    while True:
+        chunk = my_upload.read(CHUNK_SIZE)
+        if not split_lines:
+            if not chunk:
+                return
+            yield chunk
+            continue
+        if not chunk:
+            if remainder:
+                yield remainder
+            return
+        chunk = remainder + chunk
+        line_end = chunk.rfind(b'\n') + 1
+        remainder = chunk[line_end:]
+        if line_end > 0:
+            yield chunk[:line_end]
+
+
+class _UploadWriter:
+    """ Writes an upload to a temporary file of the upload folder while it is read, hashing its content on the way.
+    Once the whole upload has been read (and validated), store() moves the file to its final name, so that a partially
+    written or invalid upload is never used. The temporary file is removed on exit otherwise."""
+
+    def __init__(self, my_upload):
+        self.my_upload = my_upload
+        os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+        self.tmp_file = os.path.join(UPLOAD_FOLDER, '%i.%i.tmp' % (os.getpid(), threading.get_ident()))
+        self._sha = hashlib.sha1()
+        self._fp = None
+
+    def __enter__(self):
+        self._fp = open(self.tmp_file, 'wb')
+        return self
+
+    def __exit__(self, *exc_info):
+        self._fp.close()
+        if os.path.isfile(self.tmp_file):
+            os.remove(self.tmp_file)
+
+    def chunks(self, split_lines=True):
+        """Read the upload in chunks (ending at a line end if split_lines), which are written and hashed before they
+        are yielded"""
+        for chunk in _iter_chunks(self.my_upload, split_lines=split_lines):
+            self._fp.write(chunk)
+            self._sha.update(chunk)
+            yield chunk
+        self._fp.flush()
+
+    def hexdigest(self):
+        return self._sha.hexdigest()
+
+    def store(self, name):
+        """Move the written upload to name in the upload folder, returning its path"""
+        self._fp.close()
+        file = os.path.join(UPLOAD_FOLDER, name)
+        os.replace(self.tmp_file, file)
+        return file
+
+
+def _touch(file):
+    """Mark a stored upload as recently used for _prune_upload_folder(), returning False if it has been pruned"""
+    try:
+        os.utime(file)
+    except OSError:
+        return False
+    return True
+
+
+def _prune_upload_folder(keep):
+    """Removes the least recently used (stored or ingested) uploads until they take at most UPLOAD_FOLDER_MAX_BYTES.
+    The keep file and uploads used within UPLOAD_MIN_AGE are never removed."""
+    try:
+        upload_files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                        for entry in os.scandir(UPLOAD_FOLDER) if entry.is_file() and not entry.name.endswith('.tmp')]
+    except OSError:
+        return
+    min_mtime = time.time() - UPLOAD_MIN_AGE
+    num_bytes = 0
+    for mtime, size, upload_file in sorted(upload_files, reverse=True):
+        num_bytes += size
+        if num_bytes > UPLOAD_FOLDER_MAX_BYTES and mtime < min_mtime and upload_file != keep:
+            try:
+                os.remove(upload_file)
+            except OSError:
+                pass
+
+
+def _parse_upload(chunks, video_sequence, seq_length):
+    """
+    Parse and validate an upload chunk by chunk (chunks ending at a line end). Returns the rows sorted by frame, or
+    None if the upload is not in the usual comma separated format. Duplicate ids are checked per chunk as long as the
+    frames are in order (only the rows of the last frame of a chunk need to be carried over to the next one), and once
+    at the end otherwise.
+    """
+    chunk_rows = []
+    frame_rows = None  # rows of the last frame read so far, while frames are in order
+    is_sorted = True
+    for chunk in chunks:
+        rows = mot_rows.parse_rows(chunk)
+        if rows is None:
+            return None
+        if len(rows) == 0:
+            continue
+        if len(chunk_rows) > 0 and rows.shape[1] != chunk_rows[0].shape[1]:
+            raise TrackEvalException('The uploaded data for sequence %s has an inconsistent number of columns.'
+                                     % video_sequence)
+        _check_rows(rows, video_sequence, seq_length)
+        frames = rows[:, 0]
+        if is_sorted:
+            is_sorted = np.all(frames[1:] >= frames[:-1]) and (frame_rows is None or frames[0] >= frame_rows[0, 0])
+        if is_sorted:
+            if frame_rows is not None:
+                rows_to_check = np.concatenate((frame_rows, rows[frames == frame_rows[0, 0]]))
+                _check_duplicates(rows_to_check, video_sequence)
+            _check_duplicates(rows, video_sequence)
+            frame_rows = rows[frames == frames[-1]]
+        chunk_rows.append(rows)
+
+    if len(chunk_rows) == 0:
+        return np.empty((0, 0))
+    rows = np.concatenate(chunk_rows)
+    if not is_sorted:
+        rows = mot_rows.sort_rows(rows)
+        _check_duplicates(rows, video_sequence)
+    return rows
+
+
+def _check_rows(rows, video_sequence, seq_length):
+    """Check the number of columns and that all frames are within the sequence"""
+    if len(rows) == 0:
+        return
+    if rows.shape[1] < MIN_COLUMNS:
+        raise TrackEvalException(
+            'The uploaded data for sequence %s has %i columns, but at least %i are needed (frame, id, x, y, w, h, '
+            'confidence).' % (video_sequence, rows.shape[1], MIN_COLUMNS))
+    frames = rows[:, 0]
+    invalid_frames = np.unique(frames[(frames < 1) | (frames > seq_length) | (frames != np.floor(frames))])
+    if len(invalid_frames) > 0:
+        raise TrackEvalException(
+            'The uploaded data contains the following invalid frames for sequence %s with %i frames: ' % (
+                video_sequence, seq_length) + ', '.join(['%g' % frame for frame in invalid_frames[:10]]))
+
+
+def _check_duplicates(rows, video_sequence):
+    """Check that no id occurs more than once in a frame"""
+    if len(rows) < 2:
+        return
+    frames = rows[:, 0]
+    ids = rows[:, 1]
+    order = np.lexsort((ids, frames))
+    frames = frames[order]
+    ids = ids[order]
+    is_duplicate = (frames[1:] == frames[:-1]) & (ids[1:] == ids[:-1])
+    if np.any(is_duplicate):
+        frame = frames[1:][is_duplicate][0]
+        duplicate_ids = np.unique(ids[1:][is_duplicate & (frames[1:] == frame)])
+        raise TrackEvalException(
+            'Tracker predicts the same ID more than once in a single timestep (seq: %s, frame: %i, ids: %s)' % (
+                video_sequence, frame, ' '.join(['%g' % i for i in duplicate_ids])))